@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Prompt
+from django.db.models import Q
+
+from .models import LLMUsage, Prompt
+from .search import build_search_query
 
 
 
@@ -19,6 +22,19 @@ class PromptAdmin(admin.ModelAdmin):
 
     prompt_text_preview.short_description = "Текст промпту"
 
+    def get_search_results(self, request, queryset, search_term):
+        # Пошук за тим самим GIN індексом, що й у бібліотеці, замість LIKE
+        # по всій таблиці; нікнейм автора порівнюється точно
+        query = build_search_query(search_term)
+        if query is None:
+            return queryset, False
+        return (
+            queryset.filter(
+                Q(search_vector=query) | Q(user__nickname=search_term.strip())
+            ),
+            False,
+        )
+
     def improvement_hint_preview(self, obj):
         return (
             obj.improvement_hint[:40] + "..."
@@ -27,3 +43,21 @@ class PromptAdmin(admin.ModelAdmin):
         )
 
     improvement_hint_preview.short_description = "Підказка"
+
+
+@admin.register(LLMUsage)
+class LLMUsageAdmin(admin.ModelAdmin):
+    list_display = (
+        "date",
+        "user",
+        "model",
+        "requests",
+        "prompt_tokens",
+        "completion_tokens",
+        "cost",
+    )
+    list_filter = ("date", "model")
+    search_fields = ("user__nickname", "user__email")
+    date_hierarchy = "date"
+    ordering = ("-date", "-cost")
+    readonly_fields = list_display
@@ -1,7 +1,28 @@
-from openai import OpenAI
-import re
-from decouple import config
+import asyncio
+import hashlib
 import logging
+import re
+import time
+from collections.abc import Callable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .evaluation_cache import (
+    cache_evaluation,
+    evaluation_cache_key,
+    get_cached_evaluation,
+)
+from .evaluators import MAX_COMPLETION_TOKENS, TokenUsage, get_evaluator
+from .metrics import EvaluationUsage, record_evaluation
+from .rate_limiter import Priority, llm_rate_limiter
+from .resilience import (
+    CircuitOpenError,
+    DeadlineExceeded,
+    llm_circuit_breaker,
+    llm_hedged_caller,
+)
+from .single_flight import asingle_flight, single_flight
 
 logger = logging.getLogger(__name__)
 
@@ -27,15 +48,18 @@ Adhere to the following strict guidelines for every response:
     - If you cannot evaluate, return [5.0]/10 (Could not parse the score.)
     - If you cannot optimize, return Refined: "[repeat the input prompt, unchanged]"."""
 
+# Версія системного промпта змінюється разом з його текстом
+SYSTEM_PROMPT_VERSION = hashlib.sha256(SYSTEM_PROMPT.encode()).hexdigest()[:12]
 
-def get_client() -> OpenAI:
-    api_key = config("PERPLEXITY_API_KEY")
-    if not api_key:
-        raise RuntimeError("PERPLEXITY_API_KEY is not set")
-    return OpenAI(
-        api_key=api_key,
-        base_url="https://api.perplexity.ai",
-    )
+PARSE_FAILED_HINT = "Не вдалося розібрати оцінку."
+EVALUATION_FAILED_HINT = "Помилка при оцінці промпта."
+DEGRADED_HINT = "Сервіс оцінювання тимчасово недоступний, оцінка орієнтовна."
+
+SCORE_RE = re.compile(r"\[(\d+(?:\.\d+)?)\]/10\s*\((.*?)\)", re.DOTALL)
+REFINED_PREFIX_RE = re.compile(
+    r"^\s*(?:Refined prompt|Optimized prompt|Refined|Optimized|Оптимізований):\s*\"?",
+    re.IGNORECASE | re.MULTILINE,
+)
 
 
 def parse_score_and_refined(response_text: str) -> tuple[float, str, str]:
@@ -49,11 +73,9 @@ def parse_score_and_refined(response_text: str) -> tuple[float, str, str]:
     # Розбиває рядок типу [6.5]/10 (Непогано, але є зауваження) на
     # match.group(1) зі значенням '6.5' 
     # та match.group(2) зі значенням 'Непогано, але є зауваження'
-    score_match = re.search(
-        r"\[(\d+(?:\.\d+)?)\]/10\s*\((.*?)\)", first_line, re.DOTALL
-    )
+    score_match = SCORE_RE.search(first_line)
     if not score_match:
-        return 5.0, "Не вдалося розібрати оцінку.", response_text[:500]
+        return 5.0, PARSE_FAILED_HINT, response_text[:500]
 
     # Розпакування кортежу score_match в дві змінні
     score_str, advice = score_match.groups()
@@ -61,7 +83,7 @@ def parse_score_and_refined(response_text: str) -> tuple[float, str, str]:
         # Встановлення правильного діапазону від 1 до 10
         score = max(1.0, min(10.0, float(score_str)))
     except ValueError:
-        return 5.0, "Не вдалося розібрати оцінку.", response_text[:500]
+        return 5.0, PARSE_FAILED_HINT, response_text[:500]
     refined_text = ""
     for line in lines[1:]:
         line = line.strip()
@@ -83,27 +105,461 @@ def parse_score_and_refined(response_text: str) -> tuple[float, str, str]:
     return score, advice.strip(), refined_text[:500]
 
 
-def evaluate_prompt_quality(prompt_text: str) -> tuple[float, str, str]:
+class StreamingEvaluationParser:
+    """Розбирає відповідь моделі по частинах, поки вона генерується.
+
+    Повертає подію "score", щойно перший рядок можна розібрати, а далі
+    події "refined" з новими фрагментами покращеного промпта. Остаточний
+    результат все одно визначає parse_score_and_refined по всьому тексту.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.score_done = False
+        self.refined_start = None
+        self.refined_sent = 0
+
+    def feed(self, delta: str) -> list[dict]:
+        self.text += delta
+        events = []
+
+        if not self.score_done:
+            head = self.text.lstrip()
+            score_match = SCORE_RE.search(head.split("\n", 1)[0])
+            if score_match:
+                score_str, advice = score_match.groups()
+                events.append(
+                    {
+                        "kind": "score",
+                        "rate": max(1.0, min(10.0, float(score_str))),
+                        "improvement_hint": advice.strip()[:164],
+                    }
+                )
+                self.score_done = True
+            elif "\n" in head:
+                # Перший рядок завершений, але не у форматі оцінки
+                self.score_done = True
+
+        if self.score_done and self.refined_start is None:
+            refined_match = REFINED_PREFIX_RE.search(self.text)
+            # Чекаємо першого символу після префікса: лапка може прийти окремо
+            if refined_match and refined_match.end() < len(self.text):
+                self.refined_start = refined_match.end()
+
+        if self.refined_start is not None:
+            refined = self.text[self.refined_start :]
+            # Закривна лапка завершує покращений промпт; пробіли в кінці
+            # притримуємо до наступного фрагмента
+            quote_index = refined.find('"')
+            refined = refined[:quote_index] if quote_index != -1 else refined.rstrip()
+            refined = refined[:500]
+            if len(refined) > self.refined_sent:
+                events.append({"kind": "refined", "text": refined[self.refined_sent :]})
+                self.refined_sent = len(refined)
+
+        return events
+
+
+def build_messages(prompt_text: str) -> list[dict]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt_text},
+    ]
+
+
+def estimate_tokens(
+    messages: list[dict], max_tokens: int = MAX_COMPLETION_TOKENS
+) -> int:
+    # Грубо ~4 символи на токен плюс максимальна довжина відповіді
+    return sum(len(m["content"]) for m in messages) // 4 + max_tokens
+
+
+def finalize_result(ai_text: str) -> tuple[float, str, str]:
+    rate, improvement_hint, refined_prompt = parse_score_and_refined(ai_text)
+    improvement_hint = improvement_hint[:164]
+    refined_prompt = refined_prompt[:500]
+
+    return rate, improvement_hint, refined_prompt
+
+
+def acquire_rate_limit(messages: list[dict], priority: Priority) -> None:
+    if get_evaluator().rate_limited:
+        llm_rate_limiter.acquire(priority, estimate_tokens(messages))
+
+
+def guarded_call(fn):
+    """Пропускає виклик бекенда через circuit breaker і рахує його результат."""
+    if not llm_circuit_breaker.allow_request():
+        raise CircuitOpenError("LLM circuit breaker is open")
+    try:
+        result = fn()
+    except Exception:
+        llm_circuit_breaker.record_failure()
+        raise
+    llm_circuit_breaker.record_success()
+    return result
+
+
+def counted_call(usage, call):
+    """Викликає бекенд call(call_usage) з власним TokenUsage і додає його до
+    usage, коли виклик завершиться. Так два hedged виклики з різних потоків
+    не пишуть в один об'єкт, і кожен рахується як окремий запит."""
+    call_usage = TokenUsage(requests=1)
+    try:
+        return call(call_usage)
+    finally:
+        if usage is not None:
+            usage.add(call_usage)
+
+
+def request_evaluation(
+    prompt_text: str,
+    priority: Priority = Priority.TRAINER,
+    usage: TokenUsage | EvaluationUsage | None = None,
+) -> tuple[float, str, str]:
+    """Оцінює промпт налаштованим бекендом. Помилки бекенда не перехоплює."""
+    evaluator = get_evaluator()
+    messages = build_messages(prompt_text)
+    acquire_rate_limit(messages, priority)
+
+    def try_hedge():
+        # Другий запит теж має вкластися в ліміт провайдера, але без черги
+        return not evaluator.rate_limited or llm_rate_limiter.try_acquire(
+            priority, estimate_tokens(messages)
+        )
+
+    deadline = time.monotonic() + settings.LLM_CALL_DEADLINE
+    ai_text = guarded_call(
+        lambda: llm_hedged_caller.call(
+            lambda timeout: counted_call(
+                usage,
+                lambda call_usage: evaluator.complete(messages, timeout, call_usage),
+            ),
+            deadline,
+            try_hedge=try_hedge,
+        )
+    )
+
+    return finalize_result(ai_text)
+
+
+def request_streaming_evaluation(
+    prompt_text: str,
+    on_partial: Callable[[dict], None],
+    priority: Priority = Priority.TRAINER,
+    usage: TokenUsage | EvaluationUsage | None = None,
+) -> tuple[float, str, str]:
+    """Як request_evaluation, але передає частковий результат у on_partial.
+
+    Стрімінг не дублюється hedged запитом: дедлайн перевіряється між фрагментами.
+    """
+    messages = build_messages(prompt_text)
+    acquire_rate_limit(messages, priority)
+    parser = StreamingEvaluationParser()
+
+    def stream(call_usage):
+        deadline = time.monotonic() + settings.LLM_CALL_DEADLINE
+        for delta in get_evaluator().stream(
+            messages, settings.LLM_CALL_DEADLINE, call_usage
+        ):
+            for event in parser.feed(delta):
+                on_partial(event)
+            if time.monotonic() > deadline:
+                raise DeadlineExceeded("LLM stream exceeded deadline")
+
+    guarded_call(lambda: counted_call(usage, stream))
+
+    return finalize_result(parser.text)
+
+
+def degraded_result(prompt_text: str) -> tuple[float, str, str]:
+    logger.warning("LLM circuit breaker is open, returning degraded evaluation")
+    return 5.0, DEGRADED_HINT, prompt_text[:500]
+
+
+def emit_result(
+    result: tuple[float, str, str], on_partial: Callable[[dict], None]
+) -> None:
+    """Передає готовий результат у on_partial тими ж подіями, що й стрімінг."""
+    rate, improvement_hint, refined_prompt = result
+    on_partial({"kind": "score", "rate": rate, "improvement_hint": improvement_hint})
+    on_partial({"kind": "refined", "text": refined_prompt})
+
+
+def evaluation_outcome(result: tuple[float, str, str]) -> str:
+    return {
+        PARSE_FAILED_HINT: "parse_fallback",
+        EVALUATION_FAILED_HINT: "error",
+        DEGRADED_HINT: "degraded",
+    }.get(result[1], "ok")
+
+
+def current_evaluator_version() -> str:
+    """Модель і версія системного промпта, якими зараз оцінюються промпти."""
+    return f"{get_evaluator().model_name}:{SYSTEM_PROMPT_VERSION}"
+
+
+def evaluator_version_for(result: tuple[float, str, str]) -> str:
+    """Версія оцінювача для збереження разом з оцінкою. Орієнтовні та
+    невдалі оцінки версії не отримують, тож rescore_prompts їх переоцінить."""
+    if evaluation_outcome(result) != "ok":
+        return ""
+    return current_evaluator_version()
+
+
+def evaluate_prompt_quality(
+    prompt_text: str,
+    on_partial: Callable[[dict], None] | None = None,
+    priority: Priority = Priority.TRAINER,
+    user_id: int | None = None,
+) -> tuple[float, str, str]:
+    """Оцінює промпт. Якщо передано on_partial, відповідь моделі стрімиться.
+
+    priority визначає черговість запиту, коли ліміт провайдера вичерпано.
+    Затримка, токени та вартість записуються в метрики (на user_id).
+    """
+    started = time.monotonic()
+    usage = EvaluationUsage()
+    result, cache_status = _evaluate_prompt_quality(
+        prompt_text, on_partial, priority, usage
+    )
+    model_name = get_evaluator().model_name
+    record_evaluation(
+        model_name,
+        evaluation_outcome(result),
+        cache_status,
+        time.monotonic() - started,
+        usage.close(model_name, user_id),
+        user_id,
+    )
+    return result
+
+
+def _evaluate_prompt_quality(
+    prompt_text: str,
+    on_partial: Callable[[dict], None] | None,
+    priority: Priority,
+    usage: EvaluationUsage,
+) -> tuple[tuple[float, str, str], str]:
+    """Повертає результат оцінки та стан кешу: hit, miss або coalesced."""
+    # Оцінки різних бекендів кешуються окремо
+    model_name = get_evaluator().model_name
+    cached = get_cached_evaluation(prompt_text, model_name, SYSTEM_PROMPT_VERSION)
+    if cached is not None:
+        if on_partial:
+            emit_result(cached, on_partial)
+        return cached, "hit"
+
+    # Провайдер недоступний — відповідаємо одразу, не займаючи воркер
+    if llm_circuit_breaker.is_open():
+        return degraded_result(prompt_text), "miss"
+
+    def request():
+        if on_partial:
+            result = request_streaming_evaluation(
+                prompt_text, on_partial, priority, usage
+            )
+        else:
+            result = request_evaluation(prompt_text, priority, usage)
+
+        # Нерозібрану відповідь не кешуємо, щоб наступна спроба могла бути
+        # успішною. Кешуємо до зняття блокування single-flight, щоб наступні
+        # запити вже знайшли оцінку в кеші
+        if result[1] != PARSE_FAILED_HINT:
+            cache_evaluation(prompt_text, model_name, SYSTEM_PROMPT_VERSION, result)
+        return result
+
     try:
-        client = get_client()
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": prompt_text},
-        ]
-        response = client.chat.completions.create(
-            model="sonar-pro",
-            messages=messages,
-            temperature=0.5,
-            max_tokens=500,
+        if not settings.EVALUATION_SINGLE_FLIGHT:
+            return request(), "miss"
+
+        # Однакові промпти, що оцінюються одночасно, чекають на один запит
+        result, shared = single_flight(
+            evaluation_cache_key(prompt_text, model_name, SYSTEM_PROMPT_VERSION),
+            request,
+            timeout=settings.EVALUATION_SINGLE_FLIGHT_TIMEOUT,
         )
-        ai_text = response.choices[0].message.content
+    except CircuitOpenError:
+        return degraded_result(prompt_text), "miss"
+    except Exception:
+        logger.exception("Prompt evaluation failed")
+        return (5.0, EVALUATION_FAILED_HINT, prompt_text[:500]), "miss"
+
+    if shared:
+        if on_partial:
+            emit_result(result, on_partial)
+        return result, "coalesced"
+    return result, "miss"
+
+
+# Async-шлях для ASGI (Daphne): виклики LLM не займають потік на весь час
+# очікування, тож один процес тримає сотні оцінок одночасно. on_partial тут —
+# async-функція. Звернення лише до кешу (breaker, кеш оцінок, ліміт) йдуть
+# через sync_to_async(thread_sensitive=False): спільний потік лишається для
+# ORM, зокрема запису метрик.
+
+
+async def aguarded_call(fn):
+    """Async-версія guarded_call: fn — async-функція без аргументів."""
+    if not await sync_to_async(llm_circuit_breaker.allow_request, thread_sensitive=False)():
+        raise CircuitOpenError("LLM circuit breaker is open")
+    try:
+        result = await fn()
+    except Exception:
+        await sync_to_async(llm_circuit_breaker.record_failure, thread_sensitive=False)()
+        raise
+    await sync_to_async(llm_circuit_breaker.record_success, thread_sensitive=False)()
+    return result
 
-        rate, improvement_hint, refined_prompt = parse_score_and_refined(ai_text)
-        improvement_hint = improvement_hint[:164]
-        refined_prompt = refined_prompt[:500]
 
-        return rate, improvement_hint, refined_prompt
+async def acounted_call(usage, call):
+    """Async-версія counted_call: call(call_usage) повертає корутину."""
+    call_usage = TokenUsage(requests=1)
+    try:
+        return await call(call_usage)
+    finally:
+        if usage is not None:
+            usage.add(call_usage)
+
+
+async def arequest_evaluation(
+    prompt_text: str,
+    priority: Priority = Priority.TRAINER,
+    usage: TokenUsage | EvaluationUsage | None = None,
+) -> tuple[float, str, str]:
+    evaluator = get_evaluator()
+    messages = build_messages(prompt_text)
+    if evaluator.rate_limited:
+        await llm_rate_limiter.aacquire(priority, estimate_tokens(messages))
+
+    async def try_hedge():
+        return not evaluator.rate_limited or await sync_to_async(
+            llm_rate_limiter.try_acquire, thread_sensitive=False
+        )(priority, estimate_tokens(messages))
+
+    deadline = time.monotonic() + settings.LLM_CALL_DEADLINE
+    ai_text = await aguarded_call(
+        lambda: llm_hedged_caller.acall(
+            lambda timeout: acounted_call(
+                usage,
+                lambda call_usage: evaluator.acomplete(messages, timeout, call_usage),
+            ),
+            deadline,
+            try_hedge=try_hedge,
+        )
+    )
+
+    return finalize_result(ai_text)
+
+
+async def arequest_streaming_evaluation(
+    prompt_text: str,
+    on_partial,
+    priority: Priority = Priority.TRAINER,
+    usage: TokenUsage | EvaluationUsage | None = None,
+) -> tuple[float, str, str]:
+    evaluator = get_evaluator()
+    messages = build_messages(prompt_text)
+    if evaluator.rate_limited:
+        await llm_rate_limiter.aacquire(priority, estimate_tokens(messages))
+    parser = StreamingEvaluationParser()
+
+    async def stream(call_usage):
+        async with asyncio.timeout(settings.LLM_CALL_DEADLINE):
+            async for delta in evaluator.astream(
+                messages, settings.LLM_CALL_DEADLINE, call_usage
+            ):
+                for event in parser.feed(delta):
+                    await on_partial(event)
+
+    try:
+        await aguarded_call(lambda: acounted_call(usage, stream))
+    except TimeoutError as e:
+        raise DeadlineExceeded("LLM stream exceeded deadline") from e
+
+    return finalize_result(parser.text)
+
+
+async def aemit_result(result: tuple[float, str, str], on_partial) -> None:
+    rate, improvement_hint, refined_prompt = result
+    await on_partial(
+        {"kind": "score", "rate": rate, "improvement_hint": improvement_hint}
+    )
+    await on_partial({"kind": "refined", "text": refined_prompt})
+
+
+async def aevaluate_prompt_quality(
+    prompt_text: str,
+    on_partial=None,
+    priority: Priority = Priority.TRAINER,
+    user_id: int | None = None,
+) -> tuple[float, str, str]:
+    """Async-версія evaluate_prompt_quality з тим самим кешем, лімітом,
+    single-flight, circuit breaker та метриками."""
+    started = time.monotonic()
+    usage = EvaluationUsage()
+    result, cache_status = await _aevaluate_prompt_quality(
+        prompt_text, on_partial, priority, usage
+    )
+    model_name = get_evaluator().model_name
+    # Витрати пишуться в базу, тож тут спільний потік ORM
+    await sync_to_async(record_evaluation)(
+        model_name,
+        evaluation_outcome(result),
+        cache_status,
+        time.monotonic() - started,
+        usage.close(model_name, user_id),
+        user_id,
+    )
+    return result
+
+
+async def _aevaluate_prompt_quality(
+    prompt_text: str, on_partial, priority: Priority, usage: EvaluationUsage
+) -> tuple[tuple[float, str, str], str]:
+    model_name = get_evaluator().model_name
+    cached = await sync_to_async(get_cached_evaluation, thread_sensitive=False)(
+        prompt_text, model_name, SYSTEM_PROMPT_VERSION
+    )
+    if cached is not None:
+        if on_partial:
+            await aemit_result(cached, on_partial)
+        return cached, "hit"
+
+    if await sync_to_async(llm_circuit_breaker.is_open, thread_sensitive=False)():
+        return degraded_result(prompt_text), "miss"
+
+    async def request():
+        if on_partial:
+            result = await arequest_streaming_evaluation(
+                prompt_text, on_partial, priority, usage
+            )
+        else:
+            result = await arequest_evaluation(prompt_text, priority, usage)
+
+        if result[1] != PARSE_FAILED_HINT:
+            await sync_to_async(cache_evaluation, thread_sensitive=False)(
+                prompt_text, model_name, SYSTEM_PROMPT_VERSION, result
+            )
+        return result
+
+    try:
+        if not settings.EVALUATION_SINGLE_FLIGHT:
+            return await request(), "miss"
+
+        result, shared = await asingle_flight(
+            evaluation_cache_key(prompt_text, model_name, SYSTEM_PROMPT_VERSION),
+            request,
+            timeout=settings.EVALUATION_SINGLE_FLIGHT_TIMEOUT,
+        )
+    except CircuitOpenError:
+        return degraded_result(prompt_text), "miss"
+    except Exception:
+        logger.exception("Prompt evaluation failed")
+        return (5.0, EVALUATION_FAILED_HINT, prompt_text[:500]), "miss"
 
-    except Exception as e:
-        logger.exception("Perplexity evaluation failed: %s", e)
-        return 5.0, "Помилка при оцінці промпта.", prompt_text[:500]
+    if shared:
+        if on_partial:
+            await aemit_result(result, on_partial)
+        return result, "coalesced"
+    return result, "miss"
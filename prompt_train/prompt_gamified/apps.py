@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PromptGamifiedConfig(AppConfig):
     name = "prompt_gamified"
+
+    def ready(self):
+        import prompt_gamified.signals
@@ -0,0 +1,376 @@
+"""Пакетна оцінка промптів для офлайн-задач (переоцінювання, наповнення
+челенджів).
+
+Кілька промптів пакуються в один запит до моделі зі структурованою
+(JSON) відповіддю, що зменшує кількість запитів і накладні витрати на
+системний промпт. Ліміт запитів і circuit breaker ті самі, що й для
+evaluate_prompt_quality. Промпти, які не вдалося розібрати з пакетної
+відповіді, оцінюються окремими запитами.
+
+Пакетний системний промпт інший, тож і оцінки можуть відрізнятися від
+одиночних: вони кешуються під окремою версією BATCH_PROMPT_VERSION і
+зберігаються з версією оцінювача batch_evaluator_version().
+"""
+
+import asyncio
+import json
+import logging
+import re
+import time
+
+import httpx
+import openai
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .ai_func import (
+    SCORE_RE,
+    SYSTEM_PROMPT,
+    SYSTEM_PROMPT_VERSION,
+    aevaluate_prompt_quality,
+    aguarded_call,
+    estimate_tokens,
+    evaluate_prompt_quality,
+    evaluation_outcome,
+    guarded_call,
+    parse_score_and_refined,
+)
+from .cassette import CassetteMissError
+from .evaluation_cache import (
+    cache_evaluation,
+    evaluation_cache_key,
+    get_cached_evaluation,
+)
+from .evaluators import MAX_COMPLETION_TOKENS, TokenUsage, get_evaluator
+from .metrics import record_batch_evaluation, record_evaluation
+from .rate_limiter import Priority, RateLimitTimeout, llm_rate_limiter
+from .resilience import CircuitOpenError, DeadlineExceeded, llm_hedged_caller
+
+logger = logging.getLogger(__name__)
+
+# Версія для кешу пакетних оцінок: ні одиночна оцінка не береться з кешу
+# пакетної, ні навпаки
+BATCH_PROMPT_VERSION = SYSTEM_PROMPT_VERSION + ":batch"
+
+# Збої пакетного запиту, після яких його промпти оцінюються окремо:
+# breaker, черга ліміту, дедлайн, помилки провайдера, мережі та касети
+BATCH_REQUEST_ERRORS = (
+    CircuitOpenError,
+    RateLimitTimeout,
+    DeadlineExceeded,
+    TimeoutError,
+    OSError,
+    httpx.HTTPError,
+    openai.OpenAIError,
+    CassetteMissError,
+)
+
+# Ті самі критерії, що й для одного промпта, змінюється лише формат відповіді
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT.split("\n\n", 1)[0] + """
+
+The user message is a JSON object {"prompts": [{"id": <number>, "text": <prompt>}, ...]}. Evaluate every prompt independently, as if it were the only input, with the same strict criteria.
+
+For each prompt return an object with:
+    - "id": the id of the prompt, unchanged;
+    - "score": a number from 1 to 10;
+    - "hint": a short, direct comment about the errors in the prompt, in the language of that prompt;
+    - "refined": the optimized prompt, within 500 characters, in the language of that prompt. If you cannot optimize, repeat the prompt unchanged.
+
+Respond only with {"results": [...]}, one object per input prompt. No other text."""
+
+BATCH_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "integer"},
+                    "score": {"type": "number"},
+                    "hint": {"type": "string"},
+                    "refined": {"type": "string"},
+                },
+                "required": ["id", "score", "hint", "refined"],
+            },
+        }
+    },
+    "required": ["results"],
+}
+
+# Окремий JSON-об'єкт без вкладених: так вдається зберегти частину
+# відповіді, обрізаної лімітом токенів
+JSON_OBJECT_RE = re.compile(r"\{[^{}]*\}")
+# Текстова відповідь замість JSON: "1. [7]/10 (...)\nRefined: ..."
+NUMBERED_ITEM_RE = re.compile(r"^\s*(?:id\s*)?[#№]?(\d+)\s*[.):]\s*", re.MULTILINE)
+
+
+def build_batch_messages(prompt_texts: list[str]) -> list[dict]:
+    prompts = [{"id": i, "text": text} for i, text in enumerate(prompt_texts, 1)]
+    return [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": json.dumps({"prompts": prompts}, ensure_ascii=False),
+        },
+    ]
+
+
+def _json_items(response_text: str) -> list[dict]:
+    # Перший розібраний JSON зі списком результатів; текст до нього
+    # (пояснення, markdown) пропускається
+    decoder = json.JSONDecoder()
+    for start in re.finditer(r"[\[{]", response_text):
+        try:
+            data, _ = decoder.raw_decode(response_text, start.start())
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            data = data.get("results")
+        if isinstance(data, list) and any(isinstance(i, dict) for i in data):
+            return [item for item in data if isinstance(item, dict)]
+
+    items = []
+    for match in JSON_OBJECT_RE.finditer(response_text):
+        try:
+            items.append(json.loads(match.group()))
+        except ValueError:
+            continue
+    return items
+
+
+def _text_items(response_text: str) -> list[dict]:
+    matches = list(NUMBERED_ITEM_RE.finditer(response_text))
+    items = []
+    for match, following in zip(matches, matches[1:] + [None]):
+        end = following.start() if following else len(response_text)
+        chunk = response_text[match.end() : end]
+        if not SCORE_RE.search(chunk.split("\n", 1)[0]):
+            continue
+        score, hint, refined = parse_score_and_refined(chunk)
+        items.append(
+            {"id": match.group(1), "score": score, "hint": hint, "refined": refined}
+        )
+    return items
+
+
+def parse_batch_response(
+    response_text: str, count: int
+) -> list[tuple[float, str, str] | None]:
+    """Розбирає пакетну відповідь на count результатів у порядку промптів.
+
+    Приймає JSON (зокрема в markdown-блоці чи обрізаний), а якщо модель
+    відповіла текстом — пронумеровані відповіді у форматі
+    parse_score_and_refined. None — результат для промпта не знайдено.
+    """
+    results = [None] * count
+    items = _json_items(response_text) or _text_items(response_text)
+
+    for item in items:
+        try:
+            index = int(item["id"]) - 1
+            score = float(item["score"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        hint = str(item.get("hint") or "").strip()
+        refined = str(item.get("refined") or "").strip()
+        if not 0 <= index < count or results[index] is not None:
+            continue
+        if not hint or not refined:
+            continue
+        results[index] = (max(1.0, min(10.0, score)), hint[:164], refined[:500])
+
+    return results
+
+
+def request_batch_evaluation(
+    prompt_texts: list[str],
+    priority: Priority = Priority.BACKGROUND,
+    usage: TokenUsage | None = None,
+) -> list[tuple[float, str, str] | None]:
+    """Один запит на всі prompt_texts. Помилки бекенда не перехоплює."""
+    evaluator = get_evaluator()
+    messages = build_batch_messages(prompt_texts)
+    max_tokens = MAX_COMPLETION_TOKENS * len(prompt_texts)
+    if evaluator.rate_limited:
+        llm_rate_limiter.acquire(priority, estimate_tokens(messages, max_tokens))
+
+    # Пакет не дублюється hedged запитом: другий такий запит надто дорогий
+    deadline = time.monotonic() + settings.EVALUATION_BATCH_DEADLINE
+    ai_text = guarded_call(
+        lambda: llm_hedged_caller.call(
+            lambda timeout: evaluator.complete_json(
+                messages, BATCH_RESPONSE_SCHEMA, max_tokens, timeout, usage
+            ),
+            deadline,
+            try_hedge=lambda: False,
+        )
+    )
+
+    return parse_batch_response(ai_text, len(prompt_texts))
+
+
+def batch_evaluator_version() -> str:
+    """Модель і версія пакетного системного промпта для збереження з оцінкою."""
+    return f"{get_evaluator().model_name}:{BATCH_PROMPT_VERSION}"
+
+
+def _chunks(items: list, size: int) -> list[list]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def _cached_results(
+    prompt_texts: list[str], model_name: str
+) -> tuple[list, dict[str, list[int]]]:
+    """Результати з кешу та індекси решти промптів, згруповані за ключем
+    кешу, щоб однакові тексти оцінювались один раз."""
+    results = [None] * len(prompt_texts)
+    pending = {}
+    for i, text in enumerate(prompt_texts):
+        started = time.monotonic()
+        cached = get_cached_evaluation(text, model_name, BATCH_PROMPT_VERSION)
+        if cached is not None:
+            results[i] = cached
+            record_evaluation(
+                model_name,
+                evaluation_outcome(cached),
+                "hit",
+                time.monotonic() - started,
+            )
+            continue
+        key = evaluation_cache_key(text, model_name, BATCH_PROMPT_VERSION)
+        pending.setdefault(key, []).append(i)
+    return results, pending
+
+
+def evaluate_prompts_batch(
+    prompt_texts: list[str],
+    priority: Priority = Priority.BACKGROUND,
+    batch_size: int | None = None,
+) -> list[tuple[float, str, str]]:
+    """Оцінює prompt_texts пакетами по batch_size (EVALUATION_BATCH_SIZE)
+    промптів на запит. Результати повертаються в порядку prompt_texts."""
+    batch_size = batch_size or settings.EVALUATION_BATCH_SIZE
+    model_name = get_evaluator().model_name
+    results, pending = _cached_results(prompt_texts, model_name)
+
+    for chunk in _chunks(list(pending.values()), batch_size):
+        texts = [prompt_texts[indexes[0]] for indexes in chunk]
+        chunk_results = [None] * len(texts)
+
+        if len(texts) > 1:
+            started = time.monotonic()
+            usage = TokenUsage()
+            try:
+                chunk_results = request_batch_evaluation(texts, priority, usage)
+            except BATCH_REQUEST_ERRORS as e:
+                logger.warning(
+                    "Batch evaluation of %d prompts failed: %s", len(texts), e
+                )
+            else:
+                record_batch_evaluation(
+                    model_name,
+                    sum(result is not None for result in chunk_results),
+                    time.monotonic() - started,
+                    usage.prompt_tokens,
+                    usage.completion_tokens,
+                )
+
+        for text, result, indexes in zip(texts, chunk_results, chunk):
+            if result is None:
+                # Окремий запит з тим самим кешем, лімітом та деградацією
+                result = evaluate_prompt_quality(text, priority=priority)
+            else:
+                cache_evaluation(text, model_name, BATCH_PROMPT_VERSION, result)
+            for i in indexes:
+                results[i] = result
+
+    return results
+
+
+async def arequest_batch_evaluation(
+    prompt_texts: list[str],
+    priority: Priority = Priority.BACKGROUND,
+    usage: TokenUsage | None = None,
+) -> list[tuple[float, str, str] | None]:
+    evaluator = get_evaluator()
+    messages = build_batch_messages(prompt_texts)
+    max_tokens = MAX_COMPLETION_TOKENS * len(prompt_texts)
+    if evaluator.rate_limited:
+        await llm_rate_limiter.aacquire(priority, estimate_tokens(messages, max_tokens))
+
+    async def no_hedge():
+        return False
+
+    deadline = time.monotonic() + settings.EVALUATION_BATCH_DEADLINE
+    ai_text = await aguarded_call(
+        lambda: llm_hedged_caller.acall(
+            lambda timeout: evaluator.acomplete_json(
+                messages, BATCH_RESPONSE_SCHEMA, max_tokens, timeout, usage
+            ),
+            deadline,
+            try_hedge=no_hedge,
+        )
+    )
+
+    return parse_batch_response(ai_text, len(prompt_texts))
+
+
+async def aevaluate_prompts_batch(
+    prompt_texts: list[str],
+    priority: Priority = Priority.BACKGROUND,
+    batch_size: int | None = None,
+) -> list[tuple[float, str, str]]:
+    """Async-версія evaluate_prompts_batch. Пакети надсилаються по черзі;
+    для паралельності викликайте її для кількох груп промптів одночасно."""
+    batch_size = batch_size or settings.EVALUATION_BATCH_SIZE
+    model_name = get_evaluator().model_name
+    results, pending = await sync_to_async(_cached_results)(prompt_texts, model_name)
+
+    for chunk in _chunks(list(pending.values()), batch_size):
+        texts = [prompt_texts[indexes[0]] for indexes in chunk]
+        chunk_results = [None] * len(texts)
+
+        if len(texts) > 1:
+            started = time.monotonic()
+            usage = TokenUsage()
+            try:
+                chunk_results = await arequest_batch_evaluation(texts, priority, usage)
+            except BATCH_REQUEST_ERRORS as e:
+                logger.warning(
+                    "Batch evaluation of %d prompts failed: %s", len(texts), e
+                )
+            else:
+                await sync_to_async(record_batch_evaluation)(
+                    model_name,
+                    sum(result is not None for result in chunk_results),
+                    time.monotonic() - started,
+                    usage.prompt_tokens,
+                    usage.completion_tokens,
+                )
+
+        fallbacks = [
+            (text, indexes)
+            for text, result, indexes in zip(texts, chunk_results, chunk)
+            if result is None
+        ]
+        for text, result, indexes in zip(texts, chunk_results, chunk):
+            if result is not None:
+                await sync_to_async(cache_evaluation)(
+                    text, model_name, BATCH_PROMPT_VERSION, result
+                )
+                for i in indexes:
+                    results[i] = result
+
+        # Окремі запити для нерозібраних промптів виконуються одночасно
+        fallback_results = await asyncio.gather(
+            *(
+                aevaluate_prompt_quality(text, priority=priority)
+                for text, _ in fallbacks
+            )
+        )
+        for (_, indexes), result in zip(fallbacks, fallback_results):
+            for i in indexes:
+                results[i] = result
+
+    return results
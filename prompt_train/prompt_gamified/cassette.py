@@ -0,0 +1,301 @@
+"""Запис і відтворення відповідей LLM для відтворюваних тестів навантаження.
+
+RecordingEvaluator передає запити бекенду LLM_CASSETTE_BACKEND і дописує
+кожну пару запит/відповідь у касету — JSONL-файл LLM_CASSETTE_PATH.
+ReplayEvaluator відповідає з касети без мережі, з тими ж затримками, що
+були виміряні під час запису. Так записаний робочий день можна прогнати
+через тренажер і челендж офлайн і порівняти пропускну здатність до і
+після змін на справжніх відповідях.
+
+Рядок касети:
+
+    {"key": "<sha256 повідомлень>", "model": "sonar-pro", "latency": 1.234,
+     "text": "...", "chunks": [[0.412, "[7]/10"], ...],
+     "prompt_tokens": 600, "completion_tokens": 80}
+
+chunks є лише у стрімінгових відповідей: час від початку запиту і фрагмент.
+
+До бекенда доходять лише промпти, яких немає в кеші оцінок, тому під час
+відтворення кеш має бути налаштований так само, як під час запису.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .evaluators import (
+    BaseEvaluator,
+    TokenUsage,
+    asleep_or_timeout,
+    sleep_or_timeout,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CassetteMissError(LookupError):
+    """У касеті немає відповіді на такі повідомлення."""
+
+
+def messages_key(messages: list[dict]) -> str:
+    return hashlib.sha256(
+        json.dumps(messages, ensure_ascii=False, sort_keys=True).encode()
+    ).hexdigest()
+
+
+class RecordingEvaluator(BaseEvaluator):
+    """Оцінює промпти бекендом LLM_CASSETTE_BACKEND і записує відповіді."""
+
+    def __init__(self):
+        self.backend = import_string(settings.LLM_CASSETTE_BACKEND)()
+        self.model_name = self.backend.model_name
+        self.rate_limited = self.backend.rate_limited
+        self.path = settings.LLM_CASSETTE_PATH
+        self._lock = threading.Lock()
+
+    def _entry(
+        self,
+        messages: list[dict],
+        started: float,
+        text: str,
+        call_usage: TokenUsage,
+        usage: TokenUsage | None,
+        chunks: list | None = None,
+    ) -> dict:
+        if usage is not None:
+            usage.prompt_tokens += call_usage.prompt_tokens
+            usage.completion_tokens += call_usage.completion_tokens
+
+        entry = {
+            "key": messages_key(messages),
+            "model": self.model_name,
+            "latency": round(time.monotonic() - started, 3),
+            "text": text,
+            "prompt_tokens": call_usage.prompt_tokens,
+            "completion_tokens": call_usage.completion_tokens,
+        }
+        if chunks is not None:
+            entry["chunks"] = chunks
+        return entry
+
+    def _write(self, entry: dict) -> None:
+        # Один write на рядок у режимі append: рядки різних процесів не
+        # перемішуються. Помилка запису не повинна зривати оцінку
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as cassette:
+                cassette.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning("Could not write LLM cassette %s: %s", self.path, e)
+
+    def _record(self, *args, **kwargs) -> None:
+        self._write(self._entry(*args, **kwargs))
+
+    async def _arecord(self, *args, **kwargs) -> None:
+        # Запис у файл блокує, тож виконується в пулі потоків, а не в event loop
+        entry = self._entry(*args, **kwargs)
+        await sync_to_async(self._write, thread_sensitive=False)(entry)
+
+    def complete(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        started = time.monotonic()
+        call_usage = TokenUsage()
+        text = self.backend.complete(messages, timeout, call_usage)
+        self._record(messages, started, text, call_usage, usage)
+        return text
+
+    def stream(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> Iterator[str]:
+        started = time.monotonic()
+        call_usage = TokenUsage()
+        chunks = []
+        for chunk in self.backend.stream(messages, timeout, call_usage):
+            chunks.append([round(time.monotonic() - started, 3), chunk])
+            yield chunk
+        text = "".join(chunk for _, chunk in chunks)
+        self._record(messages, started, text, call_usage, usage, chunks)
+
+    async def acomplete(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        started = time.monotonic()
+        call_usage = TokenUsage()
+        text = await self.backend.acomplete(messages, timeout, call_usage)
+        await self._arecord(messages, started, text, call_usage, usage)
+        return text
+
+    async def astream(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> AsyncIterator[str]:
+        started = time.monotonic()
+        call_usage = TokenUsage()
+        chunks = []
+        async for chunk in self.backend.astream(messages, timeout, call_usage):
+            chunks.append([round(time.monotonic() - started, 3), chunk])
+            yield chunk
+        text = "".join(chunk for _, chunk in chunks)
+        await self._arecord(messages, started, text, call_usage, usage, chunks)
+
+    def complete_json(
+        self,
+        messages: list[dict],
+        schema: dict,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        started = time.monotonic()
+        call_usage = TokenUsage()
+        text = self.backend.complete_json(
+            messages, schema, max_tokens, timeout, call_usage
+        )
+        self._record(messages, started, text, call_usage, usage)
+        return text
+
+    async def acomplete_json(
+        self,
+        messages: list[dict],
+        schema: dict,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        started = time.monotonic()
+        call_usage = TokenUsage()
+        text = await self.backend.acomplete_json(
+            messages, schema, max_tokens, timeout, call_usage
+        )
+        await self._arecord(messages, started, text, call_usage, usage)
+        return text
+
+
+class ReplayEvaluator(BaseEvaluator):
+    """Відповідає з касети LLM_CASSETTE_PATH із записаними затримками.
+
+    Якщо ті самі повідомлення записані кілька разів, відповіді видаються
+    по колу в порядку запису. Невідомі повідомлення — CassetteMissError.
+    """
+
+    # Імітує провайдера повністю, разом з лімітом запитів
+    rate_limited = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._next = {}
+        with open(settings.LLM_CASSETTE_PATH, encoding="utf-8") as cassette:
+            for line in cassette:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], []).append(entry)
+
+        first = next(iter(self._entries.values()), None)
+        # Назва моделі записаних відповідей: той самий ключ кешу та ціни
+        self.model_name = first[0]["model"] if first else "replay"
+
+    def _entry(self, messages: list[dict], usage: TokenUsage | None) -> dict:
+        key = messages_key(messages)
+        entries = self._entries.get(key)
+        if not entries:
+            raise CassetteMissError(f"No recorded LLM response for {key}")
+        with self._lock:
+            index = self._next.get(key, 0)
+            self._next[key] = (index + 1) % len(entries)
+        entry = entries[index]
+
+        if usage is not None:
+            usage.prompt_tokens += entry["prompt_tokens"]
+            usage.completion_tokens += entry["completion_tokens"]
+        return entry
+
+    def _chunks(self, entry: dict) -> list:
+        # Нестрімінгова відповідь приходить одним фрагментом наприкінці
+        return entry.get("chunks") or [[entry["latency"], entry["text"]]]
+
+    def complete(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        entry = self._entry(messages, usage)
+        sleep_or_timeout(entry["latency"], timeout)
+        return entry["text"]
+
+    def stream(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> Iterator[str]:
+        entry = self._entry(messages, usage)
+        elapsed = 0.0
+        for offset, chunk in self._chunks(entry):
+            remaining = None if timeout is None else timeout - elapsed
+            sleep_or_timeout(max(0.0, offset - elapsed), remaining)
+            elapsed = max(elapsed, offset)
+            yield chunk
+
+    async def acomplete(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        entry = self._entry(messages, usage)
+        await asleep_or_timeout(entry["latency"], timeout)
+        return entry["text"]
+
+    async def astream(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> AsyncIterator[str]:
+        entry = self._entry(messages, usage)
+        elapsed = 0.0
+        for offset, chunk in self._chunks(entry):
+            remaining = None if timeout is None else timeout - elapsed
+            await asleep_or_timeout(max(0.0, offset - elapsed), remaining)
+            elapsed = max(elapsed, offset)
+            yield chunk
+
+    def complete_json(
+        self,
+        messages: list[dict],
+        schema: dict,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        return self.complete(messages, timeout, usage)
+
+    async def acomplete_json(
+        self,
+        messages: list[dict],
+        schema: dict,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        return await self.acomplete(messages, timeout, usage)
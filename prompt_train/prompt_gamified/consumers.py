@@ -0,0 +1,41 @@
+import json
+
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from .jobs import evaluation_group_name
+
+
+class EvaluationConsumer(AsyncWebsocketConsumer):
+    """Надсилає користувачу результати його задач оцінювання промптів."""
+
+    async def connect(self):
+        self.user = self.scope["user"]
+
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.group_name = evaluation_group_name(self.user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if hasattr(self, "group_name"):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def evaluation_result(self, event):
+        await self.send(
+            text_data=json.dumps(
+                {
+                    "type": "evaluation_result",
+                    "job_id": event["job_id"],
+                    "status": event["status"],
+                    "result": event["result"],
+                }
+            )
+        )
+
+    async def evaluation_partial(self, event):
+        # Подія "score" містить rate та improvement_hint, "refined" — фрагмент text
+        await self.send(text_data=json.dumps(dict(event, type="evaluation_partial")))
@@ -0,0 +1,31 @@
+"""Лічильники у спільному кеші (Redis), видимі з усіх процесів."""
+
+import logging
+
+import redis
+from django.core.cache import cache as default_cache
+
+logger = logging.getLogger(__name__)
+
+# Збої кешу, що не повинні зривати основну роботу: Redis недоступний, або
+# ValueError від incr, коли лічильник зник між add та incr
+CACHE_ERRORS = (redis.RedisError, ValueError)
+
+
+def incr_counter(
+    key: str, delta: int = 1, timeout: int | None = None, cache=None
+) -> int:
+    """Збільшує лічильник на delta, створюючи його за потреби, і повертає
+    нове значення."""
+    if cache is None:
+        cache = default_cache
+    cache.add(key, 0, timeout=timeout)
+    return cache.incr(key, delta)
+
+
+def incr_stat(key: str, delta: int = 1, cache=None) -> None:
+    """incr_counter для статистики: збій кешу лише записується в лог."""
+    try:
+        incr_counter(key, delta, cache=cache)
+    except CACHE_ERRORS as e:
+        logger.warning("Could not update %s: %s", key, e)
@@ -0,0 +1,85 @@
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .counters import CACHE_ERRORS, incr_stat
+
+logger = logging.getLogger(__name__)
+
+HITS_KEY = "evaluation_cache:hits"
+MISSES_KEY = "evaluation_cache:misses"
+
+
+def _cache():
+    return caches[settings.EVALUATION_CACHE_ALIAS]
+
+
+def normalize_prompt(prompt_text: str) -> str:
+    """Прибирає відмінності, що не впливають на оцінку: пробіли та регістр."""
+    return " ".join(prompt_text.split()).casefold()
+
+
+def evaluation_cache_key(prompt_text: str, model: str, prompt_version: str) -> str:
+    # Ключ залежить від моделі та версії системного промпта, тому після їх
+    # зміни старі оцінки просто перестають знаходитися
+    digest = hashlib.sha256(
+        f"{model}\0{prompt_version}\0{normalize_prompt(prompt_text)}".encode()
+    ).hexdigest()
+    return f"evaluation:{digest}"
+
+
+def get_cached_evaluation(
+    prompt_text: str, model: str, prompt_version: str
+) -> tuple[float, str, str] | None:
+    if not settings.EVALUATION_CACHE_ENABLED:
+        return None
+
+    try:
+        cached = _cache().get(evaluation_cache_key(prompt_text, model, prompt_version))
+    except CACHE_ERRORS as e:
+        # Недоступний кеш не повинен блокувати оцінювання
+        logger.warning("Evaluation cache lookup failed: %s", e)
+        return None
+
+    if cached is None:
+        incr_stat(MISSES_KEY, cache=_cache())
+        return None
+
+    incr_stat(HITS_KEY, cache=_cache())
+    rate, improvement_hint, refined_prompt = cached
+    return rate, improvement_hint, refined_prompt
+
+
+def cache_evaluation(
+    prompt_text: str,
+    model: str,
+    prompt_version: str,
+    result: tuple[float, str, str],
+) -> None:
+    if not settings.EVALUATION_CACHE_ENABLED:
+        return
+
+    try:
+        _cache().set(
+            evaluation_cache_key(prompt_text, model, prompt_version), list(result)
+        )
+    except CACHE_ERRORS as e:
+        logger.warning("Could not store evaluation in cache: %s", e)
+
+
+def get_evaluation_cache_stats() -> dict:
+    cache = _cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+    }
+
+
+def reset_evaluation_cache_stats() -> None:
+    _cache().delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,486 @@
+"""Бекенди оцінювання промптів.
+
+Бекенд обирається налаштуванням PROMPT_EVALUATOR_BACKEND (шлях до класу).
+Кожен бекенд повертає текст у форматі відповіді моделі:
+
+    [X]/10 (коментар)
+    Refined: "покращений промпт"
+
+тому розбір, кешування та стрімінг однакові для всіх бекендів. Якщо
+передано usage, бекенд додає до нього витрачені токени.
+
+complete_json використовується для пакетної оцінки (batch_evaluation) і
+повертає JSON-відповідь на кілька промптів одразу.
+"""
+
+import asyncio
+import json
+import random
+import re
+import time
+from collections.abc import AsyncIterator, Iterator
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .llm_client import llm_clients
+
+MAX_COMPLETION_TOKENS = 500
+
+
+@dataclass
+class TokenUsage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Скільки викликів бекенда зроблено — за кожен провайдер бере плату
+    requests: int = 0
+
+    def add(self, usage) -> None:
+        # usage — об'єкт response.usage від OpenAI-сумісного API, інший
+        # TokenUsage або None
+        if usage is None:
+            return
+        self.prompt_tokens += usage.prompt_tokens or 0
+        self.completion_tokens += usage.completion_tokens or 0
+        self.requests += getattr(usage, "requests", 0)
+
+
+def sleep_or_timeout(seconds: float, timeout: float | None) -> None:
+    """Імітує очікування відповіді. Як і справжній клієнт, перериває його
+    по таймауту."""
+    if timeout is not None and seconds > timeout:
+        time.sleep(max(0.0, timeout))
+        raise TimeoutError("Evaluator call timed out")
+    time.sleep(seconds)
+
+
+async def asleep_or_timeout(seconds: float, timeout: float | None) -> None:
+    if timeout is not None and seconds > timeout:
+        await asyncio.sleep(max(0.0, timeout))
+        raise TimeoutError("Evaluator call timed out")
+    await asyncio.sleep(seconds)
+
+
+class BaseEvaluator:
+    # Назва моделі входить у ключ кешу оцінок
+    model_name = ""
+    # Чи проходять виклики через спільний ліміт запитів до провайдера
+    rate_limited = False
+
+    # timeout — скільки секунд залишилось до дедлайну виклику
+    def complete(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        raise NotImplementedError
+
+    def stream(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> Iterator[str]:
+        yield self.complete(messages, timeout, usage)
+
+    async def acomplete(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        # Бекенд без власної async-реалізації виконується в окремому потоці
+        return await sync_to_async(self.complete, thread_sensitive=False)(
+            messages, timeout, usage
+        )
+
+    async def astream(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> AsyncIterator[str]:
+        yield await self.acomplete(messages, timeout, usage)
+
+    # Пакетна оцінка: відповідь — JSON за schema, max_tokens — на весь пакет
+    def complete_json(
+        self,
+        messages: list[dict],
+        schema: dict,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        # Бекенд без structured output покладається на інструкції в промпті
+        return self.complete(messages, timeout, usage)
+
+    async def acomplete_json(
+        self,
+        messages: list[dict],
+        schema: dict,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        return await sync_to_async(self.complete_json, thread_sensitive=False)(
+            messages, schema, max_tokens, timeout, usage
+        )
+
+
+class PerplexityEvaluator(BaseEvaluator):
+    model_name = "sonar-pro"
+    rate_limited = True
+
+    def _request_options(self, timeout: float | None) -> dict:
+        # Без timeout діють таймаути пулу з'єднань (LLM_*_TIMEOUT)
+        return {} if timeout is None else {"timeout": timeout}
+
+    def complete(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        response = llm_clients.get_client().chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=0.5,
+            max_tokens=MAX_COMPLETION_TOKENS,
+            **self._request_options(timeout),
+        )
+        if usage is not None:
+            usage.add(response.usage)
+        return response.choices[0].message.content
+
+    def stream(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> Iterator[str]:
+        stream = llm_clients.get_client().chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=0.5,
+            max_tokens=MAX_COMPLETION_TOKENS,
+            stream=True,
+            **self._request_options(timeout),
+        )
+        last_usage = None
+        for chunk in stream:
+            # Perplexity надсилає накопичене usage у фрагментах, остаточне — в останньому
+            last_usage = getattr(chunk, "usage", None) or last_usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        if usage is not None:
+            usage.add(last_usage)
+
+    async def acomplete(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        client = llm_clients.get_async_client()
+        response = await client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=0.5,
+            max_tokens=MAX_COMPLETION_TOKENS,
+            **self._request_options(timeout),
+        )
+        if usage is not None:
+            usage.add(response.usage)
+        return response.choices[0].message.content
+
+    async def astream(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> AsyncIterator[str]:
+        client = llm_clients.get_async_client()
+        stream = await client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=0.5,
+            max_tokens=MAX_COMPLETION_TOKENS,
+            stream=True,
+            **self._request_options(timeout),
+        )
+        last_usage = None
+        async for chunk in stream:
+            last_usage = getattr(chunk, "usage", None) or last_usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        if usage is not None:
+            usage.add(last_usage)
+
+    def _response_format(self, schema: dict) -> dict:
+        return {"type": "json_schema", "json_schema": {"schema": schema}}
+
+    def complete_json(
+        self,
+        messages: list[dict],
+        schema: dict,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        response = llm_clients.get_client().chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=0.5,
+            max_tokens=max_tokens,
+            response_format=self._response_format(schema),
+            **self._request_options(timeout),
+        )
+        if usage is not None:
+            usage.add(response.usage)
+        return response.choices[0].message.content
+
+    async def acomplete_json(
+        self,
+        messages: list[dict],
+        schema: dict,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        client = llm_clients.get_async_client()
+        response = await client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=0.5,
+            max_tokens=max_tokens,
+            response_format=self._response_format(schema),
+            **self._request_options(timeout),
+        )
+        if usage is not None:
+            usage.add(response.usage)
+        return response.choices[0].message.content
+
+
+class HeuristicEvaluator(BaseEvaluator):
+    """Детермінована локальна оцінка без мережі: однаковий промпт завжди
+    отримує однакову оцінку. Потрібна для тестів навантаження."""
+
+    model_name = "local-heuristic"
+
+    # (шаблон, бал, підказка якщо немає, доповнення для покращеного промпта)
+    CRITERIA = (
+        (
+            r"\b(ти|you are|act as|як експерт|роль|role)\b",
+            1.5,
+            "Не вказано роль виконавця.",
+            "Ти — досвідчений експерт у цій темі.",
+        ),
+        (
+            r"(формат|format|json|таблиц|table|списк|list|markdown)",
+            1.5,
+            "Не вказано формат відповіді.",
+            "Відповідь подай у вигляді структурованого списку.",
+        ),
+        (
+            r"(\d|не більше|не менше|максимум|мінімум|at most|at least|limit)",
+            1.0,
+            "Немає обмежень щодо обсягу чи кількості.",
+            "Обсяг — не більше 200 слів.",
+        ),
+        (
+            r"(контекст|context|аудитор|audience|для кого|because|тому що|мета|goal)",
+            1.0,
+            "Бракує контексту та мети.",
+            "Врахуй, для кого та з якою метою це потрібно.",
+        ),
+    )
+
+    def _user_prompt(self, messages: list[dict]) -> str:
+        return next(
+            (m["content"] for m in reversed(messages) if m["role"] == "user"), ""
+        )
+
+    def _evaluate(self, prompt_text: str) -> tuple[float, str, str]:
+        prompt_text = prompt_text.strip()
+        words = len(prompt_text.split())
+
+        score = 2.0 + sum(1.0 for limit in (8, 20, 40) if words >= limit)
+        if prompt_text.endswith((".", "?", "!")):
+            score += 0.5
+
+        hints = []
+        additions = []
+        for pattern, points, hint, addition in self.CRITERIA:
+            if re.search(pattern, prompt_text, re.IGNORECASE):
+                score += points
+            else:
+                hints.append(hint)
+                additions.append(addition)
+
+        score = max(1.0, min(10.0, round(score * 2) / 2))
+        hint = hints[0] if hints else "Чіткий та повний промпт."
+        refined = " ".join([prompt_text, *additions]).replace('"', "'")[:500]
+        return score, hint, refined
+
+    def complete(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        score, hint, refined = self._evaluate(self._user_prompt(messages))
+        return f'[{score}]/10 ({hint})\nRefined: "{refined}"'
+
+    async def acomplete(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        # Обчислення миттєве, потік не потрібен
+        return HeuristicEvaluator.complete(self, messages)
+
+    def complete_json(
+        self,
+        messages: list[dict],
+        schema: dict,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        # Пакетний запит: {"prompts": [{"id": ..., "text": ...}, ...]}
+        results = []
+        for item in json.loads(self._user_prompt(messages))["prompts"]:
+            score, hint, refined = self._evaluate(item["text"])
+            results.append(
+                {"id": item["id"], "score": score, "hint": hint, "refined": refined}
+            )
+        return json.dumps({"results": results}, ensure_ascii=False)
+
+    async def acomplete_json(
+        self,
+        messages: list[dict],
+        schema: dict,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        return HeuristicEvaluator.complete_json(self, messages, schema, max_tokens)
+
+
+class FakeLatencyEvaluator(HeuristicEvaluator):
+    """Евристична оцінка з імітацією затримки провайдера.
+
+    Затримка = FAKE_EVALUATOR_LATENCY ± FAKE_EVALUATOR_JITTER секунд;
+    генератор випадкових чисел з фіксованим зерном робить її відтворюваною.
+    """
+
+    model_name = "fake-latency"
+    # Імітує провайдера повністю, разом з лімітом запитів
+    rate_limited = True
+
+    def __init__(self):
+        self._random = random.Random(settings.FAKE_EVALUATOR_SEED)
+
+    def _delay(self) -> float:
+        jitter = settings.FAKE_EVALUATOR_JITTER
+        return max(
+            0.0,
+            settings.FAKE_EVALUATOR_LATENCY + self._random.uniform(-jitter, jitter),
+        )
+
+    def _text(
+        self, messages: list[dict], usage: TokenUsage | None, text: str | None = None
+    ) -> str:
+        if text is None:
+            text = HeuristicEvaluator.complete(self, messages)
+        # Приблизна кількість токенів, щоб тести навантаження бачили їх потік
+        if usage is not None:
+            usage.prompt_tokens += sum(len(m["content"]) for m in messages) // 4
+            usage.completion_tokens += len(text) // 4
+        return text
+
+    def complete(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        sleep_or_timeout(self._delay(), timeout)
+        return self._text(messages, usage)
+
+    def stream(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> Iterator[str]:
+        text = self._text(messages, usage)
+        # Перший токен приходить із затримкою, далі — рівномірно по словах
+        chunks = re.findall(r"\S+\s*", text)
+        sleep_or_timeout(self._delay() / 2, timeout)
+        per_chunk = self._delay() / 2 / max(len(chunks), 1)
+        for chunk in chunks:
+            time.sleep(per_chunk)
+            yield chunk
+
+    async def acomplete(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        await asleep_or_timeout(self._delay(), timeout)
+        return self._text(messages, usage)
+
+    async def astream(
+        self,
+        messages: list[dict],
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> AsyncIterator[str]:
+        text = self._text(messages, usage)
+        chunks = re.findall(r"\S+\s*", text)
+        await asleep_or_timeout(self._delay() / 2, timeout)
+        per_chunk = self._delay() / 2 / max(len(chunks), 1)
+        for chunk in chunks:
+            await asyncio.sleep(per_chunk)
+            yield chunk
+
+    def complete_json(
+        self,
+        messages: list[dict],
+        schema: dict,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        sleep_or_timeout(self._delay(), timeout)
+        text = HeuristicEvaluator.complete_json(self, messages, schema, max_tokens)
+        return self._text(messages, usage, text)
+
+    async def acomplete_json(
+        self,
+        messages: list[dict],
+        schema: dict,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: TokenUsage | None = None,
+    ) -> str:
+        await asleep_or_timeout(self._delay(), timeout)
+        text = HeuristicEvaluator.complete_json(self, messages, schema, max_tokens)
+        return self._text(messages, usage, text)
+
+
+_evaluators = {}
+
+
+def get_evaluator() -> BaseEvaluator:
+    """Повертає спільний для процесу екземпляр налаштованого бекенда."""
+    backend_path = settings.PROMPT_EVALUATOR_BACKEND
+    if backend_path not in _evaluators:
+        _evaluators[backend_path] = import_string(backend_path)()
+    return _evaluators[backend_path]
@@ -0,0 +1,116 @@
+"""MinHash-відбитки промптів для пошуку майже однакових текстів (LSH).
+
+Текст розбивається на шинґли (слова та пари сусідніх слів), для них
+рахується MINHASH_PERMUTATIONS мінімальних хешів, які групуються в
+MINHASH_BANDS смуг. Кожна смуга хешується в одне число і зберігається
+в масиві Prompt.minhash_bands з GIN-індексом. Промпти зі схожістю Жаккара
+від ~0.8 майже напевно мають хоча б одну спільну смугу, тому кандидатів
+знаходить індекс, а точна схожість рахується лише для них.
+"""
+
+import hashlib
+import random
+import re
+from itertools import pairwise
+
+from django.conf import settings
+
+from .evaluation_cache import normalize_prompt
+
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+ROWS_PER_BAND = MINHASH_PERMUTATIONS // MINHASH_BANDS
+
+# Скільки кандидатів зі спільною смугою перевіряється на точну схожість
+CANDIDATE_LIMIT = 200
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_WORD_RE = re.compile(r"\w+")
+
+# Фіксоване зерно: відбитки мають бути однаковими в усіх процесах
+_rng = random.Random(20260222)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(MINHASH_PERMUTATIONS)
+]
+
+
+def shingles(text: str) -> set[str]:
+    words = _WORD_RE.findall(normalize_prompt(text))
+    # Пари слів враховують порядок, а не лише набір слів
+    return set(words) | {f"{a} {b}" for a, b in pairwise(words)}
+
+
+def hash64(value: str) -> int:
+    """Стабільний між процесами 64-бітний хеш рядка (на відміну від hash())."""
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), "big"
+    )
+
+
+def minhash_signature(text: str) -> list[int]:
+    features = [hash64(shingle) for shingle in shingles(text)]
+    if not features:
+        return []
+    return [
+        min(((a * feature + b) % _MERSENNE_PRIME) & _MAX_HASH for feature in features)
+        for a, b in _PERMUTATIONS
+    ]
+
+
+def minhash_bands(text: str) -> list[int] | None:
+    """Хеші смуг MinHash-підпису у діапазоні BigIntegerField."""
+    signature = minhash_signature(text)
+    if not signature:
+        return None
+
+    bands = []
+    for band in range(MINHASH_BANDS):
+        rows = signature[band * ROWS_PER_BAND : (band + 1) * ROWS_PER_BAND]
+        # Номер смуги входить у хеш, щоб однакові значення різних смуг не збігались
+        digest = hashlib.blake2b(
+            f"{band}:{','.join(map(str, rows))}".encode(), digest_size=8
+        ).digest()
+        bands.append(int.from_bytes(digest, "big", signed=True))
+    return bands
+
+
+def jaccard_similarity(a: str, b: str) -> float:
+    shingles_a, shingles_b = shingles(a), shingles(b)
+    if not shingles_a or not shingles_b:
+        return 0.0
+    return len(shingles_a & shingles_b) / len(shingles_a | shingles_b)
+
+
+def find_near_duplicate(text: str, min_similarity: float | None = None):
+    """Шукає найбільш схожий збережений промпт.
+
+    Повертає (prompt, similarity) або None, якщо схожість нижча за поріг.
+    """
+    from .models import Prompt
+
+    if min_similarity is None:
+        min_similarity = settings.NEAR_DUPLICATE_SIMILARITY
+
+    bands = minhash_bands(text)
+    if not bands:
+        return None
+
+    # Без ORDER BY планувальник читає кандидатів лише через GIN-індекс.
+    # Сортування за id дозволило б йому обрати зворотний прохід первинного
+    # ключа з фільтром, тобто всю таблицю для рідкісних смуг
+    candidates = Prompt.objects.filter(minhash_bands__overlap=bands).only(
+        "id", "prompt_text", "improvement_hint", "rate"
+    )[:CANDIDATE_LIMIT]
+
+    # З однаково схожих обирається найновіший промпт
+    best_similarity, _, best = max(
+        ((jaccard_similarity(text, c.prompt_text), c.id, c) for c in candidates),
+        key=lambda item: item[:2],
+        default=(0.0, 0, None),
+    )
+
+    if best is None or best_similarity < min_similarity:
+        return None
+    return best, best_similarity
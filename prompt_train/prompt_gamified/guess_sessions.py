@@ -0,0 +1,153 @@
+"""Багатораундова гра "Вгадай кращий промпт".
+
+Звичайний раунд — два повні завантаження сторінки і запис best_prompt_id
+у сесію в БД. Гра з GUESS_SESSION_ROUNDS раундів готується наперед:
+пари беруться з пулу (або з індексу вибірки, якщо пул порожній), а всі
+промпти читаються одним запитом. Стан гри зберігається в кеші, відповіді
+приймає легкий JSON ендпоінт, а бали нараховуються одним оновленням
+користувача після останнього раунду.
+"""
+
+import random
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Prompt
+from .pair_pool import guess_pair_pool
+from .sampling import prompt_sample_index
+from .utils import award_user_points, get_difference_between_rates
+
+
+def _session_key(session_id: str) -> str:
+    return f"guess_session:{session_id}"
+
+
+def _answer_key(session_id: str, round_index: int) -> str:
+    return f"guess_session:{session_id}:answer:{round_index}"
+
+
+def _prompt_data(prompt: Prompt) -> dict:
+    return {
+        "id": prompt.id,
+        "prompt_text": prompt.prompt_text,
+        "rate": prompt.rate,
+        "improvement_hint": prompt.improvement_hint,
+    }
+
+
+def start_guess_session(user, rounds: int | None = None) -> dict | None:
+    """Готує гру з rounds раундів і зберігає її в кеші.
+
+    Повертає стан гри або None, якщо промптів для гри недостатньо.
+    """
+    rounds = rounds or settings.GUESS_SESSION_ROUNDS
+    min_rate, max_rate = get_difference_between_rates(user)
+
+    pairs = guess_pair_pool.pop_many(min_rate, max_rate, rounds)
+    missing = rounds - len(pairs)
+    if missing:
+        pairs += zip(
+            prompt_sample_index.random_ids(min_rate, 10, missing),
+            prompt_sample_index.random_ids(1, max_rate, missing),
+        )
+
+    prompts = Prompt.objects.in_bulk(
+        {prompt_id for pair in pairs for prompt_id in pair}
+    )
+
+    session_rounds = []
+    for high_id, low_id in pairs:
+        high, low = prompts.get(high_id), prompts.get(low_id)
+        # Промпт видалено або переоцінено після того, як пару сформовано
+        if high is None or low is None or high.rate < min_rate or low.rate > max_rate:
+            continue
+        choices = [high_id, low_id]
+        random.shuffle(choices)
+        session_rounds.append({"best": high_id, "choices": choices})
+
+    if not session_rounds:
+        return None
+
+    session = {
+        "id": uuid.uuid4().hex,
+        "user_id": user.id,
+        "rounds": session_rounds,
+        "prompts": {
+            prompt_id: _prompt_data(prompt) for prompt_id, prompt in prompts.items()
+        },
+        "answered": 0,
+        "wins": 0,
+    }
+    cache.set(_session_key(session["id"]), session, settings.GUESS_SESSION_TTL)
+    return session
+
+
+def session_rounds_for_client(session: dict) -> list[list[dict]]:
+    """Раунди гри для сторінки: лише тексти промптів, без оцінок."""
+    return [
+        [
+            {
+                "id": prompt_id,
+                "prompt_text": session["prompts"][prompt_id]["prompt_text"],
+            }
+            for prompt_id in game_round["choices"]
+        ]
+        for game_round in session["rounds"]
+    ]
+
+
+def answer_guess_round(
+    session_id: str, user, round_index: int, prompt_id: int
+) -> dict | None:
+    """Приймає відповідь на раунд гри.
+
+    Повертає None, якщо гри не знайдено, або словник з результатом раунду.
+    Якщо відповідь некоректна, словник містить лише "error".
+    """
+    session = cache.get(_session_key(session_id))
+    if session is None or session["user_id"] != user.id:
+        return None
+
+    if round_index != session["answered"]:
+        return {"error": "Цей раунд вже завершено або ще не розпочато."}
+
+    game_round = session["rounds"][round_index]
+    if prompt_id not in game_round["choices"]:
+        return {"error": "Такого промпта немає в цьому раунді."}
+
+    # Повторна відповідь на той самий раунд (подвійний клік, другий
+    # запит з іншої вкладки) не рахується
+    if not cache.add(
+        _answer_key(session_id, round_index), 1, settings.GUESS_SESSION_TTL
+    ):
+        return {"error": "Відповідь на цей раунд вже прийнято."}
+
+    is_correct = prompt_id == game_round["best"]
+    session["answered"] += 1
+    session["wins"] += int(is_correct)
+    finished = session["answered"] == len(session["rounds"])
+
+    if finished:
+        # Бали за всю гру — одне оновлення користувача
+        if session["wins"]:
+            award_user_points(user, "win", times=session["wins"])
+        cache.delete(_session_key(session_id))
+    else:
+        cache.set(_session_key(session_id), session, settings.GUESS_SESSION_TTL)
+
+    return {
+        "round": round_index,
+        "result": "win" if is_correct else "loss",
+        "message": (
+            "Правильно! Ви обрали найкращий промпт!"
+            if is_correct
+            else "Неправильно. Це був не кращий промпт!"
+        ),
+        "best_prompt": session["prompts"][game_round["best"]],
+        "worst_prompt": None if is_correct else session["prompts"][prompt_id],
+        "finished": finished,
+        "wins": session["wins"],
+        "rounds": len(session["rounds"]),
+    }
@@ -0,0 +1,173 @@
+import logging
+import time
+import uuid
+
+import redis
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Збої channel layer: переповнена група або недоступний Redis
+CHANNEL_LAYER_ERRORS = (ChannelFull, redis.RedisError, OSError)
+
+
+def evaluation_group_name(user_id: int) -> str:
+    """Назва Channels-групи, в яку надходять результати оцінювання користувача."""
+    return f"evaluations_user_{user_id}"
+
+
+def _job_key(job_id: str) -> str:
+    return f"evaluation_job:{job_id}"
+
+
+def create_evaluation_job(user_id: int) -> str:
+    """Реєструє нову задачу оцінювання у стані pending та повертає її id."""
+    job_id = uuid.uuid4().hex
+    cache.set(
+        _job_key(job_id),
+        {"status": "pending", "user_id": user_id, "result": None},
+        settings.EVALUATION_JOB_TTL,
+    )
+    return job_id
+
+
+def get_evaluation_job(job_id: str) -> dict | None:
+    return cache.get(_job_key(job_id))
+
+
+def complete_evaluation_job(
+    job_id: str, user_id: int, result: dict | None, status: str = "done"
+) -> None:
+    """Зберігає результат задачі та надсилає його в групу користувача.
+
+    Стан у кеші потрібен для опитування (polling), якщо WebSocket недоступний.
+    """
+    cache.set(
+        _job_key(job_id),
+        {"status": status, "user_id": user_id, "result": result},
+        settings.EVALUATION_JOB_TTL,
+    )
+    push_to_user(
+        user_id,
+        {
+            "type": "evaluation.result",
+            "job_id": job_id,
+            "status": status,
+            "result": result,
+        },
+    )
+
+
+async def acomplete_evaluation_job(
+    job_id: str, user_id: int, result: dict | None, status: str = "done"
+) -> None:
+    await cache.aset(
+        _job_key(job_id),
+        {"status": status, "user_id": user_id, "result": result},
+        settings.EVALUATION_JOB_TTL,
+    )
+    await apush_to_user(
+        user_id,
+        {
+            "type": "evaluation.result",
+            "job_id": job_id,
+            "status": status,
+            "result": result,
+        },
+    )
+
+
+def push_to_user(user_id: int, event: dict) -> None:
+    """Надсилає подію в Channels-групу користувача.
+
+    Помилка channel layer не повинна ламати задачу: клієнт отримає
+    результат через опитування.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(evaluation_group_name(user_id), event)
+    except CHANNEL_LAYER_ERRORS as e:
+        logger.warning("Could not push evaluation event to user %s: %s", user_id, e)
+
+
+async def apush_to_user(user_id: int, event: dict) -> None:
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        await channel_layer.group_send(evaluation_group_name(user_id), event)
+    except CHANNEL_LAYER_ERRORS as e:
+        logger.warning("Could not push evaluation event to user %s: %s", user_id, e)
+
+
+class PartialResultPublisher:
+    """Надсилає частковий результат оцінювання користувачу під час стрімінгу.
+
+    Фрагменти покращеного промпта накопичуються і відправляються не частіше
+    ніж раз на flush_interval секунд, щоб не надсилати подію на кожен токен.
+    """
+
+    def __init__(self, job_id: str, user_id: int, flush_interval: float = 0.1):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._last_flush = 0.0
+
+    def __call__(self, event: dict) -> None:
+        if event["kind"] != "refined":
+            self.flush()
+            self._push(event)
+            return
+
+        self._buffer.append(event["text"])
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        text = "".join(self._buffer)
+        self._buffer = []
+        self._push({"kind": "refined", "text": text})
+
+    def _push(self, event: dict) -> None:
+        self._last_flush = time.monotonic()
+        push_to_user(
+            self.user_id,
+            {"type": "evaluation.partial", "job_id": self.job_id, **event},
+        )
+
+
+class AsyncPartialResultPublisher(PartialResultPublisher):
+    """PartialResultPublisher для async-шляху оцінювання."""
+
+    async def __call__(self, event: dict) -> None:
+        if event["kind"] != "refined":
+            await self.flush()
+            await self._push(event)
+            return
+
+        self._buffer.append(event["text"])
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        text = "".join(self._buffer)
+        self._buffer = []
+        await self._push({"kind": "refined", "text": text})
+
+    async def _push(self, event: dict) -> None:
+        self._last_flush = time.monotonic()
+        await apush_to_user(
+            self.user_id,
+            {"type": "evaluation.partial", "job_id": self.job_id, **event},
+        )
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+import threading
+import weakref
+
+import httpx
+from decouple import config
+from django.conf import settings
+from openai import AsyncOpenAI, OpenAI
+
+logger = logging.getLogger(__name__)
+
+PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
+
+
+class ConnectionStats:
+    """Лічильники запитів до LLM та нових з'єднань (TCP + TLS handshake).
+
+    Запит, для якого не відкривалося нове з'єднання, пішов через keep-alive.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.new_connections = 0
+            self.tls_handshakes = 0
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def record_trace_event(self, event_name: str) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.new_connections += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+
+    @property
+    def reused_connections(self) -> int:
+        return max(0, self.requests - self.new_connections)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "tls_handshakes": self.tls_handshakes,
+                "reused_connections": max(0, self.requests - self.new_connections),
+            }
+
+
+def _llm_setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def build_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=_llm_setting("LLM_POOL_MAX_CONNECTIONS", 20),
+        max_keepalive_connections=_llm_setting("LLM_POOL_MAX_KEEPALIVE", 10),
+        keepalive_expiry=_llm_setting("LLM_KEEPALIVE_EXPIRY", 60.0),
+    )
+
+
+def build_timeout() -> httpx.Timeout:
+    connect_timeout = _llm_setting("LLM_CONNECT_TIMEOUT", 5.0)
+    return httpx.Timeout(
+        _llm_setting("LLM_READ_TIMEOUT", 30.0),
+        connect=connect_timeout,
+        pool=connect_timeout,
+    )
+
+
+class LLMClientRegistry:
+    """Довгоживучі OpenAI-клієнти з пулом з'єднань: один на процес
+    та по одному асинхронному на кожен event loop.
+
+    Після fork (Celery prefork) клієнт створюється заново, щоб дочірні
+    процеси не ділили сокети батьківського.
+    """
+
+    def __init__(self, base_url: str = PERPLEXITY_BASE_URL):
+        self.base_url = base_url
+        self.stats = ConnectionStats()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _api_key(self) -> str:
+        api_key = config("PERPLEXITY_API_KEY")
+        if not api_key:
+            raise RuntimeError("PERPLEXITY_API_KEY is not set")
+        return api_key
+
+    def _reset_after_fork(self) -> None:
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._client = None
+            self._async_clients = weakref.WeakKeyDictionary()
+
+    def _on_request(self, request: httpx.Request) -> None:
+        self.stats.record_request()
+        request.extensions["trace"] = self._trace
+
+    def _trace(self, event_name: str, info: dict) -> None:
+        self.stats.record_trace_event(event_name)
+
+    async def _on_async_request(self, request: httpx.Request) -> None:
+        self.stats.record_request()
+        request.extensions["trace"] = self._async_trace
+
+    async def _async_trace(self, event_name: str, info: dict) -> None:
+        self.stats.record_trace_event(event_name)
+
+    def get_client(self) -> OpenAI:
+        with self._lock:
+            self._reset_after_fork()
+            if self._client is None:
+                timeout = build_timeout()
+                http_client = httpx.Client(
+                    limits=build_limits(),
+                    timeout=timeout,
+                    event_hooks={"request": [self._on_request]},
+                )
+                self._client = OpenAI(
+                    api_key=self._api_key(),
+                    base_url=self.base_url,
+                    timeout=timeout,
+                    http_client=http_client,
+                )
+                logger.info("Created pooled LLM client for process %s", self._pid)
+            return self._client
+
+    def get_async_client(self) -> AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._reset_after_fork()
+            client = self._async_clients.get(loop)
+            if client is None:
+                timeout = build_timeout()
+                http_client = httpx.AsyncClient(
+                    limits=build_limits(),
+                    timeout=timeout,
+                    event_hooks={"request": [self._on_async_request]},
+                )
+                client = AsyncOpenAI(
+                    api_key=self._api_key(),
+                    base_url=self.base_url,
+                    timeout=timeout,
+                    http_client=http_client,
+                )
+                self._async_clients[loop] = client
+            return client
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._async_clients = weakref.WeakKeyDictionary()
+
+
+llm_clients = LLMClientRegistry()
+
+
+def get_connection_stats() -> dict:
+    return llm_clients.stats.snapshot()
@@ -0,0 +1,25 @@
+"""Повна збірка індексу схожих промптів (similar_prompts).
+
+Запускається після розгортання та після масової зміни оцінок. Нові
+промпти між збірками додає Celery задача update_similar_prompts_task.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from prompt_gamified.similar_prompts import similar_prompts
+
+
+class Command(BaseCommand):
+    help = "Збирає індекс TF-IDF промптів з високою оцінкою для пошуку схожих."
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        indexed = similar_prompts.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Проіндексовано {indexed} промптів за "
+                f"{time.monotonic() - started:.1f} с у {similar_prompts.path}."
+            )
+        )
@@ -0,0 +1,33 @@
+"""Вивантажує всі промпти в JSONL або CSV для перенесення між середовищами."""
+
+import sys
+
+from django.core.management.base import BaseCommand
+
+from prompt_gamified.prompt_dump import FORMATS, export_prompts, format_for_path
+
+
+class Command(BaseCommand):
+    help = "Вивантажує промпти у файл JSONL або CSV (через PostgreSQL COPY)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Шлях до файлу або - для stdout.")
+        parser.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="Формат файлу. За замовчуванням — за розширенням, інакше JSONL.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or format_for_path(path)
+
+        if path == "-":
+            export_prompts(sys.stdout.buffer, fmt)
+            return
+
+        with open(path, "wb") as out:
+            exported = export_prompts(out, fmt)
+        self.stdout.write(
+            self.style.SUCCESS(f"Вивантажено {exported} промптів у {path}.")
+        )
@@ -0,0 +1,70 @@
+"""Завантажує промпти з JSONL або CSV, створених командою export_prompts.
+
+Промпти з текстом, що вже є в базі, пропускаються, тож перервану команду
+можна запустити знову з тим самим файлом.
+"""
+
+import os
+import sys
+
+from django.core.management.base import BaseCommand
+
+from prompt_gamified.pair_pool import guess_pair_pool
+from prompt_gamified.prompt_dump import FORMATS, format_for_path, import_prompts
+from prompt_gamified.sampling import prompt_sample_index
+from prompt_gamified.tasks import update_similar_prompts_task
+from prompt_gamified.top_prompts import top_prompts
+
+
+class Command(BaseCommand):
+    help = "Завантажує промпти з файлу JSONL або CSV (через PostgreSQL COPY)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Шлях до файлу або - для stdin.")
+        parser.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="Формат файлу. За замовчуванням — за розширенням, інакше JSONL.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Кількість рядків, що читаються та записуються за раз.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Кількість процесів для MinHash-відбитків промптів.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or format_for_path(path)
+
+        if path == "-":
+            stats = import_prompts(
+                sys.stdin.buffer, fmt, options["batch_size"], options["workers"]
+            )
+        else:
+            with open(path, "rb") as stream:
+                stats = import_prompts(
+                    stream, fmt, options["batch_size"], options["workers"]
+                )
+
+        if stats.imported:
+            # COPY оминає сигнали: індекс вибірки, пули пар, список найкращих
+            # промптів та індекс схожих промптів перебудуються
+            prompt_sample_index.invalidate()
+            guess_pair_pool.invalidate()
+            top_prompts.invalidate()
+            update_similar_prompts_task.delay(rebuild=True)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Завантажено {stats.imported} промптів, дублікатів: "
+                f"{stats.duplicates}, некоректних рядків: {stats.invalid}, "
+                f"без відомого автора: {stats.unknown_users}."
+            )
+        )
@@ -0,0 +1,182 @@
+"""Переоцінювання всіх збережених промптів поточним оцінювачем.
+
+Після зміни SYSTEM_PROMPT або моделі старі оцінки непорівнянні з новими.
+Команда проходить таблицю Prompt за зростанням id пачками, оцінює кожну
+пачку з обмеженою кількістю одночасних запитів і записує нові оцінки разом
+з версією оцінювача. Після кожної пачки останній id зберігається в кеші,
+тому перервана команда продовжує з того ж місця.
+
+Промпти оцінюються пакетами по --group-size в одному запиті до моделі
+(batch_evaluation) і зберігаються з пакетною версією оцінювача; промпти,
+вже оцінені поточною одиночною чи пакетною версією, пропускаються. Запити йдуть з пріоритетом BACKGROUND, тож ліміт
+провайдера спільний з користувачами, які завжди мають перевагу. Швидкість
+обмежена зверху половиною LLM_RATE_LIMIT_RPM, помноженою на --group-size;
+однакові тексти оцінюються один раз завдяки кешу оцінок.
+"""
+
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from prompt_gamified.ai_func import current_evaluator_version, evaluation_outcome
+from prompt_gamified.batch_evaluation import (
+    aevaluate_prompts_batch,
+    batch_evaluator_version,
+)
+from prompt_gamified.models import Prompt
+from prompt_gamified.pair_pool import guess_pair_pool
+from prompt_gamified.rate_limiter import Priority
+from prompt_gamified.resilience import llm_circuit_breaker
+from prompt_gamified.sampling import prompt_sample_index
+from prompt_gamified.tasks import update_similar_prompts_task
+from prompt_gamified.top_prompts import top_prompts
+
+HINT_MAX_LENGTH = Prompt._meta.get_field("improvement_hint").max_length
+
+# Як часто перевіряти, чи замкнувся circuit breaker, секунди
+BREAKER_POLL_INTERVAL = 5
+
+
+def checkpoint_key(version: str) -> str:
+    return f"rescore_prompts:checkpoint:{version}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Переоцінює всі промпти поточною моделлю та системним промптом. "
+        "Перервану команду можна запустити знову — вона продовжить з місця зупинки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=20,
+            help="Кількість одночасних запитів до оцінювача.",
+        )
+        parser.add_argument(
+            "--group-size",
+            type=int,
+            default=settings.EVALUATION_BATCH_SIZE,
+            help="Кількість промптів в одному запиті до оцінювача.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Кількість промптів, що читаються та записуються за раз.",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Почати з початку таблиці, ігноруючи збережений прогрес.",
+        )
+
+    def handle(self, *args, **options):
+        version = batch_evaluator_version()
+        if options["restart"]:
+            cache.delete(checkpoint_key(version))
+
+        # async_to_sync, а не asyncio.run: ORM-виклики виконуються в потоці
+        # команди з її з'єднанням до бази
+        updated, failed = async_to_sync(self.rescore)(
+            version,
+            options["concurrency"],
+            options["batch_size"],
+            options["group_size"],
+        )
+        if updated:
+            # bulk_update оминає сигнали: індекс вибірки, пули пар, список
+            # найкращих промптів та індекс схожих промптів перебудуються
+            prompt_sample_index.invalidate()
+            guess_pair_pool.invalidate()
+            top_prompts.invalidate()
+            update_similar_prompts_task.delay(rebuild=True)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Переоцінено {updated} промптів версією {version}, "
+                f"не вдалося: {failed}."
+            )
+        )
+
+    async def rescore(
+        self, version: str, concurrency: int, batch_size: int, group_size: int
+    ) -> tuple[int, int]:
+        last_id = await cache.aget(checkpoint_key(version), 0)
+        if last_id:
+            self.stdout.write(f"Продовжуємо після промпта #{last_id}.")
+
+        semaphore = asyncio.Semaphore(concurrency)
+        started = time.monotonic()
+        updated = failed = 0
+
+        # Промпти, вже оцінені цією версією або одиночною оцінкою тієї ж
+        # моделі, пропускаються, тож повторний запуск з --restart доробляє
+        # лише те, що не вдалося
+        current_versions = [version, await sync_to_async(current_evaluator_version)()]
+        while True:
+            batch = [
+                prompt
+                async for prompt in Prompt.objects.filter(id__gt=last_id)
+                .exclude(evaluator_version__in=current_versions)
+                .only("id", "prompt_text")
+                .order_by("id")[:batch_size]
+            ]
+            if not batch:
+                break
+
+            groups = [
+                batch[i : i + group_size] for i in range(0, len(batch), group_size)
+            ]
+            results = await asyncio.gather(
+                *(self.evaluate(group, version, semaphore) for group in groups)
+            )
+            rescored = [prompt for group in results for prompt in group]
+            await Prompt.objects.abulk_update(
+                rescored, ["rate", "improvement_hint", "evaluator_version"]
+            )
+
+            last_id = batch[-1].id
+            await cache.aset(checkpoint_key(version), last_id, timeout=None)
+            updated += len(rescored)
+            failed += len(batch) - len(rescored)
+
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"#{last_id}: переоцінено {updated}, не вдалося {failed}, "
+                f"{(updated + failed) / elapsed:.1f} промптів/с"
+            )
+
+        return updated, failed
+
+    async def evaluate(
+        self, prompts: list[Prompt], version: str, semaphore: asyncio.Semaphore
+    ) -> list[Prompt]:
+        """Оцінює групу промптів і оновлює їх поля. Повертає ті, що отримали
+        нову оцінку."""
+        async with semaphore:
+            # Поки провайдер недоступний, орієнтовні оцінки лише зіпсували б
+            # дані, тому чекаємо на відновлення
+            while await sync_to_async(llm_circuit_breaker.is_open)():
+                await asyncio.sleep(BREAKER_POLL_INTERVAL)
+
+            results = await aevaluate_prompts_batch(
+                [prompt.prompt_text for prompt in prompts],
+                priority=Priority.BACKGROUND,
+                batch_size=len(prompts),
+            )
+
+        rescored = []
+        for prompt, result in zip(prompts, results):
+            if evaluation_outcome(result) != "ok":
+                continue
+            rate, improvement_hint, _ = result
+            prompt.rate = rate
+            prompt.improvement_hint = improvement_hint[:HINT_MAX_LENGTH]
+            prompt.evaluator_version = version
+            rescored.append(prompt)
+        return rescored
@@ -0,0 +1,241 @@
+"""Метрики оцінювання промптів: затримки, результати, токени та вартість.
+
+Гістограми затримок і лічильники живуть у спільному кеші (Redis), тому
+агрегуються з усіх процесів. Вартість по користувачах і днях зберігається
+в LLMUsage, щоб її можна було переглянути в адмінці.
+"""
+
+import logging
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .counters import CACHE_ERRORS, incr_counter
+from .evaluators import TokenUsage
+from .models import LLMUsage
+
+logger = logging.getLogger(__name__)
+
+# Верхні межі кошиків гістограми затримок, мілісекунди
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 30000)
+
+OUTCOMES = ("ok", "parse_fallback", "error", "degraded")
+CACHE_STATUSES = ("hit", "miss", "coalesced")
+
+PREFIX = "metrics:evaluations"
+
+
+def _bucket_label(latency_ms: float) -> str:
+    for bound in LATENCY_BUCKETS_MS:
+        if latency_ms <= bound:
+            return str(bound)
+    return "inf"
+
+
+def calculate_cost(
+    model: str, prompt_tokens: int, completion_tokens: int, requests: int = 1
+) -> Decimal:
+    """Вартість викликів у доларах за цінами з LLM_PRICING."""
+    pricing = settings.LLM_PRICING.get(model)
+    if not pricing:
+        return Decimal(0)
+    return (
+        Decimal(str(pricing["input_per_million"])) * prompt_tokens / 1_000_000
+        + Decimal(str(pricing["output_per_million"])) * completion_tokens / 1_000_000
+        + Decimal(str(pricing["per_request"])) * requests
+    ).quantize(Decimal("0.000001"))
+
+
+def record_usage(
+    user_id: int | None,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    requests: int = 1,
+) -> None:
+    cost = calculate_cost(model, prompt_tokens, completion_tokens, requests)
+    lookup = {"user_id": user_id, "date": timezone.localdate(), "model": model}
+    increments = {
+        "requests": F("requests") + requests,
+        "prompt_tokens": F("prompt_tokens") + prompt_tokens,
+        "completion_tokens": F("completion_tokens") + completion_tokens,
+        "cost": F("cost") + cost,
+    }
+
+    if LLMUsage.objects.filter(**lookup).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            LLMUsage.objects.create(
+                **lookup,
+                requests=requests,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                cost=cost,
+            )
+    except IntegrityError:
+        # Рядок за сьогодні щойно створив інший процес
+        LLMUsage.objects.filter(**lookup).update(**increments)
+
+
+def _record_outcome(outcome: str, cache_status: str, latency: float) -> None:
+    latency_ms = latency * 1000
+    incr_counter(f"{PREFIX}:latency:{cache_status}:{_bucket_label(latency_ms)}")
+    incr_counter(f"{PREFIX}:latency_ms_total:{cache_status}", int(latency_ms))
+    incr_counter(f"{PREFIX}:outcome:{outcome}")
+    incr_counter(f"{PREFIX}:cache:{cache_status}")
+
+
+class EvaluationUsage:
+    """Токени та виклики бекенда однієї оцінки.
+
+    Кожен виклик бекенда рахує власний TokenUsage і додає його сюди, коли
+    завершиться. Hedged запит робить два виклики з різних потоків, тож
+    додавання захищене блокуванням. Виклик, що програв і завершився вже після
+    запису метрик оцінки (close), записує свої витрати окремо.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usage = TokenUsage()
+        self._late = None
+
+    def add(self, call_usage: TokenUsage) -> None:
+        with self._lock:
+            if self._late is None:
+                self._usage.add(call_usage)
+                return
+            model, user_id = self._late
+        if call_usage.requests:
+            record_usage_safely(user_id, model, call_usage)
+
+    def close(self, model: str, user_id: int | None) -> TokenUsage:
+        """Повертає витрати, накопичені до цього моменту."""
+        with self._lock:
+            self._late = (model, user_id)
+            return self._usage
+
+
+def record_usage_safely(user_id: int | None, model: str, usage: TokenUsage) -> None:
+    try:
+        record_usage(
+            user_id, model, usage.prompt_tokens, usage.completion_tokens, usage.requests
+        )
+    except DatabaseError as e:
+        logger.warning("Could not record LLM usage: %s", e)
+
+
+def record_evaluation(
+    model: str,
+    outcome: str,
+    cache_status: str,
+    latency: float,
+    usage: TokenUsage | None = None,
+    user_id: int | None = None,
+) -> None:
+    """Записує одну оцінку промпта. Помилка запису не впливає на оцінку."""
+    try:
+        _record_outcome(outcome, cache_status, latency)
+    except CACHE_ERRORS as e:
+        logger.warning("Could not record evaluation metrics: %s", e)
+
+    # Вартість є лише у викликів, що дійшли до бекенда: кеш, circuit breaker,
+    # таймаут ліміту чи помилка лідера single-flight нічого не коштують
+    if usage is not None and usage.requests:
+        record_usage_safely(user_id, model, usage)
+
+
+def record_batch_evaluation(
+    model: str,
+    evaluated: int,
+    latency: float,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0,
+) -> None:
+    """Записує один пакетний запит: кожен розібраний з нього промпт — як
+    окрему оцінку із затримкою всього пакета, токени та вартість — один раз."""
+    try:
+        for _ in range(evaluated):
+            _record_outcome("ok", "miss", latency)
+        record_usage(None, model, prompt_tokens, completion_tokens)
+    except (*CACHE_ERRORS, DatabaseError) as e:
+        logger.warning("Could not record batch evaluation metrics: %s", e)
+
+
+def _percentile(buckets: dict, total: int, percent: float) -> str | None:
+    if not total:
+        return None
+    threshold = total * percent / 100
+    seen = 0
+    for label, count in buckets.items():
+        seen += count
+        if seen >= threshold:
+            return label
+    return "inf"
+
+
+def latency_histograms() -> dict:
+    """Гістограма затримок для кожного стану кешу. Перцентилі наближені
+    верхньою межею кошика, в який вони потрапляють, у мілісекундах."""
+    result = {}
+    labels = [str(bound) for bound in LATENCY_BUCKETS_MS] + ["inf"]
+    for cache_status in CACHE_STATUSES:
+        counts = cache.get_many(
+            [f"{PREFIX}:latency:{cache_status}:{label}" for label in labels]
+        )
+        buckets = {
+            label: counts.get(f"{PREFIX}:latency:{cache_status}:{label}", 0)
+            for label in labels
+        }
+        total = sum(buckets.values())
+        latency_total = cache.get(f"{PREFIX}:latency_ms_total:{cache_status}", 0)
+        result[cache_status] = {
+            "count": total,
+            "avg_ms": round(latency_total / total) if total else None,
+            "p50_ms": _percentile(buckets, total, 50),
+            "p95_ms": _percentile(buckets, total, 95),
+            "p99_ms": _percentile(buckets, total, 99),
+            "buckets": buckets,
+        }
+    return result
+
+
+def _usage_by_model(usage) -> list[dict]:
+    rows = usage.values("model").annotate(
+        requests=Sum("requests"),
+        prompt_tokens=Sum("prompt_tokens"),
+        completion_tokens=Sum("completion_tokens"),
+        cost=Sum("cost"),
+    )
+    return [dict(row, cost=str(row["cost"])) for row in rows.order_by("model")]
+
+
+def usage_summary(date=None) -> dict:
+    date = date or timezone.localdate()
+    usage = LLMUsage.objects.filter(date=date)
+    top_users = (
+        usage.filter(user__isnull=False)
+        .values("user_id", "user__nickname")
+        .annotate(requests=Sum("requests"), cost=Sum("cost"))
+        .order_by("-cost")[:10]
+    )
+    return {
+        "date": date.isoformat(),
+        "by_model": _usage_by_model(usage),
+        "top_users": [dict(row, cost=str(row["cost"])) for row in top_users],
+    }
+
+
+def get_evaluation_metrics() -> dict:
+    return {
+        "latency": latency_histograms(),
+        "outcomes": {o: cache.get(f"{PREFIX}:outcome:{o}", 0) for o in OUTCOMES},
+        "cache": {s: cache.get(f"{PREFIX}:cache:{s}", 0) for s in CACHE_STATUSES},
+        "today": usage_summary(),
+        "all_time": _usage_by_model(LLMUsage.objects.all()),
+    }
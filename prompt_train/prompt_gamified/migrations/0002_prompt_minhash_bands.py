@@ -0,0 +1,59 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:12
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.db import migrations, models
+
+from prompt_gamified.fingerprints import minhash_bands
+
+BATCH_SIZE = 2000
+
+
+def fill_minhash_bands(apps, schema_editor):
+    Prompt = apps.get_model("prompt_gamified", "Prompt")
+
+    # Проходимо таблицю пакетами за id, не завантажуючи її повністю
+    last_id = 0
+    while True:
+        batch = list(
+            Prompt.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .only("id", "prompt_text")[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+
+        for prompt in batch:
+            prompt.minhash_bands = minhash_bands(prompt.prompt_text)
+        Prompt.objects.bulk_update(batch, ["minhash_bands"])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prompt_gamified", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="prompt",
+            name="minhash_bands",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.BigIntegerField(),
+                blank=True,
+                editable=False,
+                null=True,
+            ),
+        ),
+        # Заповнюємо відбитки до створення індексу, так швидше
+        migrations.RunPython(fill_minhash_bands, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="prompt",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["minhash_bands"], name="prompt_minhash_bands_gin"
+            ),
+        ),
+    ]
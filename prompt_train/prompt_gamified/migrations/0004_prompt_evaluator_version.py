@@ -0,0 +1,20 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("prompt_gamified", "0003_llmusage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="prompt",
+            name="evaluator_version",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=64
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:05
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не блокує запис у таблицю, але не може
+    # виконуватися в транзакції
+    atomic = False
+
+    dependencies = [
+        ("prompt_gamified", "0004_prompt_evaluator_version"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="prompt",
+            index=models.Index(fields=["rate", "id"], name="prompt_rate_id_idx"),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:07
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Збережене згенероване поле переписує всю таблицю prompt_gamified_prompt
+    # під блокуванням ACCESS EXCLUSIVE: на великій таблиці запускайте
+    # міграцію у вікно обслуговування. GIN-індекс будується окремо і
+    # конкурентно в 0008_prompt_search_vector_gin.
+
+    dependencies = [
+        ("prompt_gamified", "0005_prompt_rate_id_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="prompt",
+            name="search_vector",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.postgres.search.CombinedSearchVector(
+                    django.contrib.postgres.search.SearchVector(
+                        "prompt_text", config="simple", weight="A"
+                    ),
+                    "||",
+                    django.contrib.postgres.search.SearchVector(
+                        "improvement_hint", config="simple", weight="B"
+                    ),
+                    django.contrib.postgres.search.SearchConfig("simple"),
+                ),
+                output_field=django.contrib.postgres.search.SearchVectorField(),
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:16
+
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не блокує запис у таблицю, але не може
+    # виконуватися в транзакції
+    atomic = False
+
+    dependencies = [
+        ("prompt_gamified", "0006_prompt_search_vector"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="prompt",
+            index=models.Index(
+                django.db.models.functions.text.MD5("prompt_text"),
+                name="prompt_text_md5_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не блокує запис у таблицю, але не може
+    # виконуватися в транзакції
+    atomic = False
+
+    dependencies = [
+        ("prompt_gamified", "0007_prompt_text_md5_idx"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="prompt",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="prompt_search_vector_gin"
+            ),
+        ),
+    ]
@@ -1,8 +1,13 @@
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
+from django.db.models.functions import MD5
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
 
 from users.models import CustomUser
+from . import fingerprints
 
 
 class Prompt(models.Model):
@@ -14,5 +19,73 @@ class Prompt(models.Model):
     )
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True)
 
+    # Модель і версія системного промпта, якими виставлено rate. Порожня,
+    # якщо оцінка орієнтовна або створена до появи версій
+    evaluator_version = models.CharField(
+        max_length=64, blank=True, default="", editable=False
+    )
+
+    # Хеші смуг MinHash-підпису тексту для пошуку майже однакових промптів
+    minhash_bands = ArrayField(
+        models.BigIntegerField(), null=True, blank=True, editable=False
+    )
+
+    # Текст і підказка для повнотекстового пошуку. Конфігурація simple: у
+    # PostgreSQL немає словника для української, слова лише зводяться до
+    # нижнього регістру
+    search_vector = models.GeneratedField(
+        expression=SearchVector("prompt_text", weight="A", config="simple")
+        + SearchVector("improvement_hint", weight="B", config="simple"),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["minhash_bands"], name="prompt_minhash_bands_gin"),
+            GinIndex(fields=["search_vector"], name="prompt_search_vector_gin"),
+            # Пошук дублікатів тексту під час імпорту (import_prompts)
+            models.Index(MD5("prompt_text"), name="prompt_text_md5_idx"),
+            # Список найкращих промптів і фільтри бібліотеки за оцінкою
+            models.Index(fields=["rate", "id"], name="prompt_rate_id_idx"),
+        ]
+
     def __str__(self):
         return f"{self.user} - '{self.prompt_text}'."
+
+    def save(self, *args, **kwargs):
+        self.minhash_bands = fingerprints.minhash_bands(self.prompt_text)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "prompt_text" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "minhash_bands"}
+
+        super().save(*args, **kwargs)
+
+
+class LLMUsage(models.Model):
+    """Денні лічильники викликів LLM та їх вартості по користувачах і моделях.
+
+    user порожній для оцінок без користувача (наприклад, фонове переоцінювання).
+    """
+
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, null=True, blank=True
+    )
+    date = models.DateField()
+    model = models.CharField(max_length=64)
+    requests = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    cost = models.DecimalField(max_digits=12, decimal_places=6, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "date", "model"],
+                name="llm_usage_user_date_model_unique",
+                nulls_distinct=False,
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.user} {self.model}: ${self.cost}"
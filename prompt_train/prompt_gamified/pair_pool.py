@@ -0,0 +1,169 @@
+"""Пул готових пар промптів для гри "Вгадай кращий промпт".
+
+Для кожного рівня складності (пороги оцінок з get_difference_between_rates)
+у спільному кеші лежить черга пар (id кращого, id гіршого). Раунд лише
+забирає пару з черги й читає два рядки за первинним ключем, тож його
+тривалість не залежить від розміру таблиці. Коли в черзі лишається менше
+GUESS_PAIR_POOL_LOW_WATERMARK пар, Celery задача поповнює її до
+GUESS_PAIR_POOL_SIZE.
+
+Черга — кільце в кеші: лічильник head атомарно видає номер наступної пари,
+tail — номер останньої записаної. Поповнює чергу лише одна задача
+одночасно.
+
+Перед видачею пари оцінки обох промптів перевіряються ще раз: промпт міг
+бути переоцінений після того, як пару поставили в чергу. Після масової зміни
+оцінок (rescore_prompts, import_prompts) номер версії в кеші збільшується, і
+всі черги починаються заново.
+"""
+
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .counters import incr_counter
+from .models import Prompt
+from .sampling import prompt_sample_index
+
+logger = logging.getLogger(__name__)
+
+# Пара, яку не забрали за добу, вже не актуальна
+ITEM_TTL = 24 * 60 * 60
+REFILL_LOCK_TTL = 60
+VERSION_KEY = "guess_pair_pool:version"
+
+# Скільки пар поспіль можна пропустити, якщо промпт з пари видалено
+MAX_STALE_PAIRS = 3
+
+
+class GuessPairPool:
+    def _prefix(self, min_rate: int, max_rate: int) -> str:
+        version = cache.get(VERSION_KEY, 0)
+        return f"guess_pair_pool:{version}:{min_rate}-{max_rate}"
+
+    def _size(self, prefix: str) -> int:
+        state = cache.get_many([f"{prefix}:head", f"{prefix}:tail"])
+        return max(0, state.get(f"{prefix}:tail", 0) - state.get(f"{prefix}:head", 0))
+
+    def size(self, min_rate: int, max_rate: int) -> int:
+        return self._size(self._prefix(min_rate, max_rate))
+
+    def _pop_ids(self, prefix: str) -> tuple[int, int] | None:
+        head_key = f"{prefix}:head"
+        position = incr_counter(head_key)
+        item_key = f"{prefix}:item:{position}"
+        pair = cache.get(item_key)
+        if pair is not None:
+            cache.delete(item_key)
+        return pair
+
+    def pop(self, min_rate: int, max_rate: int) -> tuple[Prompt, Prompt] | None:
+        """Забирає пару (кращий, гірший) або None, якщо пул порожній."""
+        prefix = self._prefix(min_rate, max_rate)
+        try:
+            for _ in range(MAX_STALE_PAIRS):
+                pair = self._pop_ids(prefix)
+                if pair is None:
+                    break
+                prompts = Prompt.objects.in_bulk(pair)
+                high, low = prompts.get(pair[0]), prompts.get(pair[1])
+                # Промпт видалено або переоцінено після того, як пару сформовано
+                if (
+                    high is not None
+                    and low is not None
+                    and high.rate >= min_rate
+                    and low.rate <= max_rate
+                ):
+                    return high, low
+            return None
+        finally:
+            if self._size(prefix) < settings.GUESS_PAIR_POOL_LOW_WATERMARK:
+                self.schedule_refill(min_rate, max_rate)
+
+    def pop_many(self, min_rate: int, max_rate: int, count: int) -> list[tuple]:
+        """Забирає до count пар id одним зверненням до кешу, без читання
+        промптів: їх перевіряє та читає одним запитом той, хто викликає."""
+        prefix = self._prefix(min_rate, max_rate)
+        head_key = f"{prefix}:head"
+        end = incr_counter(head_key, count)
+        item_keys = [
+            f"{prefix}:item:{position}" for position in range(end - count + 1, end + 1)
+        ]
+        items = cache.get_many(item_keys)
+        cache.delete_many(items.keys())
+
+        if self._size(prefix) < settings.GUESS_PAIR_POOL_LOW_WATERMARK:
+            self.schedule_refill(min_rate, max_rate)
+        return [tuple(items[key]) for key in item_keys if key in items]
+
+    def schedule_refill(self, min_rate: int, max_rate: int) -> None:
+        from .tasks import refill_guess_pair_pool_task
+
+        # Поки задача не завершилась, повторно її не ставимо
+        refill_key = f"{self._prefix(min_rate, max_rate)}:refill"
+        if cache.add(refill_key, 1, timeout=REFILL_LOCK_TTL):
+            refill_guess_pair_pool_task.delay(min_rate, max_rate)
+
+    def refill(self, min_rate: int, max_rate: int) -> int:
+        """Доповнює пул до GUESS_PAIR_POOL_SIZE і повертає кількість нових пар."""
+        prefix = self._prefix(min_rate, max_rate)
+        try:
+            added = 0
+            # Застарілі id прибираються з індексу, тож наступна спроба
+            # добирає пари вже з актуальних
+            for _ in range(MAX_STALE_PAIRS):
+                missing = settings.GUESS_PAIR_POOL_SIZE - self._size(prefix)
+                if missing <= 0:
+                    break
+
+                high_ids = prompt_sample_index.random_ids(min_rate, 10, missing)
+                low_ids = prompt_sample_index.random_ids(1, max_rate, missing)
+                if not high_ids or not low_ids:
+                    break
+                # Один запит, щоб відкинути видалені та переоцінені промпти
+                rates = dict(
+                    Prompt.objects.filter(id__in={*high_ids, *low_ids}).values_list(
+                        "id", "rate"
+                    )
+                )
+                stale = {
+                    prompt_id
+                    for prompt_id in high_ids
+                    if rates.get(prompt_id, 0) < min_rate
+                } | {
+                    prompt_id
+                    for prompt_id in low_ids
+                    if rates.get(prompt_id, max_rate + 1) > max_rate
+                }
+                if stale:
+                    prompt_sample_index.discard(stale, rates)
+
+                pairs = [
+                    (high_id, low_id)
+                    for high_id, low_id in zip(high_ids, low_ids)
+                    if high_id not in stale and low_id not in stale
+                ]
+                self._push(prefix, pairs)
+                added += len(pairs)
+            return added
+        finally:
+            cache.delete(f"{prefix}:refill")
+
+    def _push(self, prefix: str, pairs: list) -> None:
+        head = cache.get(f"{prefix}:head", 0)
+        tail = cache.get(f"{prefix}:tail", 0)
+        # Раунди, що звернулися до порожнього пулу, просунули head за tail
+        start = max(head, tail)
+        cache.set_many(
+            {f"{prefix}:item:{start + i}": pair for i, pair in enumerate(pairs, 1)},
+            timeout=ITEM_TTL,
+        )
+        cache.set(f"{prefix}:tail", start + len(pairs), None)
+
+    def invalidate(self) -> None:
+        """Відкидає всі пари в чергах, наприклад після масової зміни оцінок."""
+        incr_counter(VERSION_KEY)
+
+
+guess_pair_pool = GuessPairPool()
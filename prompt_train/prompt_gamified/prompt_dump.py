@@ -0,0 +1,193 @@
+"""Потокове вивантаження та завантаження промптів (JSONL або CSV).
+
+Рядки йдуть через PostgreSQL COPY, тож пам'ять не залежить від розміру
+набору: експорт пише рядки у файл одразу з курсора, а імпорт читає файл
+пачками по batch_size. Автор промпта передається нікнеймом. Під час
+імпорту нікнейми пачки перетворюються на id одним запитом, а промпти з
+текстом, що вже є в базі або трапився раніше у файлі, пропускаються —
+дублікати шукаються за md5 тексту через індекс prompt_text_md5_idx.
+
+MinHash-відбитки (Prompt.minhash_bands) рахуються в Python і є
+найдовшою частиною імпорту, тому їх можна рахувати в кількох процесах.
+"""
+
+import csv
+import hashlib
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+
+from django.db import connection
+from django.db.models.functions import MD5
+
+from users.models import CustomUser
+
+from .fingerprints import minhash_bands
+from .models import Prompt
+
+FIELDS = ("prompt_text", "improvement_hint", "rate", "evaluator_version", "user")
+FORMATS = ("jsonl", "csv")
+
+# Скільки нікнеймів тримати в пам'яті між пачками
+USER_CACHE_SIZE = 100_000
+
+TEXT_MAX_LENGTH = Prompt._meta.get_field("prompt_text").max_length
+HINT_MAX_LENGTH = Prompt._meta.get_field("improvement_hint").max_length
+VERSION_MAX_LENGTH = Prompt._meta.get_field("evaluator_version").max_length
+
+
+@dataclass
+class ImportStats:
+    imported: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    unknown_users: int = 0
+
+
+def format_for_path(path: str) -> str:
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def export_prompts(out, fmt: str) -> int:
+    """Пише всі промпти в бінарний потік out. Повертає кількість рядків."""
+    sql = (
+        "SELECT p.prompt_text, p.improvement_hint, p.rate, p.evaluator_version,"
+        " u.nickname"
+        f" FROM {Prompt._meta.db_table} p"
+        f" LEFT JOIN {CustomUser._meta.db_table} u ON u.id = p.user_id"
+        " ORDER BY p.id"
+    )
+    exported = 0
+    with connection.cursor() as cursor:
+        if fmt == "csv":
+            out.write((",".join(FIELDS) + "\n").encode())
+            with cursor.copy(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv)") as copy:
+                for data in copy:
+                    out.write(data)
+            return Prompt.objects.count()
+
+        with cursor.copy(f"COPY ({sql}) TO STDOUT") as copy:
+            copy.set_types(["text", "text", "int4", "text", "text"])
+            for row in copy.rows():
+                line = json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False)
+                out.write(f"{line}\n".encode())
+                exported += 1
+    return exported
+
+
+def _read_rows(stream, fmt: str):
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if fmt == "csv":
+        yield from csv.DictReader(text)
+        return
+    for line in text:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Пошкоджений рядок рахується як некоректний
+                yield None
+
+
+def _clean(row: dict) -> dict | None:
+    """Перевіряє рядок файлу. None — рядок некоректний."""
+    try:
+        rate = int(row["rate"])
+        prompt_text = row["prompt_text"].strip()
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+    if not prompt_text or len(prompt_text) > TEXT_MAX_LENGTH or not 1 <= rate <= 10:
+        return None
+    return {
+        "prompt_text": prompt_text,
+        "improvement_hint": (row.get("improvement_hint") or "")[:HINT_MAX_LENGTH],
+        "rate": rate,
+        "evaluator_version": (row.get("evaluator_version") or "")[:VERSION_MAX_LENGTH],
+        "user": row.get("user") or None,
+    }
+
+
+def _text_hash(prompt_text: str) -> str:
+    # Те саме значення, що md5(prompt_text) у PostgreSQL
+    return hashlib.md5(prompt_text.encode()).hexdigest()
+
+
+def _resolve_users(nicknames: set, users: dict) -> None:
+    if len(users) + len(nicknames) > USER_CACHE_SIZE:
+        users.clear()
+    missing = nicknames - users.keys()
+    if not missing:
+        return
+    users.update({nickname: None for nickname in missing})
+    users.update(
+        CustomUser.objects.filter(nickname__in=missing).values_list("nickname", "id")
+    )
+
+
+def _import_batch(rows: list, users: dict, stats: ImportStats, executor) -> None:
+    by_hash = {}
+    for row in rows:
+        by_hash.setdefault(_text_hash(row["prompt_text"]), row)
+    existing = set(
+        Prompt.objects.annotate(text_hash=MD5("prompt_text"))
+        .filter(text_hash__in=by_hash.keys())
+        .values_list("text_hash", flat=True)
+    )
+    new_rows = [row for text_hash, row in by_hash.items() if text_hash not in existing]
+    stats.duplicates += len(rows) - len(new_rows)
+    if not new_rows:
+        return
+
+    _resolve_users({row["user"] for row in new_rows if row["user"]}, users)
+    texts = [row["prompt_text"] for row in new_rows]
+    bands = (
+        executor.map(minhash_bands, texts, chunksize=256)
+        if executor
+        else map(minhash_bands, texts)
+    )
+
+    columns = (
+        "prompt_text, improvement_hint, rate, evaluator_version, user_id, minhash_bands"
+    )
+    with (
+        connection.cursor() as cursor,
+        cursor.copy(f"COPY {Prompt._meta.db_table} ({columns}) FROM STDIN") as copy,
+    ):
+        for row, row_bands in zip(new_rows, bands):
+            user_id = users.get(row["user"]) if row["user"] else None
+            if row["user"] and user_id is None:
+                stats.unknown_users += 1
+            copy.write_row(
+                (
+                    row["prompt_text"],
+                    row["improvement_hint"],
+                    row["rate"],
+                    row["evaluator_version"],
+                    user_id,
+                    row_bands,
+                )
+            )
+    stats.imported += len(new_rows)
+
+
+def import_prompts(
+    stream, fmt: str, batch_size: int = 5000, workers: int = 1
+) -> ImportStats:
+    """Завантажує промпти з бінарного потоку stream пачками по batch_size."""
+    stats = ImportStats()
+    users = {}
+    rows = _read_rows(stream, fmt)
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        while batch := list(islice(rows, batch_size)):
+            cleaned = [_clean(row) for row in batch]
+            valid = [row for row in cleaned if row is not None]
+            stats.invalid += len(cleaned) - len(valid)
+            if valid:
+                _import_batch(valid, users, stats, executor)
+    finally:
+        if executor:
+            executor.shutdown()
+    return stats
@@ -0,0 +1,322 @@
+"""Спільний для всіх процесів ліміт запитів до LLM провайдера.
+
+Ліміти запитів (RPM) та токенів (TPM) — token bucket у Redis, тому вони діють
+на всі web-процеси та Celery воркери разом. Відро вміщує хвилинний ліміт і
+наповнюється рівномірно, пропорційно часу, що минув; перевірка та списання
+обох відер виконуються одним Lua-скриптом. На відміну від хвилинних вікон,
+на межі хвилини не проходить подвійний ліміт.
+
+Коли ліміт вичерпано, виклик чекає в черзі замість помилки. Нижчі пріоритети
+можуть використати лише частку відра і поступаються вищим, поки ті чекають.
+
+Без LLM_RATE_LIMIT_REDIS_URL відра зберігаються в пам'яті процесу — для
+тестів і локальної розробки, як у лідерборді.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from enum import IntEnum
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .counters import incr_counter
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    CHALLENGE = 0
+    TRAINER = 1
+    BACKGROUND = 2
+
+
+# Частка відра, доступна пріоритету; решта резервується для вищих
+PRIORITY_SHARE = {
+    Priority.CHALLENGE: 1.0,
+    Priority.TRAINER: 0.8,
+    Priority.BACKGROUND: 0.5,
+}
+
+# За стільки секунд порожнє відро наповнюється повністю
+WINDOW_SECONDS = 60
+
+BUCKET_PREFIX = "llm_rate:bucket:"
+
+
+class RateLimitTimeout(Exception):
+    """Ліміт не звільнився за LLM_RATE_LIMIT_MAX_WAIT секунд."""
+
+
+def _stat_key(priority: Priority, name: str) -> str:
+    return f"llm_rate:{priority.name.lower()}:{name}"
+
+
+def _decr(key: str, delta: int = 1) -> None:
+    try:
+        cache.decr(key, delta)
+    except ValueError:
+        # Ключ уже протермінований — нічого повертати
+        pass
+
+
+@dataclass(frozen=True)
+class Bucket:
+    key: str
+    capacity: float
+    # Скільки одиниць ліміту повертається у відро за секунду
+    rate: float
+    cost: float
+    # Рівень відра, потрібний, щоб списати cost з урахуванням резерву
+    need: float
+
+
+# Відро без стану вважається повним. Списання відбувається, лише якщо
+# вистачає в усіх відрах. Час передає процес; якщо його годинник відстає
+# від інших, ті самі секунди не нараховуються відру вдруге.
+TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local levels = {}
+local stamps = {}
+for i, key in ipairs(KEYS) do
+    local base = 2 + (i - 1) * 4
+    local capacity = tonumber(ARGV[base + 1])
+    local rate = tonumber(ARGV[base + 2])
+    local need = tonumber(ARGV[base + 4])
+    local state = redis.call("HMGET", key, "level", "ts")
+    local level = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    level = math.min(capacity, level + math.max(0, now - ts) * rate)
+    if level < need then
+        return 0
+    end
+    levels[i] = level
+    stamps[i] = math.max(ts, now)
+end
+for i, key in ipairs(KEYS) do
+    local cost = tonumber(ARGV[2 + (i - 1) * 4 + 3])
+    redis.call(
+        "HSET", key, "level", tostring(levels[i] - cost), "ts", tostring(stamps[i])
+    )
+    redis.call("EXPIRE", key, ttl)
+end
+return 1
+"""
+
+
+class RedisBucketStore:
+    def __init__(self, url: str):
+        self._url = url
+        self._client = None
+        self._take = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self._url)
+        return self._client
+
+    def take(self, buckets: list[Bucket], now: float) -> bool:
+        if self._take is None:
+            # EVALSHA, а після перезапуску Redis — знову EVAL
+            self._take = self.client.register_script(TAKE_SCRIPT)
+        args = [now, WINDOW_SECONDS * 2]
+        for bucket in buckets:
+            args.extend([bucket.capacity, bucket.rate, bucket.cost, bucket.need])
+        return bool(self._take(keys=[bucket.key for bucket in buckets], args=args))
+
+
+class MemoryBucketStore:
+    """Ті самі відра в пам'яті процесу."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def take(self, buckets: list[Bucket], now: float) -> bool:
+        with self._lock:
+            updated = {}
+            for bucket in buckets:
+                level, ts = self._state.get(bucket.key, (bucket.capacity, now))
+                level = min(bucket.capacity, level + max(0.0, now - ts) * bucket.rate)
+                if level < bucket.need:
+                    return False
+                updated[bucket.key] = (level - bucket.cost, max(ts, now))
+            self._state.update(updated)
+            return True
+
+
+class LLMRateLimiter:
+    def __init__(self, poll_interval: float = 0.1, clock=time.time):
+        self.poll_interval = poll_interval
+        # Годинник для наповнення відер; тести підставляють сталий час
+        self.clock = clock
+        self._store = None
+        self._store_url = None
+
+    @property
+    def store(self):
+        url = settings.LLM_RATE_LIMIT_REDIS_URL
+        if self._store is None or url != self._store_url:
+            self._store = RedisBucketStore(url) if url else MemoryBucketStore()
+            self._store_url = url
+        return self._store
+
+    def _buckets(self, priority: Priority, tokens: int) -> list[Bucket]:
+        share = PRIORITY_SHARE[priority]
+        buckets = []
+        for name, limit, cost in (
+            ("requests", settings.LLM_RATE_LIMIT_RPM, 1),
+            ("tokens", settings.LLM_RATE_LIMIT_TPM, tokens),
+        ):
+            if not limit:
+                continue
+            # Запит, більший за відро, чекає, поки воно наповниться повністю
+            cost = min(cost, limit)
+            buckets.append(
+                Bucket(
+                    key=BUCKET_PREFIX + name,
+                    capacity=limit,
+                    rate=limit / WINDOW_SECONDS,
+                    cost=cost,
+                    # Після списання у відрі має лишитися резерв вищих пріоритетів
+                    need=cost + (1 - share) * (limit - cost),
+                )
+            )
+        return buckets
+
+    def _try_take(self, priority: Priority, tokens: int) -> bool:
+        buckets = self._buckets(priority, tokens)
+        if not buckets:
+            return True
+        return self.store.take(buckets, self.clock())
+
+    def _higher_priority_waiting(self, priority: Priority) -> bool:
+        return any(
+            cache.get(_stat_key(higher, "waiting"), 0) > 0
+            for higher in Priority
+            if higher < priority
+        )
+
+    def try_acquire(self, priority: Priority, tokens: int) -> bool:
+        """Бере місце в ліміті лише якщо воно є зараз, без черги."""
+        if self._higher_priority_waiting(priority):
+            return False
+        return self._try_take(priority, tokens)
+
+    def acquire(self, priority: Priority, tokens: int) -> float:
+        """Чекає, поки ліміт дозволить запит, і повертає час очікування."""
+        started = time.monotonic()
+        deadline = started + settings.LLM_RATE_LIMIT_MAX_WAIT
+        waiting_key = _stat_key(priority, "waiting")
+        queued = False
+
+        try:
+            while True:
+                if not self._higher_priority_waiting(priority) and self._try_take(
+                    priority, tokens
+                ):
+                    break
+
+                if time.monotonic() >= deadline:
+                    incr_counter(_stat_key(priority, "timeouts"))
+                    raise RateLimitTimeout(
+                        f"LLM rate limit queue timeout for {priority.name}"
+                    )
+
+                if not queued:
+                    # Лічильник живе не довше за максимальне очікування, тож
+                    # процес, що впав у черзі, не блокує нижчі пріоритети
+                    incr_counter(
+                        waiting_key, timeout=settings.LLM_RATE_LIMIT_MAX_WAIT + 60
+                    )
+                    queued = True
+                time.sleep(self.poll_interval)
+        finally:
+            if queued:
+                _decr(waiting_key)
+
+        waited = time.monotonic() - started
+        self._record_wait(priority, waited)
+        return waited
+
+    async def aacquire(self, priority: Priority, tokens: int) -> float:
+        """Async-версія acquire: чекає в черзі, не займаючи потік."""
+        started = time.monotonic()
+        deadline = started + settings.LLM_RATE_LIMIT_MAX_WAIT
+        waiting_key = _stat_key(priority, "waiting")
+        # Лише кеш: пул потоків, а не спільний з ORM потік thread_sensitive
+        try_acquire = sync_to_async(self.try_acquire, thread_sensitive=False)
+        queued = False
+
+        try:
+            while not await try_acquire(priority, tokens):
+                if time.monotonic() >= deadline:
+                    await sync_to_async(incr_counter, thread_sensitive=False)(
+                        _stat_key(priority, "timeouts")
+                    )
+                    raise RateLimitTimeout(
+                        f"LLM rate limit queue timeout for {priority.name}"
+                    )
+
+                if not queued:
+                    await sync_to_async(incr_counter, thread_sensitive=False)(
+                        waiting_key, timeout=settings.LLM_RATE_LIMIT_MAX_WAIT + 60
+                    )
+                    queued = True
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            if queued:
+                await sync_to_async(_decr, thread_sensitive=False)(waiting_key)
+
+        waited = time.monotonic() - started
+        await sync_to_async(self._record_wait, thread_sensitive=False)(priority, waited)
+        return waited
+
+    def _record_wait(self, priority: Priority, waited: float) -> None:
+        waited_ms = int(waited * 1000)
+        incr_counter(_stat_key(priority, "acquired"))
+        incr_counter(_stat_key(priority, "wait_ms"), waited_ms)
+        max_key = _stat_key(priority, "max_wait_ms")
+        if waited_ms > cache.get(max_key, 0):
+            cache.set(max_key, waited_ms, timeout=None)
+        if waited_ms >= 1000:
+            logger.info(
+                "LLM call (%s) waited %d ms for rate limit", priority.name, waited_ms
+            )
+
+    def stats(self) -> dict:
+        result = {}
+        for priority in Priority:
+            acquired = cache.get(_stat_key(priority, "acquired"), 0)
+            wait_ms = cache.get(_stat_key(priority, "wait_ms"), 0)
+            result[priority.name.lower()] = {
+                "queue_depth": max(0, cache.get(_stat_key(priority, "waiting"), 0)),
+                "acquired": acquired,
+                "timeouts": cache.get(_stat_key(priority, "timeouts"), 0),
+                "avg_wait_ms": round(wait_ms / acquired) if acquired else 0,
+                "max_wait_ms": cache.get(_stat_key(priority, "max_wait_ms"), 0),
+            }
+        return result
+
+    def reset_stats(self) -> None:
+        cache.delete_many(
+            [
+                _stat_key(priority, name)
+                for priority in Priority
+                for name in ("acquired", "timeouts", "wait_ms", "max_wait_ms")
+            ]
+        )
+
+
+llm_rate_limiter = LLMRateLimiter()
+
+
+def get_rate_limiter_stats() -> dict:
+    return llm_rate_limiter.stats()
@@ -0,0 +1,289 @@
+"""Захист виклику LLM провайдера: дедлайни, circuit breaker та hedged запити.
+
+Стан circuit breaker і лічильники hedged запитів зберігаються у спільному
+кеші (Redis), тому їх видно з усіх процесів. Затримки для p95 рахуються
+в межах процесу.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .counters import incr_counter
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Провайдер вважається недоступним, запит не надсилається."""
+
+
+class DeadlineExceeded(Exception):
+    """Виклик не завершився за LLM_CALL_DEADLINE секунд."""
+
+
+class CircuitBreaker:
+    """Після LLM_BREAKER_FAILURES помилок поспіль breaker розмикається на
+    LLM_BREAKER_COOLDOWN секунд. Потім один пробний запит (half-open)
+    вирішує, замкнути його знову чи продовжити паузу.
+    """
+
+    def __init__(self, name: str):
+        self.failures_key = f"circuit:{name}:failures"
+        self.open_until_key = f"circuit:{name}:open_until"
+        self.probe_key = f"circuit:{name}:probe"
+        self.opened_key = f"circuit:{name}:opened_total"
+
+    def state(self) -> str:
+        open_until = cache.get(self.open_until_key)
+        if open_until is None:
+            return "closed"
+        return "open" if time.time() < open_until else "half_open"
+
+    def is_open(self) -> bool:
+        return self.state() == "open"
+
+    def allow_request(self) -> bool:
+        state = self.state()
+        if state == "closed":
+            return True
+        if state == "open":
+            return False
+        # Half-open: пропускаємо лише один пробний запит на всі процеси
+        return cache.add(self.probe_key, 1, timeout=settings.LLM_CALL_DEADLINE * 2)
+
+    def record_success(self) -> None:
+        if cache.get(self.failures_key) or cache.get(self.open_until_key):
+            cache.delete_many([self.failures_key, self.open_until_key, self.probe_key])
+            logger.info("Circuit %s closed", self.failures_key)
+
+    def record_failure(self) -> None:
+        failures = incr_counter(self.failures_key)
+        if failures >= settings.LLM_BREAKER_FAILURES:
+            cache.set(
+                self.open_until_key,
+                time.time() + settings.LLM_BREAKER_COOLDOWN,
+                timeout=None,
+            )
+            cache.delete(self.probe_key)
+            incr_counter(self.opened_key)
+            logger.warning(
+                "Circuit %s opened after %d consecutive failures",
+                self.failures_key,
+                failures,
+            )
+
+    def stats(self) -> dict:
+        open_until = cache.get(self.open_until_key)
+        return {
+            "state": self.state(),
+            "consecutive_failures": cache.get(self.failures_key, 0),
+            "open_until": open_until,
+            "opened_total": cache.get(self.opened_key, 0),
+        }
+
+
+class LatencyTracker:
+    """Тривалість останніх успішних викликів у межах процесу."""
+
+    def __init__(self, size: int = 200):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent: float) -> float | None:
+        with self._lock:
+            samples = sorted(self._samples)
+        # Замало даних для стабільної оцінки
+        if len(samples) < 20:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+HEDGES_SENT_KEY = "hedge:sent"
+HEDGE_WINS_KEY = "hedge:wins"
+POOL_SATURATED_KEY = "hedge:pool_saturated"
+
+
+class HedgedCaller:
+    """Виконує виклик з дедлайном; якщо увімкнено hedging і відповідь не
+    прийшла за p95 затримки, надсилає другий такий самий запит і повертає
+    ту відповідь, що надійде першою.
+
+    Запит, що не вклався в дедлайн, далі займає потік пулу до свого
+    таймауту. Тому в пул потрапляє не більше LLM_HEDGE_MAX_WORKERS викликів
+    одночасно: коли всі потоки зайняті, основний запит виконується в потоці
+    виклику без hedging, а другий запит не надсилається — замість черги за
+    покинутими викликами.
+    """
+
+    def __init__(self):
+        self.latency = LatencyTracker()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._slots = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Після fork потоки батьківського процесу недоступні
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.LLM_HEDGE_MAX_WORKERS,
+                    thread_name_prefix="llm-call",
+                )
+                self._slots = threading.BoundedSemaphore(settings.LLM_HEDGE_MAX_WORKERS)
+            return self._executor
+
+    def _submit(self, fn, timeout: float):
+        """Future виклику в пулі або None, якщо вільних потоків немає."""
+        executor = self._get_executor()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            return None
+        try:
+            future = executor.submit(fn, timeout)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def hedge_delay(self) -> float:
+        p95 = self.latency.percentile(95)
+        return max(settings.LLM_HEDGE_MIN_DELAY, p95 or 0.0)
+
+    def call(self, fn, deadline: float, try_hedge=None):
+        """Викликає fn(timeout) до моменту deadline (time.monotonic()).
+
+        try_hedge() повертає False, якщо другий запит надсилати не можна
+        (наприклад, вичерпано ліміт провайдера).
+        """
+        started = time.monotonic()
+        primary = self._submit(fn, deadline - started)
+        if primary is None:
+            incr_counter(POOL_SATURATED_KEY)
+            result = fn(deadline - started)
+            self.latency.record(time.monotonic() - started)
+            return result
+        pending = {primary}
+        hedge = None
+
+        if settings.LLM_HEDGE_ENABLED:
+            hedge_at = min(deadline, started + self.hedge_delay())
+            done, _ = wait(pending, timeout=hedge_at - started)
+            if (
+                not done
+                and time.monotonic() < deadline
+                and (try_hedge is None or try_hedge())
+            ):
+                hedge = self._submit(fn, deadline - time.monotonic())
+                if hedge is None:
+                    incr_counter(POOL_SATURATED_KEY)
+                else:
+                    pending.add(hedge)
+                    incr_counter(HEDGES_SENT_KEY)
+
+        error = None
+        while pending:
+            done, pending = wait(
+                pending,
+                timeout=max(0.0, deadline - time.monotonic()),
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                break
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                self.latency.record(time.monotonic() - started)
+                if future is hedge:
+                    incr_counter(HEDGE_WINS_KEY)
+                return future.result()
+
+        if error is not None and not pending:
+            raise error
+        raise DeadlineExceeded(f"LLM call exceeded {deadline - started:.1f}s deadline")
+
+    async def acall(self, fn, deadline: float, try_hedge=None):
+        """Async-версія call: fn(timeout) повертає корутину, try_hedge —
+        async-функцію. Запит, що програв, скасовується, і acall чекає, поки
+        скасування завершиться."""
+        started = time.monotonic()
+        pending = {asyncio.ensure_future(fn(deadline - started))}
+        hedge = None
+
+        try:
+            if settings.LLM_HEDGE_ENABLED:
+                hedge_at = min(deadline, started + self.hedge_delay())
+                done, _ = await asyncio.wait(pending, timeout=hedge_at - started)
+                if (
+                    not done
+                    and time.monotonic() < deadline
+                    and (try_hedge is None or await try_hedge())
+                ):
+                    hedge = asyncio.ensure_future(fn(deadline - time.monotonic()))
+                    pending.add(hedge)
+                    await sync_to_async(incr_counter, thread_sensitive=False)(
+                        HEDGES_SENT_KEY
+                    )
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(0.0, deadline - time.monotonic()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    self.latency.record(time.monotonic() - started)
+                    if task is hedge:
+                        await sync_to_async(incr_counter, thread_sensitive=False)(
+                            HEDGE_WINS_KEY
+                        )
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            # Скасовані запити встигають додати свої витрати до того, як
+            # оцінку запишуть у метрики
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if error is not None and not pending:
+            raise error
+        raise DeadlineExceeded(f"LLM call exceeded {deadline - started:.1f}s deadline")
+
+    def stats(self) -> dict:
+        sent = cache.get(HEDGES_SENT_KEY, 0)
+        wins = cache.get(HEDGE_WINS_KEY, 0)
+        p95 = self.latency.percentile(95)
+        return {
+            "enabled": settings.LLM_HEDGE_ENABLED,
+            "hedges_sent": sent,
+            "hedge_wins": wins,
+            "hedge_win_rate": round(wins / sent, 3) if sent else 0.0,
+            "pool_saturated": cache.get(POOL_SATURATED_KEY, 0),
+            "p95_latency": round(p95, 3) if p95 is not None else None,
+        }
+
+
+llm_circuit_breaker = CircuitBreaker("llm")
+llm_hedged_caller = HedgedCaller()
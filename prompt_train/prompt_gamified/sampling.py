@@ -0,0 +1,252 @@
+"""Вибірка випадкового промпта в діапазоні оцінок без читання всієї таблиці.
+
+id промптів розкладені по кошиках оцінок 1–10 — множинах Redis
+(KEY_PREFIX + оцінка). Випадковий промпт обирається за сталий час: SCARD
+кошиків діапазону, кошик — з імовірністю, пропорційною його розміру, id —
+SRANDMEMBER у кошику. Потім читається один рядок за первинним ключем.
+
+Новий промпт або промпт зі зміненою оцінкою потрапляє у свій кошик після
+коміту транзакції — тож порядок комітів різних процесів нічого не губить.
+Видалені промпти та промпти, змінені в обхід моделі, виправляються під час
+вибірки. Після масової зміни оцінок (rescore_prompts, імпорт) invalidate()
+ставить задачу повної перебудови з бази; її ж ставить вибірка з порожнього
+індексу. Запити користувачів індекс не перебудовують.
+
+Без PROMPT_SAMPLE_REDIS_URL кошики зберігаються в пам'яті процесу — для
+тестів і локальної розробки, як у лідерборді.
+"""
+
+import logging
+import random
+from collections import Counter
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Prompt
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "prompt_sample:"
+REBUILD_SUFFIX = ":rebuild"
+REBUILD_LOCK_KEY = "prompt_sample:rebuild"
+REBUILD_LOCK_TTL = 60
+
+RATES = range(1, 11)
+
+# Скільки разів шукати заміну промпту, що зник або змінив оцінку
+MAX_ATTEMPTS = 5
+
+
+def _key(rate: int) -> str:
+    return f"{KEY_PREFIX}{rate}"
+
+
+class RedisStore:
+    def __init__(self, url: str):
+        self._url = url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self._url, decode_responses=True)
+        return self._client
+
+    def add(self, prompt_id: int, rate: int) -> None:
+        # Промпт міг бути в кошику старої оцінки — переносимо атомарно
+        with self.client.pipeline() as pipe:
+            for other in RATES:
+                if other != rate:
+                    pipe.srem(_key(other), prompt_id)
+            pipe.sadd(_key(rate), prompt_id)
+            pipe.execute()
+
+    def remove(self, prompt_ids) -> None:
+        with self.client.pipeline() as pipe:
+            for rate in RATES:
+                pipe.srem(_key(rate), *prompt_ids)
+            pipe.execute()
+
+    def sizes(self) -> dict[int, int]:
+        with self.client.pipeline(transaction=False) as pipe:
+            for rate in RATES:
+                pipe.scard(_key(rate))
+            return dict(zip(RATES, pipe.execute()))
+
+    def sample(self, rate: int, count: int) -> list[int]:
+        # Від'ємна кількість — вибірка з повтореннями
+        return [
+            int(prompt_id) for prompt_id in self.client.srandmember(_key(rate), -count)
+        ]
+
+    def replace(self, rows) -> int:
+        # Новий стан збирається в окремих ключах і підміняє старий атомарно
+        self.client.delete(*(_key(rate) + REBUILD_SUFFIX for rate in RATES))
+        written = 0
+        filled = set()
+        with self.client.pipeline(transaction=False) as pipe:
+            for prompt_id, rate in rows:
+                if rate not in RATES:
+                    continue
+                pipe.sadd(_key(rate) + REBUILD_SUFFIX, prompt_id)
+                filled.add(rate)
+                written += 1
+                if written % 10000 == 0:
+                    pipe.execute()
+            pipe.execute()
+
+        with self.client.pipeline() as pipe:
+            for rate in RATES:
+                if rate in filled:
+                    pipe.rename(_key(rate) + REBUILD_SUFFIX, _key(rate))
+                else:
+                    pipe.delete(_key(rate))
+            pipe.execute()
+        return written
+
+
+class MemoryStore:
+    """Ті самі кошики в пам'яті процесу. Вибірка за сталий час: id у списку
+    кошика, а видалений id заміщується останнім."""
+
+    def __init__(self):
+        self._buckets = {rate: [] for rate in RATES}
+        self._positions = {}
+
+    def add(self, prompt_id: int, rate: int) -> None:
+        self.remove([prompt_id])
+        self._positions[prompt_id] = (rate, len(self._buckets[rate]))
+        self._buckets[rate].append(prompt_id)
+
+    def remove(self, prompt_ids) -> None:
+        for prompt_id in prompt_ids:
+            rate, index = self._positions.pop(prompt_id, (None, None))
+            if rate is None:
+                continue
+            bucket = self._buckets[rate]
+            last = bucket.pop()
+            if last != prompt_id:
+                bucket[index] = last
+                self._positions[last] = (rate, index)
+
+    def sizes(self) -> dict[int, int]:
+        return {rate: len(bucket) for rate, bucket in self._buckets.items()}
+
+    def sample(self, rate: int, count: int) -> list[int]:
+        return random.choices(self._buckets[rate], k=count)
+
+    def replace(self, rows) -> int:
+        self._buckets = {rate: [] for rate in RATES}
+        self._positions = {}
+        for prompt_id, rate in rows:
+            if rate in RATES:
+                self.add(prompt_id, rate)
+        return len(self._positions)
+
+
+class PromptSampleIndex:
+    def __init__(self):
+        self._store = None
+        self._store_url = None
+
+    @property
+    def store(self):
+        url = settings.PROMPT_SAMPLE_REDIS_URL
+        if self._store is None or url != self._store_url:
+            self._store = RedisStore(url) if url else MemoryStore()
+            self._store_url = url
+        return self._store
+
+    def _pick(self, min_rate: int, max_rate: int, count: int) -> list[int]:
+        try:
+            sizes = self.store.sizes()
+            if not any(sizes.values()):
+                self.schedule_rebuild()
+                return []
+
+            rates = [
+                rate for rate in RATES if min_rate <= rate <= max_rate and sizes[rate]
+            ]
+            if not rates:
+                return []
+
+            picks = Counter(
+                random.choices(rates, weights=[sizes[rate] for rate in rates], k=count)
+            )
+            ids = []
+            for rate, rate_count in picks.items():
+                ids.extend(self.store.sample(rate, rate_count))
+        except redis.RedisError as e:
+            # Без індексу гра показує «немає промптів», а не помилку сервера
+            logger.warning("Prompt sample index is unavailable: %s", e)
+            return []
+
+        random.shuffle(ids)
+        return ids
+
+    def random_prompt(self, min_rate: int = 1, max_rate: int = 10) -> Prompt | None:
+        """Випадковий промпт з оцінкою від min_rate до max_rate включно."""
+        for _ in range(MAX_ATTEMPTS):
+            ids = self._pick(min_rate, max_rate, 1)
+            if not ids:
+                return None
+
+            prompt = Prompt.objects.filter(id=ids[0]).first()
+            if prompt is not None and min_rate <= prompt.rate <= max_rate:
+                return prompt
+
+            # Промпт видалено або переоцінено: прибираємо з кошика, а якщо
+            # він отримав нову оцінку — переносимо у правильний
+            rates = {} if prompt is None else {prompt.id: int(prompt.rate)}
+            self.discard(ids, rates)
+
+        return None
+
+    def random_ids(self, min_rate: int, max_rate: int, count: int) -> list[int]:
+        """count випадкових id (з повтореннями) без звернення до таблиці.
+        Для фонових задач, що самі перевіряють id одним запитом."""
+        return self._pick(min_rate, max_rate, count)
+
+    def discard(self, prompt_ids, rates: dict[int, int]) -> None:
+        """Прибирає застарілі id з кошиків. Промпти, що є в rates, переносить
+        у кошик своєї поточної оцінки."""
+        try:
+            missing = set(prompt_ids) - set(rates)
+            if missing:
+                self.store.remove(missing)
+            for prompt_id, rate in rates.items():
+                self.store.add(prompt_id, rate)
+        except redis.RedisError as e:
+            logger.warning("Could not discard stale prompts from sample index: %s", e)
+
+    def add(self, prompt_id: int, rate: int) -> None:
+        """Кладе промпт у кошик його оцінки, прибираючи зі старого."""
+        try:
+            self.store.add(prompt_id, rate)
+        except redis.RedisError as e:
+            # Пропущений промпт поверне наступна перебудова
+            logger.warning("Could not add prompt %s to sample index: %s", prompt_id, e)
+
+    def rebuild(self) -> int:
+        """Збирає кошики з бази. Повертає кількість промптів."""
+        rows = Prompt.objects.values_list("id", "rate").iterator(chunk_size=10000)
+        return self.store.replace(rows)
+
+    def schedule_rebuild(self) -> None:
+        from .tasks import rebuild_prompt_sample_index_task
+
+        # Порожній індекс перебудовується у фоні не частіше ніж раз на
+        # REBUILD_LOCK_TTL секунд
+        if cache.add(REBUILD_LOCK_KEY, 1, timeout=REBUILD_LOCK_TTL):
+            rebuild_prompt_sample_index_task.delay()
+
+    def invalidate(self) -> None:
+        """Ставить перебудову індексу після масової зміни промптів."""
+        from .tasks import rebuild_prompt_sample_index_task
+
+        rebuild_prompt_sample_index_task.delay()
+
+
+prompt_sample_index = PromptSampleIndex()
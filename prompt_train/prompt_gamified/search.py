@@ -0,0 +1,93 @@
+"""Повнотекстовий пошук у бібліотеці промптів.
+
+Шукає за згенерованою колонкою Prompt.search_vector (текст промпта з вагою
+A, підказка з вагою B) через GIN індекс, тож час пошуку залежить від
+кількості збігів, а не від розміру таблиці. Кожне слово запиту шукається
+як префікс: "вірш осін" знайде "вірш про осінь".
+
+Результати впорядковані за релевантністю (ts_rank), а серед однакових — від
+новішого. Сторінки передаються курсором (rank, id) останнього результату,
+тож наступна сторінка не перечитує попередні, як OFFSET.
+"""
+
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import DecimalField, F, Q
+from django.db.models.functions import Cast
+
+from .models import Prompt
+
+# Довші запити не роблять пошук точнішим, лише повільнішим
+MAX_SEARCH_WORDS = 8
+
+
+def build_search_query(text: str) -> SearchQuery | None:
+    """tsquery з префіксами всіх слів тексту або None, якщо слів немає."""
+    # \w відкидає службові символи tsquery, тож raw запит безпечний
+    words = re.findall(r"\w+", text.lower())[:MAX_SEARCH_WORDS]
+    if not words:
+        return None
+    return SearchQuery(
+        " & ".join(f"{word}:*" for word in words), search_type="raw", config="simple"
+    )
+
+
+def encode_cursor(prompt: Prompt) -> str:
+    return f"{prompt.rank}_{prompt.id}"
+
+
+def decode_cursor(cursor: str | None) -> tuple[Decimal, int] | None:
+    if not cursor:
+        return None
+    try:
+        rank, prompt_id = cursor.split("_")
+        return Decimal(rank), int(prompt_id)
+    except (ValueError, InvalidOperation):
+        return None
+
+
+def search_queryset(query: SearchQuery, queryset=None):
+    """Промпти, що відповідають запиту, від найрелевантнішого."""
+    queryset = Prompt.objects.all() if queryset is None else queryset
+    return (
+        queryset.filter(search_vector=query)
+        # ts_rank повертає real, який не переживає перетворення у float
+        # Python без похибки; numeric порівнюється з курсором точно
+        .annotate(
+            rank=Cast(
+                SearchRank(F("search_vector"), query),
+                DecimalField(max_digits=12, decimal_places=9),
+            )
+        ).order_by("-rank", "-id")
+    )
+
+
+def search_prompts(
+    text: str,
+    min_rate: int = 1,
+    max_rate: int = 10,
+    cursor: str | None = None,
+    page_size: int | None = None,
+) -> tuple[list[Prompt], str | None]:
+    """Сторінка результатів пошуку і курсор наступної сторінки (або None)."""
+    page_size = page_size or settings.PROMPT_SEARCH_PAGE_SIZE
+    query = build_search_query(text)
+    if query is None:
+        return [], None
+
+    queryset = search_queryset(
+        query, Prompt.objects.filter(rate__gte=min_rate, rate__lte=max_rate)
+    ).only("id", "prompt_text", "improvement_hint", "rate")
+
+    after = decode_cursor(cursor)
+    if after is not None:
+        rank, prompt_id = after
+        queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=prompt_id))
+
+    results = list(queryset[: page_size + 1])
+    if len(results) > page_size:
+        return results[:page_size], encode_cursor(results[page_size - 1])
+    return results, None
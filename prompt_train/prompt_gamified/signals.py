@@ -0,0 +1,48 @@
+import copy
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Prompt
+from .sampling import prompt_sample_index
+from .similar_prompts import similar_prompts
+from .top_prompts import top_prompts
+
+
+@receiver(post_save, sender=Prompt)
+def update_sample_index(sender, instance, created, update_fields=None, **kwargs):
+    """Кладе промпт у кошик індексу вибірки після коміту: до нього інші
+    процеси не бачать рядка і відкинули б його id як видалений."""
+    if created or update_fields is None or "rate" in update_fields:
+        # rate могли передати дробовим, у базі він уже цілий
+        prompt_id, rate = instance.id, int(instance.rate)
+        transaction.on_commit(lambda: prompt_sample_index.add(prompt_id, rate))
+
+
+@receiver(post_save, sender=Prompt)
+def update_top_prompts(sender, instance, created, update_fields=None, **kwargs):
+    """Оновлює список найкращих промптів без повного перечитування. Як і
+    індекс вибірки — після коміту, щоб відкочена зміна не потрапила в список."""
+    # Знімок полів на момент збереження: instance можуть змінити до коміту
+    prompt = copy.copy(instance)
+    if created:
+        transaction.on_commit(lambda: top_prompts.add(prompt))
+    elif update_fields is None or {"rate", "prompt_text", "improvement_hint"} & set(
+        update_fields
+    ):
+        transaction.on_commit(lambda: top_prompts.update(prompt))
+
+
+@receiver(post_delete, sender=Prompt)
+def discard_top_prompt(sender, instance, **kwargs):
+    prompt_id = instance.id
+    transaction.on_commit(lambda: top_prompts.discard(prompt_id))
+
+
+@receiver(post_save, sender=Prompt)
+def schedule_similar_prompts_update(sender, instance, created, **kwargs):
+    """Новий приклад для схожих промптів потрапить в індекс з наступним оновленням."""
+    if created and instance.rate >= settings.SIMILAR_PROMPTS_MIN_RATE:
+        similar_prompts.schedule_update()
@@ -0,0 +1,323 @@
+"""Схожі високо оцінені промпти — приклади того, як виглядає промпт на 9/10.
+
+Індекс TF-IDF будується заздалегідь лише з промптів з оцінкою від
+SIMILAR_PROMPTS_MIN_RATE. Ознаки — слова та пари сусідніх слів
+(fingerprints.shingles), захешовані в FEATURES стовпців, тож словник не
+потрібен. Вектори нормовані, і косинусна схожість — це сума добутків ваг
+спільних ознак.
+
+Індекс зберігається як інвертовані списки у файлах .npy і читається через
+memmap: кожен процес відкриває ті самі сторінки з диска, а пошук
+переглядає лише списки ознак запиту. Без запиту до LLM і без сканування
+таблиці пошук триває мілісекунди.
+
+Індекс складається з двох сегментів: base — повна збірка (команда
+build_similar_prompts) і delta — промпти, додані після неї. Нові промпти
+з високою оцінкою ставлять Celery задачу, яка не частіше ніж раз на
+SIMILAR_PROMPTS_UPDATE_INTERVAL секунд перебудовує лише delta. Коли delta
+виростає до MERGE_RATIO від base, індекс збирається повністю. IDF
+рахується під час повної збірки; delta використовує IDF з base.
+
+Файли сегментів не змінюються після запису: новий стан з'являється, коли
+manifest.json атомарно замінюється, а процеси помічають це за часом зміни
+файлу. Повна збірка і доповнення delta з різних воркерів виконуються по
+черзі під файловим блокуванням у теці індексу, інакше delta могла б
+посилатися на base, яку щойно видалила повна збірка. Видалені та
+переоцінені промпти відсіює запит до БД за id кандидатів.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .evaluation_cache import normalize_prompt
+from .fingerprints import hash64, shingles
+from .models import Prompt
+
+logger = logging.getLogger(__name__)
+
+FEATURES = 1 << 18
+MANIFEST = "manifest.json"
+BUILD_LOCK = "build.lock"
+UPDATE_LOCK_KEY = "similar_prompts:update"
+
+# Частка від base, після якої delta зливається в повну збірку
+MERGE_RATIO = 0.2
+
+# Кандидатів на кожен результат: частину відкине перевірка в БД
+CANDIDATES_PER_RESULT = 4
+
+# Нижче цієї схожості промпт вже не є прикладом для того ж завдання
+MIN_SCORE = 0.1
+
+
+def _features(text: str) -> Counter:
+    return Counter(hash64(shingle) % FEATURES for shingle in shingles(text))
+
+
+def _weights(counts: Counter, idf: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Ознаки і нормовані ваги TF-IDF одного тексту."""
+    features = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    tf = 1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    weights = tf * idf[features]
+    norm = np.linalg.norm(weights)
+    if not norm:
+        return features[:0], weights[:0]
+    return features, (weights / norm).astype(np.float32)
+
+
+class Segment:
+    """Інвертовані списки частини індексу: для кожної ознаки — рядки і ваги."""
+
+    def __init__(self, path: Path):
+        self.ids = np.load(path / "ids.npy", mmap_mode="r")
+        self.indptr = np.load(path / "indptr.npy", mmap_mode="r")
+        self.rows = np.load(path / "rows.npy", mmap_mode="r")
+        self.weights = np.load(path / "weights.npy", mmap_mode="r")
+
+    def scores(
+        self, features: np.ndarray, weights: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """id промптів зі спільними ознаками та їх косинусна схожість із запитом."""
+        rows, contributions = [], []
+        for feature, weight in zip(features, weights):
+            start, end = self.indptr[feature], self.indptr[feature + 1]
+            if start < end:
+                rows.append(self.rows[start:end])
+                contributions.append(self.weights[start:end] * weight)
+        if not rows:
+            return self.ids[:0], np.zeros(0, dtype=np.float32)
+
+        unique_rows, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        return self.ids[unique_rows], np.bincount(
+            inverse, weights=np.concatenate(contributions)
+        )
+
+    @staticmethod
+    def write(path: Path, rows, idf: np.ndarray) -> int:
+        """Записує сегмент з рядків (id, текст) у нову теку path.
+        Повертає кількість записаних рядків."""
+        path.mkdir(parents=True)
+        ids = array("q")
+        feature_column, row_column, weight_column = array("q"), array("i"), array("f")
+        for prompt_id, text in rows:
+            features, weights = _weights(_features(text), idf)
+            if not len(features):
+                continue
+            row = len(ids)
+            ids.append(prompt_id)
+            feature_column.extend(features.tolist())
+            row_column.extend([row] * len(features))
+            weight_column.extend(weights.tolist())
+
+        features = np.frombuffer(feature_column, dtype=np.int64)
+        order = np.argsort(features, kind="stable")
+        indptr = np.zeros(FEATURES + 1, dtype=np.int64)
+        np.cumsum(np.bincount(features, minlength=FEATURES), out=indptr[1:])
+
+        np.save(path / "ids.npy", np.frombuffer(ids, dtype=np.int64))
+        np.save(path / "indptr.npy", indptr)
+        np.save(path / "rows.npy", np.frombuffer(row_column, dtype=np.int32)[order])
+        np.save(
+            path / "weights.npy", np.frombuffer(weight_column, dtype=np.float32)[order]
+        )
+        return len(ids)
+
+
+class SimilarPromptsIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded_version = None
+        self._segments = []
+        self._idf = None
+
+    @property
+    def path(self) -> Path:
+        return Path(settings.SIMILAR_PROMPTS_DIR)
+
+    def _read_manifest(self) -> dict | None:
+        try:
+            return json.loads((self.path / MANIFEST).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, manifest: dict) -> None:
+        temporary = self.path / f"{MANIFEST}.{uuid.uuid4().hex}"
+        temporary.write_text(json.dumps(manifest))
+        os.replace(temporary, self.path / MANIFEST)
+
+        # Процеси, що вже відкрили старі файли, читають їх і після видалення
+        segments = {manifest["base"], manifest.get("delta")}
+        for child in self.path.iterdir():
+            if child.is_dir() and child.name not in segments:
+                shutil.rmtree(child, ignore_errors=True)
+
+    def _rows(self, after_id: int = 0, max_id: int | None = None):
+        rows = Prompt.objects.filter(
+            id__gt=after_id, rate__gte=settings.SIMILAR_PROMPTS_MIN_RATE
+        )
+        if max_id is not None:
+            rows = rows.filter(id__lte=max_id)
+        return (
+            rows.order_by("id")
+            .values_list("id", "prompt_text")
+            .iterator(chunk_size=2000)
+        )
+
+    @contextmanager
+    def _build_lock(self):
+        """Одна збірка індексу одночасно на всі процеси, що ділять теку."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / BUILD_LOCK, "w") as lock_file:
+            # Блокування знімається разом із закриттям файлу
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def rebuild(self) -> int:
+        """Повна збірка індексу. Повертає кількість проіндексованих промптів."""
+        with self._build_lock():
+            return self._rebuild()
+
+    def _rebuild(self) -> int:
+        max_id = (
+            Prompt.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        )
+
+        # Перший прохід рахує, в скількох промптах зустрічається кожна ознака
+        document_frequency = np.zeros(FEATURES, dtype=np.int64)
+        documents = 0
+        for _, text in self._rows(max_id=max_id):
+            features = list(_features(text))
+            if features:
+                document_frequency[features] += 1
+                documents += 1
+        idf = (np.log((1 + documents) / (1 + document_frequency)) + 1).astype(
+            np.float32
+        )
+
+        base = f"base-{uuid.uuid4().hex}"
+        indexed = Segment.write(self.path / base, self._rows(max_id=max_id), idf)
+        np.save(self.path / base / "idf.npy", idf)
+        self._write_manifest(
+            {"base": base, "delta": None, "base_max_id": max_id, "base_rows": indexed}
+        )
+        return indexed
+
+    def update(self) -> int:
+        """Додає промпти, створені після повної збірки. Повертає їх кількість."""
+        with self._build_lock():
+            manifest = self._read_manifest()
+            if manifest is None:
+                return self._rebuild()
+
+            rows = list(self._rows(after_id=manifest["base_max_id"]))
+            if len(rows) > max(manifest["base_rows"], 1) * MERGE_RATIO:
+                return self._rebuild()
+
+            idf = np.load(self.path / manifest["base"] / "idf.npy")
+            delta = f"delta-{uuid.uuid4().hex}"
+            indexed = Segment.write(self.path / delta, rows, idf)
+
+            # Якщо base замінили попри блокування (flock ненадійний на деяких
+            # мережевих файлових системах), delta для старої base не публікуємо
+            current = self._read_manifest()
+            if current is None or current["base"] != manifest["base"]:
+                shutil.rmtree(self.path / delta, ignore_errors=True)
+                return 0
+            self._write_manifest({**current, "delta": delta})
+            return indexed
+
+    def schedule_update(self) -> None:
+        from .tasks import update_similar_prompts_task
+
+        # Усі нові промпти за інтервал потрапляють в одну перебудову delta
+        interval = settings.SIMILAR_PROMPTS_UPDATE_INTERVAL
+        if cache.add(UPDATE_LOCK_KEY, 1, timeout=interval):
+            update_similar_prompts_task.apply_async(countdown=interval)
+
+    def _load(self) -> list[Segment]:
+        try:
+            stat = (self.path / MANIFEST).stat()
+        except OSError:
+            return []
+        # os.replace дає маніфесту новий inode, навіть якщо час збігся
+        version = (stat.st_ino, stat.st_mtime_ns)
+
+        with self._lock:
+            if version != self._loaded_version:
+                manifest = self._read_manifest()
+                if manifest is None:
+                    return []
+                names = [manifest["base"], manifest.get("delta")]
+                self._segments = [
+                    Segment(self.path / name) for name in names if name is not None
+                ]
+                self._idf = np.load(
+                    self.path / manifest["base"] / "idf.npy", mmap_mode="r"
+                )
+                self._loaded_version = version
+            return self._segments
+
+    def similar(self, text: str, count: int | None = None) -> list[dict]:
+        """Найсхожіші на text промпти з високою оцінкою, від найсхожішого."""
+        count = count or settings.SIMILAR_PROMPTS_COUNT
+        try:
+            segments = self._load()
+        except OSError as e:
+            # Індекс саме замінюють: схожі промпти не обов'язкові
+            logger.warning("Could not load similar prompts index: %s", e)
+            return []
+        if not segments:
+            return []
+
+        features, weights = _weights(_features(text), self._idf)
+        if not len(features):
+            return []
+
+        ids, scores = zip(*(segment.scores(features, weights) for segment in segments))
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        keep = scores >= MIN_SCORE
+        ids, scores = ids[keep], scores[keep]
+
+        limit = min(len(ids), count * CANDIDATES_PER_RESULT)
+        if not limit:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        candidates = Prompt.objects.filter(
+            id__in=ids[top].tolist(), rate__gte=settings.SIMILAR_PROMPTS_MIN_RATE
+        ).in_bulk()
+        normalized = normalize_prompt(text)
+        results = []
+        for index in top:
+            prompt = candidates.get(int(ids[index]))
+            # Той самий текст — не приклад, а сам промпт користувача
+            if prompt is None or normalize_prompt(prompt.prompt_text) == normalized:
+                continue
+            results.append(
+                {
+                    "id": prompt.id,
+                    "prompt_text": prompt.prompt_text,
+                    "rate": prompt.rate,
+                    "similarity": round(float(scores[index]), 3),
+                }
+            )
+            if len(results) == count:
+                break
+        return results
+
+
+similar_prompts = SimilarPromptsIndex()
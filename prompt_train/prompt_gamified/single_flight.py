@@ -0,0 +1,157 @@
+"""Об'єднання однакових одночасних запитів (single-flight).
+
+Перший запит із ключем бере блокування в спільному кеші (Redis) і стає
+лідером; решта, з будь-якого процесу чи воркера, чекає на його результат
+замість власного виклику. На відміну від кешу оцінок, це працює ще до того,
+як будь-який результат з'явився.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from .counters import incr_stat
+
+logger = logging.getLogger(__name__)
+
+LEADERS_KEY = "single_flight:leaders"
+COALESCED_KEY = "single_flight:coalesced"
+
+# Результат потрібен лише тим, хто вже чекає; далі працює кеш оцінок
+RESULT_TTL = 30
+
+
+def _cache_call(fn):
+    """sync_to_async для операцій лише з кешем. thread_sensitive=True (як у
+    cache.aget та інших async-методах кешу Django) виконує їх в одному потоці
+    разом з ORM усіх запитів процесу; з'єднання з базою тут не потрібне, тож
+    вони йдуть у пул потоків."""
+    return sync_to_async(fn, thread_sensitive=False)
+
+
+class SingleFlightError(Exception):
+    """Лідер завершився помилкою або не встиг за відведений час."""
+
+
+def _lead(key: str, token: str, fn, timeout: int):
+    lock_key = f"single_flight:lock:{key}"
+    result_key = f"single_flight:result:{key}"
+    # Результат попереднього виклику з тим самим ключем вже не актуальний
+    cache.delete(result_key)
+    incr_stat(LEADERS_KEY)
+
+    try:
+        value = fn()
+    except Exception:
+        cache.set(result_key, {"ok": False}, RESULT_TTL)
+        raise
+    else:
+        cache.set(result_key, {"ok": True, "value": value}, RESULT_TTL)
+        return value
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def _shared_outcome(outcome: dict):
+    incr_stat(COALESCED_KEY)
+    if not outcome["ok"]:
+        raise SingleFlightError("Single-flight leader failed")
+    return outcome["value"]
+
+
+def single_flight(key: str, fn, timeout: int, poll_interval: float = 0.05):
+    """Викликає fn один раз на всі одночасні запити з однаковим key.
+
+    Повертає пару (результат, shared), де shared=True, якщо результат
+    отримано від іншого запиту. timeout має перевищувати найдовший виклик fn:
+    після нього блокування знімається, і чекаючий запит сам стає лідером.
+    """
+    lock_key = f"single_flight:lock:{key}"
+    result_key = f"single_flight:result:{key}"
+    deadline = time.monotonic() + timeout
+
+    while True:
+        token = uuid.uuid4().hex
+        if cache.add(lock_key, token, timeout=timeout):
+            return _lead(key, token, fn, timeout), False
+
+        while True:
+            outcome = cache.get(result_key)
+            if outcome is not None:
+                return _shared_outcome(outcome), True
+
+            if cache.get(lock_key) is None:
+                # Лідер міг встигнути записати результат і зняти блокування
+                outcome = cache.get(result_key)
+                if outcome is not None:
+                    return _shared_outcome(outcome), True
+                # Лідер зник без результату — пробуємо стати лідером самі
+                break
+
+            if time.monotonic() >= deadline:
+                raise SingleFlightError("Timed out waiting for single-flight leader")
+            time.sleep(poll_interval)
+
+
+async def _alead(key: str, token: str, fn):
+    lock_key = f"single_flight:lock:{key}"
+    result_key = f"single_flight:result:{key}"
+    await _cache_call(cache.delete)(result_key)
+    await _cache_call(incr_stat)(LEADERS_KEY)
+
+    try:
+        value = await fn()
+    except Exception:
+        await _cache_call(cache.set)(result_key, {"ok": False}, RESULT_TTL)
+        raise
+    else:
+        await _cache_call(cache.set)(
+            result_key, {"ok": True, "value": value}, RESULT_TTL
+        )
+        return value
+    finally:
+        if await _cache_call(cache.get)(lock_key) == token:
+            await _cache_call(cache.delete)(lock_key)
+
+
+async def asingle_flight(key: str, fn, timeout: int, poll_interval: float = 0.05):
+    """Async-версія single_flight: fn — async-функція без аргументів.
+
+    Працює з тими самими ключами, тому async та синхронні виклики
+    об'єднуються між собою.
+    """
+    lock_key = f"single_flight:lock:{key}"
+    result_key = f"single_flight:result:{key}"
+    deadline = time.monotonic() + timeout
+
+    while True:
+        token = uuid.uuid4().hex
+        if await _cache_call(cache.add)(lock_key, token, timeout=timeout):
+            return await _alead(key, token, fn), False
+
+        while True:
+            outcome = await _cache_call(cache.get)(result_key)
+            if outcome is not None:
+                return await _cache_call(_shared_outcome)(outcome), True
+
+            if await _cache_call(cache.get)(lock_key) is None:
+                outcome = await _cache_call(cache.get)(result_key)
+                if outcome is not None:
+                    return await _cache_call(_shared_outcome)(outcome), True
+                break
+
+            if time.monotonic() >= deadline:
+                raise SingleFlightError("Timed out waiting for single-flight leader")
+            await asyncio.sleep(poll_interval)
+
+
+def get_single_flight_stats() -> dict:
+    return {
+        "leaders": cache.get(LEADERS_KEY, 0),
+        "coalesced": cache.get(COALESCED_KEY, 0),
+    }
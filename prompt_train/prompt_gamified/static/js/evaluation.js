@@ -0,0 +1,148 @@
+// Отримання результату оцінювання промпта: WebSocket з опитуванням як резервом
+document.addEventListener("DOMContentLoaded", () => {
+    const container = document.querySelector("[data-evaluation-job]");
+    if (!container) {
+        return;
+    }
+
+    const jobId = container.dataset.evaluationJob;
+    const statusUrl = container.dataset.statusUrl;
+    const pollInterval = 2000;
+    const resultClasses = {
+        win: "alert-success",
+        draw: "alert-info",
+        loss: "alert-danger",
+    };
+    let finished = false;
+    let polling = false;
+    let pollTimeout;
+
+    function render(job) {
+        if (finished) {
+            return;
+        }
+        finished = true;
+        clearTimeout(pollTimeout);
+
+        if (job.status !== "done" || !job.result) {
+            container.querySelectorAll("[data-eval-pending]").forEach(el => el.classList.add("d-none"));
+            container.querySelectorAll("[data-eval-failed]").forEach(el => el.classList.remove("d-none"));
+            return;
+        }
+
+        container.querySelectorAll("[data-eval-field]").forEach(el => {
+            const value = job.result[el.dataset.evalField];
+            el.textContent = value === undefined || value === null ? "" : value;
+        });
+
+        const alert = container.querySelector("[data-eval-alert]");
+        if (alert && job.result.result) {
+            alert.classList.add(resultClasses[job.result.result] || "alert-secondary");
+        }
+
+        renderSimilar(job.result.similar_prompts || []);
+
+        container.querySelectorAll("[data-eval-pending]").forEach(el => el.classList.add("d-none"));
+        container.querySelectorAll("[data-eval-done]").forEach(el => el.classList.remove("d-none"));
+    }
+
+    // Приклади схожих промптів з високою оцінкою
+    function renderSimilar(prompts) {
+        const block = container.querySelector("[data-eval-similar]");
+        const list = container.querySelector("[data-eval-similar-list]");
+        if (!block || !list || !prompts.length) {
+            return;
+        }
+
+        list.replaceChildren(...prompts.map(prompt => {
+            const item = document.createElement("li");
+            item.className = "list-group-item";
+            const rate = document.createElement("strong");
+            rate.textContent = `${prompt.rate} / 10: `;
+            item.append(rate, prompt.prompt_text);
+            return item;
+        }));
+        block.classList.remove("d-none");
+    }
+
+    // Частковий результат під час стрімінгу; фінальний render() його перезапише
+    function renderPartial(data) {
+        if (finished) {
+            return;
+        }
+
+        if (data.kind === "score") {
+            container.querySelectorAll('[data-eval-field="prompt_rate"], [data-eval-field="user_rate"]')
+                .forEach(el => { el.textContent = data.rate; });
+            container.querySelectorAll('[data-eval-field="improvement_hint"]')
+                .forEach(el => { el.textContent = data.improvement_hint; });
+            container.querySelectorAll("[data-eval-pending]").forEach(el => el.classList.add("d-none"));
+            container.querySelectorAll("[data-eval-partial]").forEach(el => el.classList.remove("d-none"));
+        } else if (data.kind === "refined") {
+            container.querySelectorAll('[data-eval-field="refined_prompt"]')
+                .forEach(el => { el.textContent += data.text; });
+        }
+    }
+
+    function poll() {
+        if (finished) {
+            return;
+        }
+        fetch(statusUrl, { headers: { Accept: "application/json" } })
+            .then(response => response.json())
+            .then(job => {
+                if (job.status === "pending") {
+                    pollTimeout = setTimeout(poll, pollInterval);
+                } else {
+                    render(job);
+                }
+            })
+            .catch(() => {
+                pollTimeout = setTimeout(poll, pollInterval * 2);
+            });
+    }
+
+    function startPolling() {
+        if (!finished && !polling) {
+            polling = true;
+            poll();
+        }
+    }
+
+    const protocol = window.location.protocol === "https:" ? "wss:" : "ws:";
+    let socket;
+    try {
+        socket = new WebSocket(`${protocol}//${window.location.host}/ws/evaluations/`);
+    } catch (e) {
+        startPolling();
+        return;
+    }
+
+    socket.onopen = () => {
+        // Результат міг з'явитися до підключення сокета
+        fetch(statusUrl, { headers: { Accept: "application/json" } })
+            .then(response => response.json())
+            .then(job => {
+                if (job.status !== "pending") {
+                    render(job);
+                }
+            })
+            .catch(startPolling);
+    };
+
+    socket.onmessage = e => {
+        const data = JSON.parse(e.data);
+        if (data.job_id !== jobId) {
+            return;
+        }
+        if (data.type === "evaluation_partial") {
+            renderPartial(data);
+        } else if (data.type === "evaluation_result") {
+            render(data);
+            socket.close();
+        }
+    };
+
+    socket.onerror = startPolling;
+    socket.onclose = startPolling;
+});
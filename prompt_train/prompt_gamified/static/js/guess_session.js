@@ -0,0 +1,94 @@
+// Багатораундова гра "Вгадай кращий промпт": раунди вже на сторінці,
+// відповіді надсилаються JSON запитами без перезавантаження
+document.addEventListener("DOMContentLoaded", () => {
+    const container = document.querySelector("[data-guess-session]");
+    if (!container) {
+        return;
+    }
+
+    const rounds = JSON.parse(document.getElementById("guess-rounds").textContent);
+    const answerUrl = container.dataset.answerUrl;
+    const csrfToken = container.dataset.csrfToken;
+    const choices = container.querySelector("[data-guess-choices]");
+    const result = container.querySelector("[data-guess-result]");
+    const summary = container.querySelector("[data-guess-summary]");
+    const error = container.querySelector("[data-guess-error]");
+    let current = 0;
+    let sending = false;
+
+    function showRound() {
+        const round = rounds[current];
+        container.querySelector("[data-guess-round]").textContent = current + 1;
+        container.querySelectorAll("[data-guess-prompt]").forEach(el => {
+            el.textContent = round[el.dataset.guessPrompt].prompt_text;
+        });
+        result.classList.add("d-none");
+        choices.classList.remove("d-none");
+    }
+
+    function showResult(data) {
+        container.querySelectorAll("[data-guess-field]").forEach(el => {
+            const [prompt, field] = el.dataset.guessField.split(".");
+            el.textContent = data[prompt] ? data[prompt][field] : "";
+        });
+        container.querySelectorAll("[data-guess-wins]").forEach(el => {
+            el.textContent = data.wins;
+        });
+        container.querySelector("[data-guess-message]").textContent = data.message;
+
+        const alert = container.querySelector("[data-guess-alert]");
+        alert.classList.remove("alert-success", "alert-danger");
+        alert.classList.add(data.result === "win" ? "alert-success" : "alert-danger");
+        container.querySelector("[data-guess-worst]").classList.toggle("d-none", !data.worst_prompt);
+        container.querySelector("[data-guess-next]").classList.toggle("d-none", data.finished);
+
+        choices.classList.add("d-none");
+        result.classList.remove("d-none");
+        if (data.finished) {
+            summary.classList.remove("d-none");
+        }
+    }
+
+    function answer(index) {
+        if (sending) {
+            return;
+        }
+        sending = true;
+        error.classList.add("d-none");
+
+        fetch(answerUrl, {
+            method: "POST",
+            headers: {
+                "Content-Type": "application/json",
+                "X-CSRFToken": csrfToken,
+            },
+            body: JSON.stringify({ round: current, prompt_id: rounds[current][index].id }),
+        })
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) {
+                    error.textContent = data.error;
+                    error.classList.remove("d-none");
+                    return;
+                }
+                showResult(data);
+            })
+            .catch(() => {
+                error.textContent = "Не вдалося надіслати відповідь. Спробуйте ще раз.";
+                error.classList.remove("d-none");
+            })
+            .finally(() => {
+                sending = false;
+            });
+    }
+
+    container.querySelectorAll("[data-guess-choice]").forEach(button => {
+        button.addEventListener("click", () => answer(Number(button.dataset.guessChoice)));
+    });
+    container.querySelector("[data-guess-next]").addEventListener("click", () => {
+        current += 1;
+        showRound();
+    });
+
+    showRound();
+});
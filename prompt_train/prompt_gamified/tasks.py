@@ -0,0 +1,72 @@
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from .jobs import PartialResultPublisher, complete_evaluation_job
+from .models import Prompt
+from .pair_pool import guess_pair_pool
+from .sampling import prompt_sample_index
+from .similar_prompts import similar_prompts
+from .utils import evaluate_challenge_prompt, evaluate_trainer_prompt
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def evaluate_prompt_task(job_id, user_id, prompt_text, challenge_prompt_id=None):
+    """
+    Асинхронна оцінка промпта (тренажер або челендж).
+    Результат зберігається в кеші та надсилається користувачу через WebSocket.
+    При увімкненому стрімінгу оцінка та покращений промпт надходять частинами.
+    """
+    User = get_user_model()
+    on_partial = None
+    if settings.EVALUATION_STREAMING:
+        on_partial = PartialResultPublisher(job_id, user_id)
+
+    try:
+        user = User.objects.get(id=user_id)
+        if challenge_prompt_id is None:
+            result = evaluate_trainer_prompt(user, prompt_text, on_partial=on_partial)
+        else:
+            challenge_prompt = Prompt.objects.get(id=challenge_prompt_id)
+            result = evaluate_challenge_prompt(
+                user, prompt_text, challenge_prompt, on_partial=on_partial
+            )
+    except (User.DoesNotExist, Prompt.DoesNotExist) as e:
+        logger.error(f"Задачу оцінювання {job_id} неможливо виконати: {e}")
+        complete_evaluation_job(job_id, user_id, None, status="failed")
+        return
+    except Exception:
+        # Інакше задача лишилась би в pending, і клієнт опитував би її вічно
+        logger.exception("Evaluation job %s failed", job_id)
+        complete_evaluation_job(job_id, user_id, None, status="failed")
+        return
+
+    if on_partial:
+        on_partial.flush()
+    complete_evaluation_job(job_id, user_id, result)
+
+
+@shared_task
+def refill_guess_pair_pool_task(min_rate, max_rate):
+    """Поповнює пул пар для "Вгадай кращий промпт" з порогами min_rate/max_rate."""
+    added = guess_pair_pool.refill(min_rate, max_rate)
+    logger.info(f"Пул пар {min_rate}-{max_rate} поповнено на {added}")
+
+
+@shared_task
+def rebuild_prompt_sample_index_task():
+    """Перебудова індексу випадкової вибірки промптів з бази"""
+    count = prompt_sample_index.rebuild()
+    logger.info(f"Індекс вибірки промптів перебудовано: {count} промптів")
+
+
+@shared_task
+def update_similar_prompts_task(rebuild=False):
+    """Додає в індекс схожих промптів нові промпти з високою оцінкою.
+    rebuild=True збирає індекс повністю, наприклад після зміни оцінок."""
+    indexed = similar_prompts.rebuild() if rebuild else similar_prompts.update()
+    logger.info(f"Індекс схожих промптів оновлено: {indexed} промптів")
@@ -1,9 +1,94 @@
-from django.test import TestCase
+import asyncio
+import json
+import tempfile
+import os
+import shutil
+import threading
+import time
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import DatabaseError, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
 from django.utils import timezone
 from chat.models import Conversation, Message
 from users.models import CustomUser
 from cryptography.fernet import Fernet
 from django.conf import settings
+from prompt_gamified.ai_func import (
+    DEGRADED_HINT,
+    EVALUATION_FAILED_HINT,
+    StreamingEvaluationParser,
+    aevaluate_prompt_quality,
+    SYSTEM_PROMPT_VERSION,
+    current_evaluator_version,
+    evaluate_prompt_quality,
+    evaluation_outcome,
+    parse_score_and_refined,
+)
+from prompt_gamified.batch_evaluation import (
+    batch_evaluator_version,
+    evaluate_prompts_batch,
+    parse_batch_response,
+)
+from prompt_gamified.cassette import (
+    RecordingEvaluator,
+    ReplayEvaluator,
+    messages_key,
+)
+from prompt_gamified.evaluation_cache import (
+    evaluation_cache_key,
+    get_cached_evaluation,
+    get_evaluation_cache_stats,
+)
+from prompt_gamified.evaluators import (
+    FakeLatencyEvaluator,
+    HeuristicEvaluator,
+    TokenUsage,
+    _evaluators,
+    get_evaluator,
+)
+from prompt_gamified.fingerprints import MINHASH_BANDS, find_near_duplicate
+from prompt_gamified.jobs import (
+    complete_evaluation_job,
+    create_evaluation_job,
+    evaluation_group_name,
+    get_evaluation_job,
+)
+from prompt_gamified.llm_client import LLMClientRegistry
+from prompt_gamified.metrics import (
+    EvaluationUsage,
+    get_evaluation_metrics,
+    record_evaluation,
+)
+from prompt_gamified.models import LLMUsage, Prompt
+from prompt_gamified.pair_pool import guess_pair_pool
+from prompt_gamified.rate_limiter import (
+    LLMRateLimiter,
+    Priority,
+    RateLimitTimeout,
+    get_rate_limiter_stats,
+)
+from prompt_gamified.resilience import (
+    CircuitBreaker,
+    DeadlineExceeded,
+    HedgedCaller,
+    llm_circuit_breaker,
+)
+from prompt_gamified.sampling import prompt_sample_index
+from prompt_gamified.search import search_prompts
+from prompt_gamified.similar_prompts import Segment, similar_prompts
+from prompt_gamified.single_flight import get_single_flight_stats
+from prompt_gamified.tasks import evaluate_prompt_task
+from prompt_gamified.top_prompts import top_prompts
+from prompt_gamified.utils import arun_evaluation_job
 
 
 class ConversationModelTest(TestCase):
@@ -219,3 +304,1532 @@ class MessageModelTest(TestCase):
         message = Message.objects.create(user=self.user1, content=unicode_text)
 
         self.assertEqual(message.get_decrypted_content(), unicode_text)
+
+
+class EvaluationPipelineTest(TestCase):
+    """Тести асинхронного оцінювання промптів через Celery"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="trainer@test.com", password="pass123", nickname="trainer"
+        )
+        self.user.is_active = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+    @patch(
+        "prompt_gamified.utils.evaluate_prompt_quality",
+        return_value=(9.0, "Чітко", "Покращений промпт"),
+    )
+    def test_trainer_post_returns_job_and_stores_result(self, mock_evaluate):
+        """Перевірка, що view повертає id задачі, а результат доступний через polling"""
+        response = self.client.post(
+            reverse("prompt_gamified:prompt_trainer"), {"prompt": "Напиши вірш"}
+        )
+
+        job_id = response.context["job_id"]
+        self.assertTrue(Prompt.objects.filter(prompt_text="Напиши вірш").exists())
+
+        status = self.client.get(
+            reverse("prompt_gamified:evaluation_status", args=[job_id])
+        ).json()
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["result"]["prompt_rate"], 9.0)
+        self.assertEqual(status["result"]["refined_prompt"], "Покращений промпт")
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.exp, 1)
+        self.assertEqual(self.user.points, 20)
+
+    def test_trainer_post_validation_error(self):
+        """Перевірка, що порожній промпт не ставиться в чергу"""
+        response = self.client.post(
+            reverse("prompt_gamified:prompt_trainer"), {"prompt": "   "}
+        )
+        self.assertNotIn("job_id", response.context)
+        self.assertEqual(response.context["error"], "Будь ласка, введіть промпт.")
+
+    def test_status_of_foreign_job_is_hidden(self):
+        """Перевірка, що користувач не бачить чужі задачі"""
+        job_id = create_evaluation_job(self.user.id + 1)
+        response = self.client.get(
+            reverse("prompt_gamified:evaluation_status", args=[job_id])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    @patch(
+        "prompt_gamified.utils.evaluate_prompt_quality",
+        return_value=(3.0, "Слабко", "Покращений промпт"),
+    )
+    def test_challenge_post_awards_after_evaluation(self, mock_evaluate):
+        """Перевірка челенджу: сесія очищується, результат приходить через задачу"""
+        challenge_prompt = Prompt.objects.create(
+            prompt_text="Еталон", improvement_hint="", rate=8
+        )
+        session = self.client.session
+        session["challenge_prompt_id"] = challenge_prompt.id
+        session.save()
+
+        response = self.client.post(
+            reverse("prompt_gamified:challenge"), {"prompt": "Мій промпт"}
+        )
+
+        self.assertNotIn("challenge_prompt_id", self.client.session)
+        job = get_evaluation_job(response.context["job_id"])
+        self.assertEqual(job["result"]["result"], "loss")
+        self.assertEqual(job["result"]["challenge_rate"], 8)
+
+    @patch(
+        "prompt_gamified.utils.evaluate_prompt_quality",
+        return_value=(10.0, DEGRADED_HINT, "Мій промпт"),
+    )
+    def test_degraded_evaluation_is_not_saved_or_rewarded(self, mock_evaluate):
+        """Перевірка, що орієнтовна оцінка не стає промптом і не дає балів"""
+        challenge_prompt = Prompt.objects.create(
+            prompt_text="Еталон", improvement_hint="", rate=8
+        )
+        session = self.client.session
+        session["challenge_prompt_id"] = challenge_prompt.id
+        session.save()
+
+        response = self.client.post(
+            reverse("prompt_gamified:challenge"), {"prompt": "Мій промпт"}
+        )
+        job = get_evaluation_job(response.context["job_id"])
+        self.assertEqual(job["result"]["result"], "unrated")
+
+        self.client.post(reverse("prompt_gamified:prompt_trainer"), {"prompt": "Мій промпт"})
+        self.assertFalse(Prompt.objects.filter(prompt_text="Мій промпт").exists())
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.exp, self.user.points), (0, 0))
+
+    @patch("prompt_gamified.tasks.evaluate_trainer_prompt", side_effect=RateLimitTimeout)
+    def test_unexpected_error_fails_the_job(self, mock_evaluate):
+        """Перевірка, що непередбачена помилка завершує задачу станом failed"""
+        job_id = create_evaluation_job(self.user.id)
+
+        evaluate_prompt_task(job_id, self.user.id, "Напиши вірш")
+
+        self.assertEqual(get_evaluation_job(job_id)["status"], "failed")
+
+    def test_result_is_pushed_to_user_group(self):
+        """Перевірка надсилання результату в Channels-групу користувача"""
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(
+            evaluation_group_name(self.user.id), channel_name
+        )
+
+        complete_evaluation_job("job123", self.user.id, {"prompt_rate": 7.0})
+
+        event = async_to_sync(channel_layer.receive)(channel_name)
+        self.assertEqual(event["type"], "evaluation.result")
+        self.assertEqual(event["job_id"], "job123")
+        self.assertEqual(event["result"], {"prompt_rate": 7.0})
+
+
+class _CompletionHandler(BaseHTTPRequestHandler):
+    """Мінімальний keep-alive сервер, що імітує chat completions API"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps(
+            {
+                "id": "test",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "sonar-pro",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {
+                            "role": "assistant",
+                            "content": '[8]/10 (Добре)\nRefined: "Кращий промпт"',
+                        },
+                    }
+                ],
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LLMClientRegistryTest(TestCase):
+    """Тести пулу з'єднань LLM клієнта"""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _CompletionHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.registry = LLMClientRegistry(
+            base_url=f"http://127.0.0.1:{self.server.server_port}"
+        )
+
+    def tearDown(self):
+        self.registry.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_client_is_reused(self):
+        """Перевірка, що реєстр повертає той самий клієнт"""
+        self.assertIs(self.registry.get_client(), self.registry.get_client())
+
+    def test_connections_are_kept_alive(self):
+        """Перевірка, що другий запит використовує вже відкрите з'єднання"""
+        for _ in range(3):
+            self.registry.get_client().chat.completions.create(
+                model="sonar-pro", messages=[{"role": "user", "content": "hi"}]
+            )
+
+        stats = self.registry.stats.snapshot()
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["new_connections"], 1)
+        self.assertEqual(stats["reused_connections"], 2)
+
+
+class EvaluationCacheTest(TestCase):
+    """Тести кешу оцінок промптів"""
+
+    def setUp(self):
+        caches["evaluations"].clear()
+
+    def test_normalize_prompt(self):
+        """Перевірка, що пробіли та регістр не впливають на ключ"""
+        self.assertEqual(
+            evaluation_cache_key("  Напиши   ВІРШ ", "sonar-pro", "v1"),
+            evaluation_cache_key("напиши вірш", "sonar-pro", "v1"),
+        )
+        self.assertNotEqual(
+            evaluation_cache_key("напиши вірш", "sonar-pro", "v1"),
+            evaluation_cache_key("напиши вірш", "sonar-pro", "v2"),
+        )
+
+    @patch(
+        "prompt_gamified.ai_func.request_evaluation",
+        return_value=(8.0, "Добре", "Кращий промпт"),
+    )
+    def test_repeated_prompt_is_served_from_cache(self, mock_request):
+        """Перевірка, що повторний промпт не звертається до API"""
+        first = evaluate_prompt_quality("Напиши вірш")
+        second = evaluate_prompt_quality("напиши  вірш")
+
+        self.assertEqual(first, second)
+        self.assertEqual(mock_request.call_count, 1)
+        stats = get_evaluation_cache_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    @patch("prompt_gamified.ai_func.request_evaluation", side_effect=RuntimeError)
+    def test_failed_evaluation_is_not_cached(self, mock_request):
+        """Перевірка, що помилка провайдера не потрапляє в кеш"""
+        evaluate_prompt_quality("Напиши вірш")
+        evaluate_prompt_quality("Напиши вірш")
+
+        self.assertEqual(mock_request.call_count, 2)
+
+
+class NearDuplicatePromptTest(TestCase):
+    """Тести пошуку майже однакових промптів"""
+
+    base_text = (
+        "Напиши Django view для інтеграції з Perplexity API, яка обробляє "
+        "помилки, повертає JSON і логує кожен запит до сервісу"
+    )
+
+    def setUp(self):
+        self.stored = Prompt.objects.create(
+            prompt_text=self.base_text, improvement_hint="Додай приклад", rate=9
+        )
+
+    def test_bands_are_saved(self):
+        """Перевірка, що відбиток зберігається разом з промптом"""
+        self.assertEqual(len(self.stored.minhash_bands), MINHASH_BANDS)
+
+    def test_small_edit_is_found(self):
+        """Перевірка, що промпт з однією зміненою фразою знаходиться"""
+        match = find_near_duplicate(self.base_text.replace("кожен", "кожний"))
+
+        self.assertIsNotNone(match)
+        prompt, score = match
+        self.assertEqual(prompt, self.stored)
+        self.assertGreaterEqual(score, 0.8)
+
+    def test_unrelated_prompt_is_not_found(self):
+        """Перевірка, що інший за змістом промпт не вважається дублікатом"""
+        self.assertIsNone(
+            find_near_duplicate("Склади план уроку з історії України для 7 класу")
+        )
+
+
+def _stream_chunks(text, size=3):
+    """Імітує відповідь моделі у режимі stream=True"""
+    for start in range(0, len(text), size):
+        delta = SimpleNamespace(content=text[start : start + size])
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+class StreamingEvaluationTest(TestCase):
+    """Тести стрімінгу оцінки промпта"""
+
+    response_text = '[7.5]/10 (Бракує контексту)\nRefined: "Напиши вірш про осінь у Києві"'
+
+    def setUp(self):
+        caches["evaluations"].clear()
+
+    def test_parser_emits_score_before_refined(self):
+        """Перевірка, що оцінка надходить одразу після першого рядка"""
+        parser = StreamingEvaluationParser()
+        events = []
+        for char in self.response_text:
+            events.extend(parser.feed(char))
+
+        self.assertEqual(events[0]["kind"], "score")
+        self.assertEqual(events[0]["rate"], 7.5)
+        self.assertEqual(events[0]["improvement_hint"], "Бракує контексту")
+        refined = "".join(e["text"] for e in events if e["kind"] == "refined")
+        self.assertEqual(refined, "Напиши вірш про осінь у Києві")
+
+    @patch("prompt_gamified.evaluators.llm_clients.get_client")
+    def test_streaming_result_matches_full_parse(self, mock_get_client):
+        """Перевірка, що остаточний результат такий самий, як без стрімінгу"""
+        create = mock_get_client.return_value.chat.completions.create
+        create.return_value = _stream_chunks(self.response_text)
+        events = []
+
+        result = evaluate_prompt_quality("Напиши вірш", on_partial=events.append)
+
+        self.assertEqual(result, parse_score_and_refined(self.response_text))
+        self.assertTrue(create.call_args.kwargs["stream"])
+        self.assertEqual(events[0]["kind"], "score")
+
+
+class EvaluatorBackendTest(TestCase):
+    """Тести бекендів оцінювання промптів"""
+
+    def setUp(self):
+        caches["evaluations"].clear()
+
+    @override_settings(
+        PROMPT_EVALUATOR_BACKEND="prompt_gamified.evaluators.HeuristicEvaluator"
+    )
+    def test_backend_selected_by_settings(self):
+        """Перевірка, що бекенд обирається налаштуванням і спільний для процесу"""
+        self.assertIsInstance(get_evaluator(), HeuristicEvaluator)
+        self.assertIs(get_evaluator(), get_evaluator())
+
+    @override_settings(
+        PROMPT_EVALUATOR_BACKEND="prompt_gamified.evaluators.HeuristicEvaluator",
+        EVALUATION_CACHE_ENABLED=False,
+    )
+    def test_heuristic_evaluation_is_deterministic(self):
+        """Перевірка, що однаковий промпт отримує однакову оцінку"""
+        weak = evaluate_prompt_quality("Напиши вірш")
+        strong = evaluate_prompt_quality(
+            "Ти — поет. Напиши вірш про осінь для дитячої аудиторії, "
+            "не більше 12 рядків, у форматі двох строф."
+        )
+
+        self.assertEqual(weak, evaluate_prompt_quality("Напиши вірш"))
+        self.assertLess(weak[0], strong[0])
+        self.assertEqual(weak[1], "Не вказано роль виконавця.")
+        self.assertTrue(weak[2].startswith("Напиши вірш"))
+
+    @override_settings(
+        PROMPT_EVALUATOR_BACKEND="prompt_gamified.evaluators.FakeLatencyEvaluator",
+        FAKE_EVALUATOR_LATENCY=0.0,
+        FAKE_EVALUATOR_JITTER=0.0,
+        EVALUATION_CACHE_ENABLED=False,
+    )
+    def test_fake_backend_streams_same_result(self):
+        """Перевірка, що стрімінг фейкового бекенда дає той самий результат"""
+        self.assertIsInstance(get_evaluator(), FakeLatencyEvaluator)
+        events = []
+
+        streamed = evaluate_prompt_quality("Напиши вірш", on_partial=events.append)
+
+        self.assertEqual(streamed, evaluate_prompt_quality("Напиши вірш"))
+        self.assertEqual(events[0]["kind"], "score")
+        refined = "".join(e["text"] for e in events if e["kind"] == "refined")
+        self.assertEqual(refined, streamed[2])
+
+
+@override_settings(LLM_RATE_LIMIT_RPM=10, LLM_RATE_LIMIT_TPM=0, LLM_RATE_LIMIT_MAX_WAIT=0)
+class LLMRateLimiterTest(TestCase):
+    """Тести спільного ліміту запитів до LLM"""
+
+    def setUp(self):
+        caches["default"].clear()
+        # Сталий час: відра наповнюються лише тоді, коли тест зсуває годинник
+        self.now = 1_000_000 * 60
+        self.limiter = LLMRateLimiter(poll_interval=0, clock=lambda: self.now)
+
+    def test_lower_priority_leaves_reserve_for_higher(self):
+        """Перевірка, що фонові задачі не забирають увесь ліміт"""
+        for _ in range(5):
+            self.limiter.acquire(Priority.BACKGROUND, 100)
+
+        with self.assertRaises(RateLimitTimeout):
+            self.limiter.acquire(Priority.BACKGROUND, 100)
+
+        for _ in range(5):
+            self.limiter.acquire(Priority.CHALLENGE, 100)
+        with self.assertRaises(RateLimitTimeout):
+            self.limiter.acquire(Priority.CHALLENGE, 100)
+
+    @override_settings(LLM_RATE_LIMIT_RPM=0, LLM_RATE_LIMIT_TPM=1000)
+    def test_token_limit(self):
+        """Перевірка, що ліміт токенів діє окремо від ліміту запитів"""
+        self.limiter.acquire(Priority.CHALLENGE, 600)
+
+        with self.assertRaises(RateLimitTimeout):
+            self.limiter.acquire(Priority.CHALLENGE, 600)
+        self.limiter.acquire(Priority.CHALLENGE, 400)
+
+        # За хвилину порожнє відро наповнюється повністю
+        self.now += 60
+        self.limiter.acquire(Priority.CHALLENGE, 600)
+
+    def test_bucket_refills_gradually(self):
+        """Перевірка, що після вичерпання ліміту запити проходять рівномірно,
+        а не всі разом на початку наступної хвилини"""
+        for _ in range(10):
+            self.limiter.acquire(Priority.CHALLENGE, 100)
+
+        self.now += 3
+        with self.assertRaises(RateLimitTimeout):
+            self.limiter.acquire(Priority.CHALLENGE, 100)
+
+        # 10 запитів на хвилину — один кожні 6 секунд
+        self.now += 3
+        self.limiter.acquire(Priority.CHALLENGE, 100)
+        with self.assertRaises(RateLimitTimeout):
+            self.limiter.acquire(Priority.CHALLENGE, 100)
+
+    def test_lower_priority_waits_for_queued_higher(self):
+        """Перевірка, що тренажер поступається челенджу, який чекає в черзі"""
+        caches["default"].set("llm_rate:challenge:waiting", 1)
+
+        with self.assertRaises(RateLimitTimeout):
+            self.limiter.acquire(Priority.TRAINER, 100)
+        self.limiter.acquire(Priority.CHALLENGE, 100)
+
+    def test_stats_and_staff_endpoint(self):
+        """Перевірка статистики черги та доступу до неї лише для персоналу"""
+        self.limiter.acquire(Priority.TRAINER, 100)
+        caches["default"].set("llm_rate:challenge:waiting", 2)
+        with self.assertRaises(RateLimitTimeout):
+            self.limiter.acquire(Priority.TRAINER, 100)
+
+        stats = get_rate_limiter_stats()
+        self.assertEqual(stats["trainer"]["acquired"], 1)
+        self.assertEqual(stats["trainer"]["timeouts"], 1)
+        self.assertEqual(stats["challenge"]["queue_depth"], 2)
+
+        user = CustomUser.objects.create_user(
+            email="user@test.com", password="pass123", nickname="user"
+        )
+        self.client.force_login(user)
+        url = reverse("prompt_gamified:llm_status")
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        user.is_active = user.is_staff = True
+        user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.json()["rate_limiter"]["trainer"]["acquired"], 1)
+        self.assertIn("reused_connections", response.json()["connections"])
+
+
+class SingleFlightEvaluationTest(TestCase):
+    """Тести об'єднання однакових одночасних оцінок"""
+
+    def setUp(self):
+        caches["default"].clear()
+        caches["evaluations"].clear()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow_request(self, prompt_text, priority, usage=None):
+        self.calls += 1
+        self.release.wait(5)
+        return 8.0, "Добре", "Кращий промпт"
+
+    def evaluate_concurrently(self, texts):
+        results = {}
+
+        def run(text):
+            results[text] = evaluate_prompt_quality(text)
+
+        threads = [threading.Thread(target=run, args=(text,)) for text in texts]
+        # Потоки мають власні з'єднання з БД поза транзакцією тесту
+        with patch("prompt_gamified.metrics.record_usage"):
+            for thread in threads:
+                thread.start()
+            # Даємо всім потокам дійти до очікування на лідера
+            time.sleep(0.3)
+            self.release.set()
+            for thread in threads:
+                thread.join(5)
+        return results
+
+    @override_settings(EVALUATION_CACHE_ENABLED=False)
+    def test_identical_prompts_share_one_request(self):
+        """Перевірка, що однакові промпти чекають на один запит до API"""
+        texts = ["Напиши вірш", "напиши  вірш", "НАПИШИ ВІРШ"]
+        with patch(
+            "prompt_gamified.ai_func.request_evaluation", side_effect=self.slow_request
+        ):
+            results = self.evaluate_concurrently(texts)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(set(results.values()), {(8.0, "Добре", "Кращий промпт")})
+        self.assertEqual(get_single_flight_stats(), {"leaders": 1, "coalesced": 2})
+
+    def test_leader_failure_falls_back_for_everyone(self):
+        """Перевірка, що помилка лідера дає запасну оцінку всім, хто чекав"""
+
+        def failing_request(prompt_text, priority, usage=None):
+            self.slow_request(prompt_text, priority)
+            raise RuntimeError
+
+        with patch(
+            "prompt_gamified.ai_func.request_evaluation", side_effect=failing_request
+        ):
+            results = self.evaluate_concurrently(["Напиши вірш", "напиши вірш"])
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results["напиши вірш"][2], "напиши вірш")
+        self.assertTrue(all(r[0] == 5.0 for r in results.values()))
+
+
+@override_settings(
+    LLM_BREAKER_FAILURES=2, LLM_BREAKER_COOLDOWN=30, EVALUATION_CACHE_ENABLED=False
+)
+class LLMResilienceTest(TestCase):
+    """Тести дедлайнів, circuit breaker та hedged запитів"""
+
+    def setUp(self):
+        caches["default"].clear()
+
+    @patch("prompt_gamified.evaluators.llm_clients.get_client")
+    def test_breaker_opens_after_consecutive_failures(self, mock_get_client):
+        """Перевірка, що після серії помилок провайдер не викликається"""
+        create = mock_get_client.return_value.chat.completions.create
+        create.side_effect = RuntimeError
+
+        for _ in range(2):
+            result = evaluate_prompt_quality("Напиши вірш")
+            self.assertEqual(result[1], EVALUATION_FAILED_HINT)
+        degraded = evaluate_prompt_quality("Напиши вірш")
+
+        self.assertEqual(degraded, (5.0, DEGRADED_HINT, "Напиши вірш"))
+        self.assertEqual(create.call_count, 2)
+        self.assertEqual(CircuitBreaker("llm").stats()["state"], "open")
+
+    def test_half_open_probe_closes_breaker(self):
+        """Перевірка, що успішний пробний запит замикає breaker"""
+        breaker = CircuitBreaker("llm")
+        breaker.record_failure()
+        breaker.record_failure()
+        caches["default"].set(breaker.open_until_key, time.time() - 1)
+
+        self.assertEqual(breaker.state(), "half_open")
+        self.assertTrue(breaker.allow_request())
+        # Поки триває пробний запит, інші не пропускаються
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state(), "closed")
+
+    @override_settings(
+        PROMPT_EVALUATOR_BACKEND="prompt_gamified.evaluators.FakeLatencyEvaluator",
+        FAKE_EVALUATOR_LATENCY=1.0,
+        FAKE_EVALUATOR_JITTER=0.0,
+        LLM_CALL_DEADLINE=0.1,
+    )
+    def test_slow_call_hits_deadline(self):
+        """Перевірка, що повільний провайдер не тримає воркер довше дедлайну"""
+        started = time.monotonic()
+        result = evaluate_prompt_quality("Напиши вірш")
+
+        self.assertEqual(result[1], EVALUATION_FAILED_HINT)
+        self.assertLess(time.monotonic() - started, 0.9)
+
+    @override_settings(LLM_HEDGE_ENABLED=True, LLM_HEDGE_MIN_DELAY=0.05)
+    def test_hedged_request_wins_over_slow_primary(self):
+        """Перевірка, що другий запит повертає відповідь, коли перший завис"""
+        caller = HedgedCaller()
+        calls = []
+
+        def fn(timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return "primary"
+            return "hedge"
+
+        result = caller.call(fn, time.monotonic() + 2)
+
+        self.assertEqual(result, "hedge")
+        stats = caller.stats()
+        self.assertEqual((stats["hedges_sent"], stats["hedge_wins"]), (1, 1))
+        self.assertEqual(stats["hedge_win_rate"], 1.0)
+
+    @override_settings(LLM_HEDGE_MAX_WORKERS=1)
+    def test_saturated_pool_does_not_queue_behind_abandoned_calls(self):
+        """Перевірка, що покинутий виклик не змушує наступні чекати в черзі пулу"""
+        caller = HedgedCaller()
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        with self.assertRaises(DeadlineExceeded):
+            caller.call(lambda timeout: release.wait(), time.monotonic() + 0.05)
+
+        # Єдиний потік пулу досі зайнятий: виклик іде в потоці запиту
+        threads = []
+        result = caller.call(
+            lambda timeout: threads.append(threading.current_thread()) or "ok",
+            time.monotonic() + 1,
+        )
+        self.assertEqual(result, "ok")
+        self.assertEqual(threads, [threading.current_thread()])
+        self.assertEqual(caller.stats()["pool_saturated"], 1)
+
+
+@override_settings(
+    PROMPT_EVALUATOR_BACKEND="prompt_gamified.evaluators.FakeLatencyEvaluator",
+    FAKE_EVALUATOR_LATENCY=0.3,
+    FAKE_EVALUATOR_JITTER=0.0,
+    LLM_RATE_LIMIT_RPM=0,
+    EVALUATION_CACHE_ENABLED=False,
+)
+class AsyncEvaluationTest(TestCase):
+    """Тести async-шляху оцінювання"""
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_evaluations_run_concurrently_in_one_loop(self):
+        """Перевірка, що сотня оцінок виконується одночасно, а не по черзі"""
+
+        async def evaluate_all():
+            return await asyncio.gather(
+                *(aevaluate_prompt_quality(f"Напиши вірш №{i}") for i in range(100))
+            )
+
+        started = time.monotonic()
+        results = async_to_sync(evaluate_all)()
+
+        # Послідовно це зайняло б 30 секунд
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(len(results), 100)
+        self.assertNotIn(EVALUATION_FAILED_HINT, {r[1] for r in results})
+
+    @override_settings(FAKE_EVALUATOR_LATENCY=0.0)
+    def test_cache_calls_do_not_block_the_orm_thread(self):
+        """Перевірка, що звернення до кешу йдуть не в спільний потік ORM"""
+        threads = []
+
+        def record_thread(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return None
+
+        with patch(
+            "prompt_gamified.ai_func.get_cached_evaluation", side_effect=record_thread
+        ), patch.object(llm_circuit_breaker, "is_open", side_effect=record_thread):
+            async_to_sync(aevaluate_prompt_quality)("Напиши вірш")
+
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    @override_settings(FAKE_EVALUATOR_LATENCY=0.0)
+    def test_async_job_saves_prompt_and_pushes_result(self):
+        """Перевірка, що async-задача зберігає промпт і надсилає результат"""
+        user = CustomUser.objects.create_user(
+            email="user@test.com", password="pass123", nickname="user"
+        )
+        job_id = create_evaluation_job(user.id)
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(
+            evaluation_group_name(user.id), channel_name
+        )
+
+        async_to_sync(arun_evaluation_job)(job_id, user.id, "Напиши вірш")
+
+        job = get_evaluation_job(job_id)
+        self.assertEqual(job["status"], "done")
+        self.assertTrue(Prompt.objects.filter(prompt_text="Напиши вірш").exists())
+        events = []
+        while True:
+            event = async_to_sync(channel_layer.receive)(channel_name)
+            events.append(event["type"])
+            if event["type"] == "evaluation.result":
+                break
+        self.assertEqual(events[0], "evaluation.partial")
+
+
+class EvaluationMetricsTest(TestCase):
+    """Тести метрик оцінювання: затримки, токени, вартість"""
+
+    response_text = '[8]/10 (Добре)\nRefined: "Напиши вірш про осінь"'
+
+    def setUp(self):
+        caches["default"].clear()
+        caches["evaluations"].clear()
+        self.user = CustomUser.objects.create_user(
+            email="user@test.com", password="pass123", nickname="user"
+        )
+
+    @patch("prompt_gamified.evaluators.llm_clients.get_client")
+    def test_usage_and_cost_recorded_per_user(self, mock_get_client):
+        """Перевірка, що токени з response.usage потрапляють у денну вартість"""
+        mock_get_client.return_value.chat.completions.create.return_value = (
+            SimpleNamespace(
+                choices=[
+                    SimpleNamespace(
+                        message=SimpleNamespace(content=self.response_text)
+                    )
+                ],
+                usage=SimpleNamespace(prompt_tokens=1000, completion_tokens=200),
+            )
+        )
+
+        evaluate_prompt_quality("Напиши вірш", user_id=self.user.id)
+        evaluate_prompt_quality("Напиши вірш", user_id=self.user.id)
+
+        usage = LLMUsage.objects.get(user=self.user, model="sonar-pro")
+        self.assertEqual(usage.requests, 1)
+        self.assertEqual(usage.prompt_tokens, 1000)
+        self.assertEqual(usage.completion_tokens, 200)
+        # 1000 * 3 / 1M + 200 * 15 / 1M + 0.006
+        self.assertEqual(str(usage.cost), "0.012000")
+
+        metrics = get_evaluation_metrics()
+        self.assertEqual(metrics["cache"], {"hit": 1, "miss": 1, "coalesced": 0})
+        self.assertEqual(metrics["outcomes"]["ok"], 2)
+        self.assertEqual(metrics["latency"]["miss"]["count"], 1)
+        self.assertEqual(metrics["today"]["top_users"][0]["user_id"], self.user.id)
+
+    @patch("prompt_gamified.ai_func.request_evaluation", side_effect=RuntimeError)
+    def test_failed_evaluation_counted_as_error(self, mock_request):
+        """Перевірка, що помилка провайдера рахується окремим результатом"""
+        evaluate_prompt_quality("Напиши вірш", user_id=self.user.id)
+
+        self.assertEqual(get_evaluation_metrics()["outcomes"]["error"], 1)
+
+    @patch(
+        "prompt_gamified.ai_func.acquire_rate_limit", side_effect=RateLimitTimeout
+    )
+    def test_error_without_backend_call_is_not_billed(self, mock_acquire):
+        """Перевірка, що помилка до виклику бекенда не додає запит і вартість"""
+        result = evaluate_prompt_quality("Напиши вірш", user_id=self.user.id)
+
+        self.assertEqual(evaluation_outcome(result), "error")
+        self.assertFalse(LLMUsage.objects.exists())
+
+    def test_hedged_calls_are_billed_separately(self):
+        """Перевірка, що обидва hedged виклики рахуються, навіть той, що
+        завершився після запису метрик"""
+        usage = EvaluationUsage()
+        threads = [
+            threading.Thread(target=usage.add, args=(TokenUsage(100, 10, 1),))
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        totals = usage.close("sonar-pro", self.user.id)
+        record_evaluation("sonar-pro", "ok", "miss", 0.1, totals, self.user.id)
+        # Запит, що програв, повернувся вже після запису оцінки
+        usage.add(TokenUsage(50, 5, 1))
+
+        row = LLMUsage.objects.get(user=self.user, model="sonar-pro")
+        self.assertEqual(row.requests, 3)
+        self.assertEqual((row.prompt_tokens, row.completion_tokens), (250, 25))
+
+    def test_metrics_endpoint_is_staff_only(self):
+        """Перевірка, що метрики доступні лише персоналу"""
+        url = reverse("prompt_gamified:evaluation_metrics")
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.user.is_active = self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(url)
+        self.assertIn("p95_ms", response.json()["latency"]["miss"])
+
+
+@override_settings(
+    PROMPT_EVALUATOR_BACKEND="prompt_gamified.evaluators.HeuristicEvaluator",
+    EVALUATION_CACHE_ENABLED=False,
+)
+class RescorePromptsCommandTest(TestCase):
+    """Тести команди переоцінювання промптів"""
+
+    texts = [
+        "Напиши вірш",
+        "Ти — поет. Напиши вірш про осінь для дітей, не більше 12 рядків.",
+        "Поясни, що таке рекурсія, на прикладі",
+    ]
+
+    def setUp(self):
+        caches["default"].clear()
+        self.prompts = [
+            Prompt.objects.create(prompt_text=text, improvement_hint="-", rate=1)
+            for text in self.texts
+        ]
+
+    def test_rescores_all_prompts_with_version(self):
+        """Перевірка, що всі промпти отримують нову оцінку та версію"""
+        call_command("rescore_prompts", concurrency=2, batch_size=2, stdout=StringIO())
+
+        for prompt in self.prompts:
+            prompt.refresh_from_db()
+            rate, improvement_hint, _ = evaluate_prompt_quality(prompt.prompt_text)
+            self.assertEqual(prompt.rate, int(rate))
+            self.assertEqual(prompt.improvement_hint, improvement_hint)
+            self.assertEqual(prompt.evaluator_version, batch_evaluator_version())
+
+    def test_resumes_after_checkpoint(self):
+        """Перевірка, що повторний запуск продовжує після збереженого id"""
+        caches["default"].set(
+            f"rescore_prompts:checkpoint:{batch_evaluator_version()}",
+            self.prompts[0].id,
+        )
+
+        call_command("rescore_prompts", stdout=StringIO())
+
+        self.prompts[0].refresh_from_db()
+        self.assertEqual(self.prompts[0].evaluator_version, "")
+        self.assertEqual(
+            Prompt.objects.filter(evaluator_version=batch_evaluator_version()).count(),
+            2,
+        )
+
+    def test_batch_results_stay_out_of_single_evaluation_cache(self):
+        """Перевірка, що пакетні оцінки не видаються за одиночні"""
+        caches["evaluations"].clear()
+        self.prompts[0].evaluator_version = current_evaluator_version()
+        self.prompts[0].save(update_fields=["evaluator_version"])
+
+        call_command("rescore_prompts", group_size=2, stdout=StringIO())
+
+        # Промпт з актуальною одиночною оцінкою не переоцінюється
+        self.prompts[0].refresh_from_db()
+        self.assertEqual(self.prompts[0].rate, 1)
+        model_name = get_evaluator().model_name
+        for text in self.texts[1:]:
+            self.assertIsNone(
+                get_cached_evaluation(text, model_name, SYSTEM_PROMPT_VERSION)
+            )
+
+    @patch("prompt_gamified.ai_func.arequest_evaluation", side_effect=RuntimeError)
+    @patch(
+        "prompt_gamified.batch_evaluation.arequest_batch_evaluation",
+        side_effect=DeadlineExceeded,
+    )
+    def test_failed_evaluation_keeps_old_rate(self, mock_batch, mock_request):
+        """Перевірка, що невдала оцінка не перезаписує збережену"""
+        out = StringIO()
+        call_command("rescore_prompts", stdout=out)
+
+        self.assertFalse(Prompt.objects.exclude(rate=1).exists())
+        self.assertFalse(Prompt.objects.exclude(evaluator_version="").exists())
+        self.assertIn("не вдалося: 3", out.getvalue())
+
+
+@override_settings(
+    PROMPT_EVALUATOR_BACKEND="prompt_gamified.evaluators.HeuristicEvaluator",
+    EVALUATION_CACHE_ENABLED=False,
+)
+class BatchEvaluationTest(TestCase):
+    """Тести пакетної оцінки промптів"""
+
+    texts = [
+        "Напиши вірш",
+        "Ти — поет. Напиши вірш про осінь для дітей, не більше 12 рядків.",
+        "Поясни, що таке рекурсія, на прикладі",
+    ]
+
+    def test_parse_batch_response_variants(self):
+        """Перевірка розбору JSON у markdown-блоці, обрізаного JSON і тексту"""
+        fenced = (
+            '```json\n{"results": [{"id": 2, "score": 12, "hint": "Добре", '
+            '"refined": "Напиши вірш"}, {"id": 1, "score": "4.5", "hint": "Мало '
+            'деталей", "refined": "Напиши вірш про осінь"}]}\n```'
+        )
+        self.assertEqual(
+            parse_batch_response(fenced, 2),
+            [
+                (4.5, "Мало деталей", "Напиши вірш про осінь"),
+                (10.0, "Добре", "Напиши вірш"),
+            ],
+        )
+
+        truncated = (
+            '{"results": [{"id": 1, "score": 6, "hint": "Норм", "refined": "А"}, '
+            '{"id": 2, "score": 7, "hint": "Доб'
+        )
+        self.assertEqual(parse_batch_response(truncated, 2), [(6.0, "Норм", "А"), None])
+
+        text = '1. [3]/10 (Погано)\nRefined: "Б"\n2) [8]/10 (Добре)\nRefined: "В"'
+        self.assertEqual(
+            parse_batch_response(text, 2), [(3.0, "Погано", "Б"), (8.0, "Добре", "В")]
+        )
+
+    def test_batch_matches_single_evaluation_in_one_request(self):
+        """Перевірка, що пакет дає ті самі оцінки одним запитом"""
+        evaluator = get_evaluator()
+        with patch.object(
+            evaluator, "complete_json", wraps=evaluator.complete_json
+        ) as mock_complete:
+            results = evaluate_prompts_batch(self.texts + [self.texts[0]])
+
+        self.assertEqual(mock_complete.call_count, 1)
+        self.assertEqual(len(mock_complete.call_args.args[0]), 2)
+        expected = [evaluate_prompt_quality(text) for text in self.texts]
+        self.assertEqual(results, expected + [expected[0]])
+
+    def test_unparsed_items_fall_back_to_single_calls(self):
+        """Перевірка, що нерозібрані промпти оцінюються окремими запитами"""
+        evaluator = get_evaluator()
+        response = json.dumps(
+            {"results": [{"id": 1, "score": 9, "hint": "Добре", "refined": "А"}]}
+        )
+        with patch.object(evaluator, "complete_json", return_value=response):
+            with patch.object(
+                evaluator, "complete", wraps=evaluator.complete
+            ) as mock_complete:
+                results = evaluate_prompts_batch(self.texts)
+
+        self.assertEqual(results[0], (9.0, "Добре", "А"))
+        self.assertEqual(mock_complete.call_count, 2)
+        self.assertEqual(results[1:], [evaluate_prompt_quality(t) for t in self.texts[1:]])
+
+
+@override_settings(
+    LLM_CASSETTE_BACKEND="prompt_gamified.evaluators.FakeLatencyEvaluator",
+    FAKE_EVALUATOR_LATENCY=0.2,
+    FAKE_EVALUATOR_JITTER=0.0,
+    LLM_RATE_LIMIT_RPM=0,
+    EVALUATION_CACHE_ENABLED=False,
+)
+class LLMCassetteTest(TestCase):
+    """Тести запису та відтворення відповідей LLM"""
+
+    recording = "prompt_gamified.cassette.RecordingEvaluator"
+    replay = "prompt_gamified.cassette.ReplayEvaluator"
+
+    def setUp(self):
+        caches["default"].clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "cassette.jsonl")
+        settings_override = override_settings(LLM_CASSETTE_PATH=path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Екземпляри бекендів кешуються на процес, касета в кожному тесті своя
+        for backend in (self.recording, self.replay):
+            self.addCleanup(_evaluators.pop, backend, None)
+
+    def test_replay_returns_recorded_responses_with_latency(self):
+        """Перевірка, що відтворення дає записані відповіді з тією ж затримкою"""
+        with override_settings(PROMPT_EVALUATOR_BACKEND=self.recording):
+            recorded = evaluate_prompt_quality("Напиши вірш")
+            streamed = evaluate_prompt_quality(
+                "Поясни рекурсію", on_partial=lambda event: None
+            )
+
+        with override_settings(PROMPT_EVALUATOR_BACKEND=self.replay):
+            self.assertEqual(get_evaluator().model_name, "fake-latency")
+            started = time.monotonic()
+            self.assertEqual(evaluate_prompt_quality("Напиши вірш"), recorded)
+            self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+            events = []
+            replayed = evaluate_prompt_quality(
+                "Поясни рекурсію", on_partial=events.append
+            )
+            self.assertEqual(replayed, streamed)
+            self.assertEqual(events[0]["kind"], "score")
+
+            # Відповіді на незаписаний промпт немає
+            self.assertEqual(
+                evaluate_prompt_quality("Новий промпт")[1], EVALUATION_FAILED_HINT
+            )
+
+    def test_async_recording_writes_outside_event_loop(self):
+        """Перевірка, що async-оцінка не пише касету з event loop"""
+        in_loop = []
+        write = RecordingEvaluator._write
+
+        def checked_write(evaluator, entry):
+            try:
+                asyncio.get_running_loop()
+                in_loop.append(True)
+            except RuntimeError:
+                in_loop.append(False)
+            write(evaluator, entry)
+
+        with override_settings(PROMPT_EVALUATOR_BACKEND=self.recording), patch.object(
+            RecordingEvaluator, "_write", checked_write
+        ):
+            async_to_sync(aevaluate_prompt_quality)("Напиши вірш")
+
+        self.assertEqual(in_loop, [False])
+        with open(settings.LLM_CASSETTE_PATH, encoding="utf-8") as cassette:
+            self.assertEqual(len(cassette.readlines()), 1)
+
+    def test_replay_cycles_through_repeated_responses(self):
+        """Перевірка, що повторні записи тих самих повідомлень видаються по колу"""
+        messages = [{"role": "user", "content": "Напиши вірш"}]
+        with open(settings.LLM_CASSETTE_PATH, "w", encoding="utf-8") as cassette:
+            for text in ("перша", "друга"):
+                cassette.write(
+                    json.dumps(
+                        {
+                            "key": messages_key(messages),
+                            "model": "sonar-pro",
+                            "latency": 0.0,
+                            "text": text,
+                            "prompt_tokens": 10,
+                            "completion_tokens": 2,
+                        }
+                    )
+                    + "\n"
+                )
+
+        evaluator = ReplayEvaluator()
+        self.assertEqual(
+            [evaluator.complete(messages) for _ in range(3)],
+            ["перша", "друга", "перша"],
+        )
+
+
+class PromptSampleIndexTest(TestCase):
+    """Тести індексу випадкової вибірки промптів"""
+
+    def setUp(self):
+        caches["default"].clear()
+        for rate in (2, 5, 9, 9):
+            Prompt.objects.create(prompt_text=f"Промпт {rate}", improvement_hint="-", rate=rate)
+        self.index = prompt_sample_index
+        self.index.store.replace([])
+
+    def test_samples_within_rate_range_with_one_query(self):
+        """Перевірка, що порожній індекс будується задачею, а вибірка читає один рядок"""
+        # Задача перебудови виконується одразу, але вибірка її не чекає
+        self.assertIsNone(self.index.random_prompt())
+        self.assertEqual(self.index.random_prompt(min_rate=7).rate, 9)
+        self.assertEqual(self.index.random_prompt(max_rate=4).rate, 2)
+        self.assertIsNone(self.index.random_prompt(min_rate=10))
+
+        # Індекс уже побудовано: лише вибірка рядка за первинним ключем
+        with self.assertNumQueries(1):
+            self.index.random_prompt(min_rate=3, max_rate=6)
+
+    def test_prompts_are_added_on_commit_in_any_order(self):
+        """Перевірка, що промпт з меншим id, закомічений пізніше, не губиться"""
+        self.index.rebuild()
+        with self.captureOnCommitCallbacks() as callbacks:
+            first = Prompt.objects.create(prompt_text="Перший", improvement_hint="-", rate=10)
+            second = Prompt.objects.create(prompt_text="Другий", improvement_hint="-", rate=10)
+        self.assertIsNone(self.index.random_prompt(min_rate=10))
+
+        for callback in reversed(callbacks):
+            callback()
+        self.assertEqual(
+            set(self.index.random_ids(10, 10, 50)), {first.id, second.id}
+        )
+
+    def test_rescored_prompt_moves_to_its_new_bucket(self):
+        """Перевірка, що промпт зі зміненою оцінкою не потрапляє в старий діапазон"""
+        self.index.rebuild()
+        Prompt.objects.filter(rate=9).update(rate=3)
+
+        self.assertIsNone(self.index.random_prompt(min_rate=7))
+        self.assertEqual(self.index.random_prompt(min_rate=3, max_rate=3).rate, 3)
+
+    def test_invalidate_rebuilds_from_database(self):
+        """Перевірка, що після масового імпорту індекс перебудовується з бази"""
+        self.index.rebuild()
+        # bulk_create не надсилає сигналів — як COPY в import_prompts
+        (prompt,) = Prompt.objects.bulk_create(
+            [Prompt(prompt_text="Новий", improvement_hint="-", rate=10)]
+        )
+        self.assertIsNone(self.index.random_prompt(min_rate=10))
+
+        self.index.invalidate()
+        self.assertEqual(self.index.random_prompt(min_rate=10), prompt)
+
+
+@override_settings(GUESS_PAIR_POOL_SIZE=10, GUESS_PAIR_POOL_LOW_WATERMARK=3)
+class GuessPairPoolTest(TestCase):
+    """Тести пулу пар для гри «Вгадай кращий промпт»"""
+
+    def setUp(self):
+        caches["default"].clear()
+        for rate in (1, 2, 5, 8, 9):
+            Prompt.objects.create(
+                prompt_text=f"Промпт {rate}", improvement_hint="-", rate=rate
+            )
+        prompt_sample_index.rebuild()
+
+    def test_round_refills_pool_and_pops_pairs(self):
+        """Перевірка, що раунд наповнює пул, а наступні забирають з нього пари"""
+        user = CustomUser.objects.create_user(
+            email="user@test.com", password="pass123", nickname="user"
+        )
+        user.is_active = True
+        user.save()
+        self.client.force_login(user)
+
+        response = self.client.get(reverse("prompt_gamified:guess_the_best_prompt"))
+        self.assertEqual(len(response.context["prompts"]), 2)
+        # Ранг B: кращий від 8, гірший до 2
+        self.assertEqual(guess_pair_pool.size(8, 2), 10)
+
+        high, low = guess_pair_pool.pop(8, 2)
+        self.assertGreaterEqual(high.rate, 8)
+        self.assertLessEqual(low.rate, 2)
+        self.assertEqual(guess_pair_pool.size(8, 2), 9)
+
+    def test_pairs_with_deleted_prompts_are_skipped(self):
+        """Перевірка, що пара з видаленим промптом не потрапляє в раунд"""
+        guess_pair_pool.refill(8, 2)
+        Prompt.objects.filter(rate=1).delete()
+
+        for _ in range(7):
+            pair = guess_pair_pool.pop(8, 2)
+            if pair is not None:
+                self.assertEqual(pair[1].rate, 2)
+
+
+    def test_pairs_with_rescored_prompts_are_skipped(self):
+        """Перевірка, що пара з переоціненим промптом не видається"""
+        guess_pair_pool.refill(8, 2)
+        # Кращі промпти переоцінені нижче за поріг складності
+        Prompt.objects.filter(rate__gte=8).update(rate=5)
+
+        for _ in range(3):
+            self.assertIsNone(guess_pair_pool.pop(8, 2))
+
+    def test_invalidate_drops_queued_pairs(self):
+        """Перевірка, що invalidate відкидає всі пари в черзі"""
+        guess_pair_pool.refill(8, 2)
+        self.assertEqual(guess_pair_pool.size(8, 2), 10)
+
+        guess_pair_pool.invalidate()
+        self.assertEqual(guess_pair_pool.size(8, 2), 0)
+
+
+@override_settings(GUESS_SESSION_ROUNDS=4)
+class GuessSessionTest(TestCase):
+    """Тести багатораундової гри «Вгадай кращий промпт»"""
+
+    def setUp(self):
+        caches["default"].clear()
+        for rate in (1, 2, 8, 9):
+            Prompt.objects.create(
+                prompt_text=f"Промпт {rate}", improvement_hint="-", rate=rate
+            )
+        prompt_sample_index.rebuild()
+        self.user = CustomUser.objects.create_user(
+            email="user@test.com", password="pass123", nickname="user"
+        )
+        self.user.is_active = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def _start(self):
+        response = self.client.get(reverse("prompt_gamified:guess_the_best_session"))
+        return response.context["session_id"], response.context["rounds"]
+
+    def _answer(self, session_id, round_index, prompt_id):
+        return self.client.post(
+            reverse("prompt_gamified:guess_the_best_answer", args=[session_id]),
+            data=json.dumps({"round": round_index, "prompt_id": prompt_id}),
+            content_type="application/json",
+        )
+
+    def test_session_awards_points_once_at_the_end(self):
+        """Перевірка, що бали за всі раунди нараховуються після останнього"""
+        session_id, rounds = self._start()
+        self.assertEqual(len(rounds), 4)
+        best_ids = set(
+            Prompt.objects.filter(rate__gte=8).values_list("id", flat=True)
+        )
+
+        for index, choices in enumerate(rounds):
+            best = next(choice for choice in choices if choice["id"] in best_ids)
+            # Перші два раунди — правильно, решта — ні
+            choice = best if index < 2 else next(c for c in choices if c != best)
+            data = self._answer(session_id, index, choice["id"]).json()
+            self.assertEqual(data["result"], "win" if index < 2 else "loss")
+            self.assertEqual(data["finished"], index == 3)
+
+            self.user.refresh_from_db()
+            self.assertEqual(self.user.points, 60 if index == 3 else 0)
+
+        self.assertEqual(self.user.exp, 4)
+        self.assertEqual(data["wins"], 2)
+
+    def test_round_cannot_be_answered_twice(self):
+        """Перевірка, що на раунд не можна відповісти двічі"""
+        session_id, rounds = self._start()
+
+        self.assertEqual(self._answer(session_id, 0, rounds[0][0]["id"]).status_code, 200)
+        self.assertEqual(self._answer(session_id, 0, rounds[0][1]["id"]).status_code, 400)
+
+    def test_other_user_cannot_answer(self):
+        """Перевірка, що чужа гра недоступна"""
+        session_id, rounds = self._start()
+        other = CustomUser.objects.create_user(
+            email="other@test.com", password="pass123", nickname="other"
+        )
+        other.is_active = True
+        other.save()
+        self.client.force_login(other)
+
+        response = self._answer(session_id, 0, rounds[0][0]["id"])
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(TOP_PROMPTS_SIZE=3)
+class TopPromptsTest(TestCase):
+    """Тести списку найкращих промптів"""
+
+    def setUp(self):
+        caches["default"].clear()
+        self.prompts = {
+            rate: Prompt.objects.create(
+                prompt_text=f"Промпт {rate}", improvement_hint="-", rate=rate
+            )
+            for rate in (3, 5, 7, 9)
+        }
+
+    def _ids(self, entries):
+        return [entry["id"] for entry in entries]
+
+    def test_new_prompt_is_inserted_without_query(self):
+        """Перевірка, що новий кращий промпт додається в список без запиту до БД"""
+        top_prompts.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            best = Prompt.objects.create(
+                prompt_text="Новий", improvement_hint="-", rate=9
+            )
+            Prompt.objects.create(prompt_text="Слабкий", improvement_hint="-", rate=2)
+
+        with self.assertNumQueries(0):
+            entries = top_prompts.get()
+        # При однаковій оцінці новіший промпт вище
+        self.assertEqual(
+            self._ids(entries), [best.id, self.prompts[9].id, self.prompts[7].id]
+        )
+
+    def test_rate_edit_reorders_or_rebuilds_list(self):
+        """Перевірка, що зміна оцінки переставляє промпт або перебудовує список"""
+        top_prompts.get()
+
+        prompt = self.prompts[3]
+        prompt.rate = 8
+        with self.captureOnCommitCallbacks(execute=True):
+            prompt.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self._ids(top_prompts.get()),
+                [self.prompts[9].id, prompt.id, self.prompts[7].id],
+            )
+
+        # Промпт випадає з повного списку — його місце займає промпт з БД
+        prompt.rate = 1
+        with self.captureOnCommitCallbacks(execute=True):
+            prompt.save(update_fields=["rate"])
+        self.assertEqual(
+            self._ids(top_prompts.get()),
+            [self.prompts[9].id, self.prompts[7].id, self.prompts[5].id],
+        )
+
+    def test_rolled_back_changes_do_not_reach_list(self):
+        """Перевірка, що відкочені створення та видалення не змінюють список"""
+        expected = [self.prompts[9].id, self.prompts[7].id, self.prompts[5].id]
+        top_prompts.get()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Prompt.objects.create(
+                        prompt_text="Відкочений", improvement_hint="-", rate=10
+                    )
+                    self.prompts[9].delete()
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self._ids(top_prompts.get()), expected)
+
+    def test_view_filters_by_rate(self):
+        """Перевірка фільтрів бібліотеки промптів"""
+        user = CustomUser.objects.create_user(
+            email="user@test.com", password="pass123", nickname="user"
+        )
+        user.is_active = True
+        user.save()
+        self.client.force_login(user)
+
+        response = self.client.get(
+            reverse("prompt_gamified:good_prompts"), {"min_rate": 6}
+        )
+        self.assertEqual(
+            self._ids(response.context["prompts"]),
+            [self.prompts[9].id, self.prompts[7].id],
+        )
+
+        response = self.client.get(
+            reverse("prompt_gamified:good_prompts"), {"max_rate": 5, "order": "new"}
+        )
+        self.assertEqual(
+            self._ids(response.context["prompts"]),
+            [self.prompts[5].id, self.prompts[3].id],
+        )
+
+
+@override_settings(PROMPT_SEARCH_PAGE_SIZE=2)
+class PromptSearchTest(TestCase):
+    """Тести повнотекстового пошуку промптів"""
+
+    def setUp(self):
+        self.autumn = [
+            Prompt.objects.create(
+                prompt_text=f"Напиши вірш про осінь номер {i}",
+                improvement_hint="Додай настрій",
+                rate=rate,
+            )
+            for i, rate in enumerate((4, 6, 8))
+        ]
+        self.hint_only = Prompt.objects.create(
+            prompt_text="Опиши парк", improvement_hint="Згадай осінь", rate=9
+        )
+        Prompt.objects.create(
+            prompt_text="Напиши код", improvement_hint="Уточни мову", rate=7
+        )
+
+    def test_ranked_prefix_search_with_keyset_pages(self):
+        """Перевірка префіксного пошуку, ранжування та сторінок за курсором"""
+        page, cursor = search_prompts("осін")
+        # Збіг у тексті промпта важить більше, ніж у підказці
+        self.assertEqual(
+            [prompt.id for prompt in page], [self.autumn[2].id, self.autumn[1].id]
+        )
+        self.assertIsNotNone(cursor)
+
+        page, cursor = search_prompts("осін", cursor=cursor)
+        self.assertEqual(
+            [prompt.id for prompt in page], [self.autumn[0].id, self.hint_only.id]
+        )
+        self.assertIsNone(cursor)
+
+    def test_rate_filter_and_empty_query(self):
+        """Перевірка фільтра за оцінкою та запиту без слів"""
+        page, _ = search_prompts("вірш осінь", min_rate=5, max_rate=7)
+        self.assertEqual([prompt.id for prompt in page], [self.autumn[1].id])
+        self.assertEqual(search_prompts("!!! ?"), ([], None))
+
+    def test_admin_search_uses_full_text_query(self):
+        """Перевірка пошуку промптів в адмінці"""
+        admin = CustomUser.objects.create_superuser(
+            email="admin@test.com", password="pass123", nickname="admin"
+        )
+        admin.is_active = True
+        admin.save()
+        self.client.force_login(admin)
+
+        response = self.client.get(
+            reverse("admin:prompt_gamified_prompt_changelist"), {"q": "код"}
+        )
+        self.assertEqual(response.context["cl"].result_count, 1)
+
+
+class SimilarPromptsTest(TestCase):
+    """Тести індексу схожих промптів з високою оцінкою"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        override = override_settings(SIMILAR_PROMPTS_DIR=directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        caches["default"].clear()
+
+        self.poems = [
+            Prompt.objects.create(
+                prompt_text=text, improvement_hint="-", rate=rate
+            )
+            for text, rate in (
+                ("Напиши вірш про осінь у Києві з римою", 9),
+                ("Напиши вірш про зиму в горах", 8),
+                ("Напиши вірш про осінь", 3),
+            )
+        ]
+        for text in (
+            "Напиши Django view для списку товарів",
+            "Поясни різницю між TCP та UDP",
+            "Склади план тренувань на тиждень",
+        ):
+            Prompt.objects.create(prompt_text=text, improvement_hint="-", rate=9)
+
+    def test_similar_high_rated_prompts(self):
+        """Перевірка, що знаходяться схожі промпти лише з високою оцінкою"""
+        similar_prompts.rebuild()
+
+        with self.assertNumQueries(1):
+            results = similar_prompts.similar("Напиши вірш про осінь у Львові")
+        ids = [result["id"] for result in results]
+        self.assertEqual(ids[:2], [self.poems[0].id, self.poems[1].id])
+        self.assertNotIn(self.poems[2].id, ids)
+
+    def test_new_prompt_is_added_incrementally(self):
+        """Перевірка, що новий промпт потрапляє в індекс без повної збірки"""
+        similar_prompts.rebuild()
+        base = json.loads((similar_prompts.path / "manifest.json").read_text())["base"]
+
+        caches["default"].clear()
+        prompt = Prompt.objects.create(
+            prompt_text="Розкажи казку про кота", improvement_hint="-", rate=10
+        )
+
+        manifest = json.loads((similar_prompts.path / "manifest.json").read_text())
+        self.assertEqual(manifest["base"], base)
+        self.assertIsNotNone(manifest["delta"])
+        results = similar_prompts.similar("Розкажи казку про кота і пса")
+        self.assertEqual(results[0]["id"], prompt.id)
+
+
+    def test_update_does_not_publish_delta_for_replaced_base(self):
+        """Перевірка, що delta не публікується, якщо base замінили під час збірки"""
+        similar_prompts.rebuild()
+        Prompt.objects.create(
+            prompt_text="Розкажи казку про кота", improvement_hint="-", rate=10
+        )
+        write = Segment.write
+
+        def write_and_rebuild(path, rows, idf):
+            # Поки пишеться delta, інший воркер повністю перебудовує індекс
+            if path.name.startswith("delta-"):
+                similar_prompts._rebuild()
+            return write(path, rows, idf)
+
+        with patch.object(Segment, "write", side_effect=write_and_rebuild):
+            self.assertEqual(similar_prompts.update(), 0)
+
+        manifest = json.loads((similar_prompts.path / "manifest.json").read_text())
+        self.assertIsNone(manifest["delta"])
+        self.assertTrue((similar_prompts.path / manifest["base"]).is_dir())
+        results = similar_prompts.similar("Розкажи казку про кота і пса")
+        self.assertTrue(results)
+
+    def test_builds_are_serialized(self):
+        """Перевірка, що друга збірка чекає, поки завершиться перша"""
+        entered = threading.Event()
+
+        def build():
+            with similar_prompts._build_lock():
+                entered.set()
+
+        with similar_prompts._build_lock():
+            thread = threading.Thread(target=build)
+            thread.start()
+            self.assertFalse(entered.wait(0.2))
+        thread.join(5)
+        self.assertTrue(entered.is_set())
+
+
+class PromptDumpCommandTest(TestCase):
+    """Тести команд export_prompts та import_prompts"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.directory = directory
+        self.user = CustomUser.objects.create_user(
+            email="author@test.com", password="pass123", nickname="author"
+        )
+        Prompt.objects.create(
+            prompt_text='Напиши "вірш"\nпро осінь, з комою',
+            improvement_hint="Додай настрій",
+            rate=8,
+            user=self.user,
+        )
+        Prompt.objects.create(prompt_text="Опиши парк", improvement_hint="-", rate=3)
+
+    def _roundtrip(self, filename):
+        path = os.path.join(self.directory, filename)
+        call_command("export_prompts", path, stdout=StringIO())
+        exported = list(
+            Prompt.objects.order_by("id").values_list(
+                "prompt_text", "improvement_hint", "rate", "user_id"
+            )
+        )
+        Prompt.objects.all().delete()
+
+        out = StringIO()
+        call_command("import_prompts", path, "--workers=1", stdout=out)
+        self.assertIn("Завантажено 2 промптів", out.getvalue())
+        self.assertEqual(
+            list(
+                Prompt.objects.order_by("id").values_list(
+                    "prompt_text", "improvement_hint", "rate", "user_id"
+                )
+            ),
+            exported,
+        )
+        self.assertTrue(all(Prompt.objects.values_list("minhash_bands", flat=True)))
+
+    def test_jsonl_roundtrip(self):
+        """Перевірка вивантаження та завантаження JSONL"""
+        self._roundtrip("prompts.jsonl")
+
+    def test_csv_roundtrip(self):
+        """Перевірка вивантаження та завантаження CSV"""
+        self._roundtrip("prompts.csv")
+
+    def test_import_skips_duplicates_and_invalid_rows(self):
+        """Перевірка, що дублікати, некоректні рядки та невідомі автори враховуються"""
+        path = os.path.join(self.directory, "prompts.jsonl")
+        rows = [
+            {"prompt_text": "Опиши парк", "rate": 5},
+            {"prompt_text": "Новий промпт", "rate": 7, "user": "author"},
+            {"prompt_text": "Новий промпт", "rate": 7},
+            {"prompt_text": "Ще один", "rate": 9, "user": "ghost"},
+            {"prompt_text": "", "rate": 5},
+            {"prompt_text": "Завелика оцінка", "rate": 11},
+        ]
+        with open(path, "w", encoding="utf-8") as dump:
+            for row in rows:
+                dump.write(json.dumps(row, ensure_ascii=False) + "\n")
+            dump.write("{не json\n")
+
+        out = StringIO()
+        call_command(
+            "import_prompts", path, "--workers=1", "--batch-size=2", stdout=out
+        )
+        self.assertIn(
+            "Завантажено 2 промптів, дублікатів: 2, некоректних рядків: 3, "
+            "без відомого автора: 1.",
+            out.getvalue(),
+        )
+        self.assertEqual(
+            Prompt.objects.get(prompt_text="Новий промпт").user_id, self.user.id
+        )
+        self.assertIsNone(Prompt.objects.get(prompt_text="Ще один").user_id)
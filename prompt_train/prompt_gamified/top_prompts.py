@@ -0,0 +1,187 @@
+"""Список найкращих промптів для бібліотеки промптів.
+
+Перші TOP_PROMPTS_SIZE промптів за (rate, id) — від кращого до гіршого, а
+серед однакових оцінок від новішого — зберігаються в спільному кеші.
+Новий промпт потрапляє в список, лише якщо він кращий за останній. Зміна
+оцінки чи тексту оновлює список на місці, тож перегляд сторінки не
+звертається до таблиці.
+
+Якщо список не можна оновити на місці (промпт випав з повного списку, інший
+процес саме оновлює список), номер версії в кеші збільшується. Список зі
+старою версією вважається застарілим, і наступний перегляд будує його
+заново одним запитом за індексом (rate, id).
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .counters import incr_counter
+from .models import Prompt
+
+TOP_KEY = "top_prompts:list"
+VERSION_KEY = "top_prompts:version"
+LOCK_KEY = "top_prompts:lock"
+LOCK_TTL = 5
+
+# Скільки секунд кешується вибірка з фільтрами, яку не можна отримати зі списку
+FILTERED_TTL = 60
+
+FIELDS = ("id", "prompt_text", "improvement_hint", "rate")
+ORDERINGS = {"rate": ("-rate", "-id"), "new": ("-id",)}
+
+
+def _sort_key(entry: dict) -> tuple[int, int]:
+    return entry["rate"], entry["id"]
+
+
+def _entry(prompt: Prompt) -> dict:
+    entry = {field: getattr(prompt, field) for field in FIELDS}
+    # rate могли передати дробовим, у базі він уже цілий
+    entry["rate"] = int(entry["rate"])
+    return entry
+
+
+def _clamp_rate(value, default: int) -> int:
+    try:
+        return min(max(int(value), 1), 10)
+    except (TypeError, ValueError):
+        return default
+
+
+def top_prompt_filters(params) -> tuple[int, int, str]:
+    """Фільтри сторінки з GET параметрів: (min_rate, max_rate, order)."""
+    min_rate = _clamp_rate(params.get("min_rate"), 1)
+    max_rate = _clamp_rate(params.get("max_rate"), 10)
+    order = params.get("order")
+    return min_rate, max(min_rate, max_rate), order if order in ORDERINGS else "rate"
+
+
+class TopPrompts:
+    def _query(self, min_rate: int = 1, max_rate: int = 10, order: str = "rate"):
+        return list(
+            Prompt.objects.filter(rate__gte=min_rate, rate__lte=max_rate)
+            .order_by(*ORDERINGS[order])
+            .values(*FIELDS)[: settings.TOP_PROMPTS_SIZE]
+        )
+
+    def _cached(self) -> tuple[int, list | None]:
+        state = cache.get_many([TOP_KEY, VERSION_KEY])
+        version = state.get(VERSION_KEY, 0)
+        top = state.get(TOP_KEY)
+        if top is None or top["version"] != version:
+            return version, None
+        return version, top["entries"]
+
+    def get(self) -> list[dict]:
+        """Найкращі промпти від кращого до гіршого."""
+        version, entries = self._cached()
+        if entries is None:
+            entries = self._query()
+            # Якщо тим часом список застарів, версія вже інша і його
+            # перебудує наступний перегляд
+            cache.set(TOP_KEY, {"version": version, "entries": entries}, None)
+        return entries
+
+    def filtered(self, min_rate: int, max_rate: int, order: str) -> list[dict]:
+        """Найкращі промпти з оцінкою від min_rate до max_rate."""
+        if order == "rate" and max_rate == 10:
+            # Кращі промпти з оцінкою від min_rate — це початок загального списку
+            return [entry for entry in self.get() if entry["rate"] >= min_rate]
+
+        key = f"top_prompts:{min_rate}-{max_rate}:{order}"
+        entries = cache.get(key)
+        if entries is None:
+            entries = self._query(min_rate, max_rate, order)
+            cache.set(key, entries, FILTERED_TTL)
+        return entries
+
+    def _update(self, change) -> None:
+        # Зміни з різних процесів не повинні перезаписати одна одну
+        if cache.add(LOCK_KEY, 1, LOCK_TTL):
+            try:
+                version, entries = self._cached()
+                if entries is not None:
+                    entries = change(list(entries))
+                    if entries is not None:
+                        cache.set(
+                            TOP_KEY, {"version": version, "entries": entries}, None
+                        )
+                        return
+            finally:
+                cache.delete(LOCK_KEY)
+        self.invalidate()
+
+    def _insert(self, entries: list, entry: dict) -> list:
+        entries.append(entry)
+        entries.sort(key=_sort_key, reverse=True)
+        del entries[settings.TOP_PROMPTS_SIZE :]
+        return entries
+
+    def _beats_last(self, entries: list, entry: dict) -> bool:
+        return len(entries) < settings.TOP_PROMPTS_SIZE or _sort_key(entry) > _sort_key(
+            entries[-1]
+        )
+
+    def add(self, prompt: Prompt) -> None:
+        """Новий промпт: потрапляє в список, якщо він кращий за останній."""
+        entry = _entry(prompt)
+        _, entries = self._cached()
+        # Звичайний випадок — промпт гірший за весь список, нічого не пишемо
+        if entries is not None and not self._beats_last(entries, entry):
+            return
+        self._update(
+            lambda entries: (
+                self._insert(entries, entry)
+                if self._beats_last(entries, entry)
+                else entries
+            )
+        )
+
+    def update(self, prompt: Prompt) -> None:
+        """Змінений промпт: оновлює або переставляє його в списку."""
+        entry = _entry(prompt)
+
+        def change(entries):
+            ids = [item["id"] for item in entries]
+            if entry["id"] not in ids:
+                return (
+                    self._insert(entries, entry)
+                    if self._beats_last(entries, entry)
+                    else entries
+                )
+
+            was_full = len(entries) >= settings.TOP_PROMPTS_SIZE
+            del entries[ids.index(entry["id"])]
+            # Неповний список містить усі промпти, а в повному промпт лишається,
+            # якщо він досі кращий за останній
+            if not was_full or (entries and _sort_key(entry) > _sort_key(entries[-1])):
+                return self._insert(entries, entry)
+            # Промпт випав з повного списку: його місце займе промпт, якого
+            # в списку немає
+            return None
+
+        self._update(change)
+
+    def discard(self, prompt_id: int) -> None:
+        """Видалений промпт."""
+
+        def change(entries):
+            ids = [item["id"] for item in entries]
+            if prompt_id not in ids:
+                return entries
+            if len(entries) >= settings.TOP_PROMPTS_SIZE:
+                return None
+            del entries[ids.index(prompt_id)]
+            return entries
+
+        _, entries = self._cached()
+        if entries is not None and all(item["id"] != prompt_id for item in entries):
+            return
+        self._update(change)
+
+    def invalidate(self) -> None:
+        """Змушує перебудувати список при наступному перегляді."""
+        incr_counter(VERSION_KEY)
+
+
+top_prompts = TopPrompts()
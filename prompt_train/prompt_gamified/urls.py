@@ -11,6 +11,21 @@ urlpatterns = [
     path("home", views.home_view, name="home_page"),
     path("good-prompts/", views.good_prompts_view, name="good_prompts"),
     path("prompt-trainer/", views.prompt_trainer_view, name="prompt_trainer"),
+    path(
+        "evaluations/<str:job_id>/",
+        views.evaluation_status_view,
+        name="evaluation_status",
+    ),
+    path(
+        "llm/status/",
+        views.llm_status_view,
+        name="llm_status",
+    ),
+    path(
+        "llm/metrics/",
+        views.evaluation_metrics_view,
+        name="evaluation_metrics",
+    ),
     path("leaderboard/", views.leaderboard_view, name="leaderboard"),
     path("challenge/", views.challenge_view, name="challenge"),
     path(
@@ -18,6 +33,16 @@ urlpatterns = [
         views.guess_the_best_prompt_view,
         name="guess_the_best_prompt",
     ),
+    path(
+        "guess-the-best-prompt/session/",
+        views.guess_the_best_session_view,
+        name="guess_the_best_session",
+    ),
+    path(
+        "guess-the-best-prompt/session/<str:session_id>/answer/",
+        views.guess_the_best_answer_view,
+        name="guess_the_best_answer",
+    ),
     path("store/", views.store_view , name="store"),
     path("buy-cosmetic/<int:cosmetic_id>/", views.buy_cosmetic_view, name="buy_cosmetic"),
 ]
@@ -1,25 +1,46 @@
+import asyncio
+import logging
 import random
-from django.db import transaction
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from .models import Prompt
-from .ai_func import evaluate_prompt_quality
+from .ai_func import (
+    aevaluate_prompt_quality,
+    evaluate_prompt_quality,
+    evaluation_outcome,
+    evaluator_version_for,
+)
+from .fingerprints import find_near_duplicate
+from .jobs import (
+    AsyncPartialResultPublisher,
+    acomplete_evaluation_job,
+    create_evaluation_job,
+)
+from .pair_pool import guess_pair_pool
+from .rate_limiter import Priority
+from .sampling import prompt_sample_index
+from .similar_prompts import similar_prompts
+
+logger = logging.getLogger(__name__)
+
+# Челендж без справжньої оцінки (збій, орієнтовна оцінка) не рахується
+UNRATED_RESULT = "unrated"
+UNRATED_MESSAGE = "Не вдалося оцінити промпт, бали не нараховано. Спробуйте ще раз!"
+
+
+def is_rated(evaluation: tuple[float, str, str]) -> bool:
+    """Чи оцінку дала модель. Орієнтовні та невдалі оцінки не зберігаються
+    як промпти і не приносять балів."""
+    return evaluation_outcome(evaluation) == "ok"
 
 
 def get_random_high_rated_prompt(min_rate=7) -> Prompt | None:
-    high_rated_prompts = Prompt.objects.filter(rate__gte=min_rate)
-
-    if not high_rated_prompts.exists():
-        return None
-
-    return random.choice(high_rated_prompts)
+    return prompt_sample_index.random_prompt(min_rate=min_rate)
 
 
 def get_random_low_rated_prompt(max_rate=4) -> Prompt | None:
-    low_rated_prompts = Prompt.objects.filter(rate__lte=max_rate)
-
-    if not low_rated_prompts.exists():
-        return None
-
-    return random.choice(low_rated_prompts)
+    return prompt_sample_index.random_prompt(max_rate=max_rate)
 
 
 def get_difference_between_rates(user) -> tuple[int, int]:
@@ -57,60 +78,166 @@ def calculate_challenge_result(
         return "loss", "Програш. Спробуйте ще раз!"
 
 
-def award_user_points(user, result: str) -> None:
+def award_user_points(user, result: str, times: int = 1) -> None:
+    # times — кількість однакових результатів, що нараховуються разом
     if result == "win":
-        user.exp += 2
-        user.points += 30
+        user.add_rewards(exp=2 * times, points=30 * times)
     elif result == "draw":
-        user.exp += 1
-        user.points += 10
+        user.add_rewards(exp=1 * times, points=10 * times)
+
+
+def create_user_prompt(
+    user_prompt_text: str, user, on_partial=None, priority=Priority.TRAINER
+) -> tuple[float, str, str]:
+
+    evaluation = evaluate_prompt_quality(
+        user_prompt_text, on_partial=on_partial, priority=priority, user_id=user.id
+    )
+    user_rate, improvement_hint, refined_prompt = evaluation
 
-    with transaction.atomic():
-        user.save(update_fields=["exp", "points", "rank"])
+    if is_rated(evaluation):
+        Prompt.objects.create(
+            prompt_text=user_prompt_text,
+            improvement_hint=improvement_hint,
+            rate=user_rate,
+            user=user,
+            evaluator_version=evaluator_version_for(evaluation),
+        )
 
+    return user_rate, improvement_hint, refined_prompt
 
-def create_user_prompt(user_prompt_text: str, user) -> tuple[float, str, str]:
 
-    user_rate, improvement_hint, refined_prompt = evaluate_prompt_quality(
-        user_prompt_text
+def evaluate_challenge_prompt(
+    user, user_prompt_text: str, challenge_prompt: Prompt, on_partial=None
+) -> dict:
+    """Оцінює промпт челенджу та нараховує бали. Викликається з Celery задачі."""
+    # Челендж — інтерактивна гра, тому має перевагу над тренажером
+    evaluation = create_user_prompt(
+        user_prompt_text, user, on_partial=on_partial, priority=Priority.CHALLENGE
     )
+    user_rate, improvement_hint, refined_prompt = evaluation
+
+    if is_rated(evaluation):
+        result, message = calculate_challenge_result(user_rate, challenge_prompt.rate)
+        award_user_points(user, result)
+    else:
+        result, message = UNRATED_RESULT, UNRATED_MESSAGE
+
+    return {
+        "result": result,
+        "message": message,
+        "user_prompt": user_prompt_text,
+        "user_rate": user_rate,
+        "challenge_rate": challenge_prompt.rate,
+        "improvement_hint": improvement_hint,
+        "refined_prompt": refined_prompt,
+    }
+
+
+def enqueue_prompt_evaluation(
+    user, prompt_text: str, challenge_prompt_id: int | None = None
+) -> str:
+    """Ставить оцінку промпта в чергу Celery та одразу повертає id задачі."""
+    from .tasks import evaluate_prompt_task
 
-    Prompt.objects.create(
-        prompt_text=user_prompt_text,
-        improvement_hint=improvement_hint,
-        rate=user_rate,
-        user=user,
+    # Задача має існувати до відправки в чергу: worker може завершити її
+    # раніше, ніж view поверне відповідь
+    job_id = create_evaluation_job(user.id)
+    evaluate_prompt_task.delay(job_id, user.id, prompt_text, challenge_prompt_id)
+    return job_id
+
+
+def award_trainer_points(user, rate: float) -> None:
+    exp = 1 if rate > 7 else 0
+    points = 20 if rate >= 8 else 0
+    if exp or points:
+        user.add_rewards(exp=exp, points=points)
+
+
+def evaluate_trainer_prompt(user, user_message: str, on_partial=None) -> dict:
+    """Оцінює промпт тренажера та нараховує бали. Викликається з Celery задачі."""
+    evaluation = evaluate_prompt_quality(
+        user_message,
+        on_partial=on_partial,
+        priority=Priority.TRAINER,
+        user_id=user.id,
     )
+    rate, improvement_hint, refined_prompt = evaluation
+
+    if is_rated(evaluation):
+        Prompt.objects.create(
+            prompt_text=user_message,
+            improvement_hint=improvement_hint,
+            rate=rate,
+            user=user,
+            evaluator_version=evaluator_version_for(evaluation),
+        )
+        award_trainer_points(user, rate)
+
+    return {
+        "prompt_text": user_message,
+        "prompt_rate": rate,
+        "improvement_hint": improvement_hint,
+        "refined_prompt": refined_prompt,
+        "similar_prompts": similar_prompts.similar(user_message),
+    }
 
-    return user_rate, improvement_hint, refined_prompt
 
+# Обробники async views тренажера та челенджу. Якщо EVALUATION_RUNNER =
+# "asyncio", оцінка виконується в event loop того ж процесу замість Celery
+
+
+async def ahandle_prompt_trainer_post(
+    user, user_message: str
+) -> tuple[dict, str | None]:
+    user_message = user_message.strip()
+
+    if not user_message:
+        return {}, "Будь ласка, введіть промпт."
 
-def handle_challenge_get(request) -> dict:
+    if len(user_message) > 500:
+        return {}, "Промпт має бути не більше 500 символів."
+
+    near_duplicate = await sync_to_async(find_near_duplicate)(user_message)
+
+    job_id = await aenqueue_prompt_evaluation(user, user_message)
+
+    context = {
+        "prompt_text": user_message,
+        "job_id": job_id,
+    }
+    if near_duplicate:
+        context["similar_prompt"], context["similarity"] = near_duplicate
+
+    return context, None
+
+
+async def ahandle_challenge_get(request) -> dict:
     context = {}
 
-    challenge_prompt = get_random_high_rated_prompt()
+    challenge_prompt = await sync_to_async(get_random_high_rated_prompt)()
 
     if not challenge_prompt:
         context["error"] = "Поки що немає промптів з оцінкою 7+. Спробуйте пізніше!"
         return context
 
-    request.session["challenge_prompt_id"] = challenge_prompt.id
+    await request.session.aset("challenge_prompt_id", challenge_prompt.id)
     context["challenge_prompt"] = challenge_prompt
 
     return context
 
 
-def handle_challenge_post(request) -> dict:
+async def ahandle_challenge_post(request) -> dict | None:
     context = {}
 
     user_prompt_text = request.POST.get("prompt", "").strip()
-    challenge_prompt_id = request.session.get("challenge_prompt_id")
+    challenge_prompt_id = await request.session.aget("challenge_prompt_id")
 
     if not challenge_prompt_id:
         return None
 
     try:
-        challenge_prompt = Prompt.objects.get(id=challenge_prompt_id)
+        challenge_prompt = await Prompt.objects.aget(id=challenge_prompt_id)
     except Prompt.DoesNotExist:
         return None
 
@@ -120,78 +247,155 @@ def handle_challenge_post(request) -> dict:
         context["challenge_prompt"] = challenge_prompt
         return context
 
-    user_rate, improvement_hint, refined_prompt = create_user_prompt(
-        user_prompt_text, request.user
+    user = await request.auser()
+    job_id = await aenqueue_prompt_evaluation(
+        user, user_prompt_text, challenge_prompt.id
     )
 
-    result, message = calculate_challenge_result(user_rate, challenge_prompt.rate)
-
-    award_user_points(request.user, result)
-
-    if "challenge_prompt_id" in request.session:
-        del request.session["challenge_prompt_id"]
+    await request.session.apop("challenge_prompt_id", None)
 
     context.update(
         {
-            "result": result,
-            "message": message,
+            "job_id": job_id,
             "user_prompt": user_prompt_text,
-            "user_rate": user_rate,
             "challenge_prompt": challenge_prompt,
             "challenge_rate": challenge_prompt.rate,
-            "improvement_hint": improvement_hint,
-            "refined_prompt": refined_prompt,
         }
     )
 
     return context
 
 
-def handle_prompt_trainer_post(user, user_message: str) -> tuple[dict, str | None]:
-    user_message = user_message.strip()
-
-    if not user_message:
-        return {}, "Будь ласка, введіть промпт."
+# Посилання на задачі, щоб event loop не втратив їх до завершення
+_background_evaluations = set()
 
-    if len(user_message) > 500:
-        return {}, "Промпт має бути не більше 500 символів."
 
-    rate, improvement_hint, refined_prompt = evaluate_prompt_quality(user_message)
+async def aenqueue_prompt_evaluation(
+    user, prompt_text: str, challenge_prompt_id: int | None = None
+) -> str:
+    if settings.EVALUATION_RUNNER != "asyncio":
+        return await sync_to_async(enqueue_prompt_evaluation)(
+            user, prompt_text, challenge_prompt_id
+        )
 
-    Prompt.objects.create(
-        prompt_text=user_message,
-        improvement_hint=improvement_hint,
-        rate=rate,
-        user=user,
+    job_id = await sync_to_async(create_evaluation_job)(user.id)
+    task = asyncio.create_task(
+        arun_evaluation_job(job_id, user.id, prompt_text, challenge_prompt_id)
     )
+    _background_evaluations.add(task)
+    task.add_done_callback(_background_evaluations.discard)
+    return job_id
 
-    updated_fields = []
-    if rate > 7:
-        user.exp += 1
-        updated_fields.append("exp")
-    if rate >= 8:
-        user.points += 20
-        updated_fields.append("points")
 
-    if updated_fields:
-        with transaction.atomic():
-            user.save(update_fields=updated_fields)
+async def arun_evaluation_job(
+    job_id: str, user_id: int, prompt_text: str, challenge_prompt_id=None
+) -> None:
+    """Async-аналог evaluate_prompt_task."""
+    User = get_user_model()
+    on_partial = None
+    if settings.EVALUATION_STREAMING:
+        on_partial = AsyncPartialResultPublisher(job_id, user_id)
 
-    context = {
+    try:
+        user = await User.objects.aget(id=user_id)
+        if challenge_prompt_id is None:
+            result = await aevaluate_trainer_prompt(
+                user, prompt_text, on_partial=on_partial
+            )
+        else:
+            challenge_prompt = await Prompt.objects.aget(id=challenge_prompt_id)
+            result = await aevaluate_challenge_prompt(
+                user, prompt_text, challenge_prompt, on_partial=on_partial
+            )
+    except (User.DoesNotExist, Prompt.DoesNotExist) as e:
+        logger.error(f"Задачу оцінювання {job_id} неможливо виконати: {e}")
+        await acomplete_evaluation_job(job_id, user_id, None, status="failed")
+        return
+    except Exception:
+        # Помилка у фоновій задачі інакше лишилась би непоміченою
+        logger.exception("Async evaluation job %s failed", job_id)
+        await acomplete_evaluation_job(job_id, user_id, None, status="failed")
+        return
+
+    if on_partial:
+        await on_partial.flush()
+    await acomplete_evaluation_job(job_id, user_id, result)
+
+
+async def aevaluate_trainer_prompt(user, user_message: str, on_partial=None) -> dict:
+    evaluation = await aevaluate_prompt_quality(
+        user_message,
+        on_partial=on_partial,
+        priority=Priority.TRAINER,
+        user_id=user.id,
+    )
+    rate, improvement_hint, refined_prompt = evaluation
+
+    if is_rated(evaluation):
+        await Prompt.objects.acreate(
+            prompt_text=user_message,
+            improvement_hint=improvement_hint,
+            rate=rate,
+            user=user,
+            evaluator_version=evaluator_version_for(evaluation),
+        )
+        await sync_to_async(award_trainer_points)(user, rate)
+
+    return {
         "prompt_text": user_message,
         "prompt_rate": rate,
         "improvement_hint": improvement_hint,
         "refined_prompt": refined_prompt,
+        "similar_prompts": await sync_to_async(similar_prompts.similar)(user_message),
+    }
+
+
+async def aevaluate_challenge_prompt(
+    user, user_prompt_text: str, challenge_prompt: Prompt, on_partial=None
+) -> dict:
+    evaluation = await aevaluate_prompt_quality(
+        user_prompt_text,
+        on_partial=on_partial,
+        priority=Priority.CHALLENGE,
+        user_id=user.id,
+    )
+    user_rate, improvement_hint, refined_prompt = evaluation
+
+    if is_rated(evaluation):
+        await Prompt.objects.acreate(
+            prompt_text=user_prompt_text,
+            improvement_hint=improvement_hint,
+            rate=user_rate,
+            user=user,
+            evaluator_version=evaluator_version_for(evaluation),
+        )
+        result, message = calculate_challenge_result(user_rate, challenge_prompt.rate)
+        await sync_to_async(award_user_points)(user, result)
+    else:
+        result, message = UNRATED_RESULT, UNRATED_MESSAGE
+
+    return {
+        "result": result,
+        "message": message,
+        "user_prompt": user_prompt_text,
+        "user_rate": user_rate,
+        "challenge_rate": challenge_prompt.rate,
+        "improvement_hint": improvement_hint,
+        "refined_prompt": refined_prompt,
     }
-    return context, None
 
 
 def handle_guess_the_best_prompt_get(request) -> dict:
     context = {}
 
     min_rate, max_rate = get_difference_between_rates(request.user)
-    high_rated_prompt = get_random_high_rated_prompt(min_rate=min_rate)
-    low_rated_prompt = get_random_low_rated_prompt(max_rate=max_rate)
+    pair = guess_pair_pool.pop(min_rate, max_rate)
+    if pair is not None:
+        high_rated_prompt, low_rated_prompt = pair
+    else:
+        # Пул ще не наповнений: пара обирається напряму
+        high_rated_prompt = get_random_high_rated_prompt(min_rate=min_rate)
+        low_rated_prompt = get_random_low_rated_prompt(max_rate=max_rate)
 
     if not high_rated_prompt or not low_rated_prompt:
         context["error"] = "Недостатньо промптів для гри. Спробуйте пізніше!"
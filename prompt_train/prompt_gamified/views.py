@@ -1,21 +1,44 @@
+import json
+import logging
+
+import redis
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import get_user_model, login
 from django.core.paginator import Paginator
 from django.core.exceptions import ValidationError
-from users.models import CustomUser, Cosmetic, UserCosmetic
-from .models import Prompt
+from django.http import JsonResponse
+from users.leaderboard import leaderboard
+from users.models import Cosmetic, UserCosmetic
+from .guess_sessions import (
+    answer_guess_round,
+    session_rounds_for_client,
+    start_guess_session,
+)
+from .jobs import get_evaluation_job
+from .llm_client import get_connection_stats
+from .metrics import get_evaluation_metrics
+from .rate_limiter import get_rate_limiter_stats
+from .resilience import llm_circuit_breaker, llm_hedged_caller
+from .search import search_prompts
+from .single_flight import get_single_flight_stats
+from .top_prompts import top_prompt_filters, top_prompts
 from django.db import transaction
 import random
 from .utils import (
-    handle_challenge_get,
-    handle_challenge_post,
+    ahandle_challenge_get,
+    ahandle_challenge_post,
+    ahandle_prompt_trainer_post,
     handle_guess_the_best_prompt_get,
     handle_guess_the_best_prompt_post,
-    handle_prompt_trainer_post,
 )
 
+logger = logging.getLogger(__name__)
+
+
 def index_view(request):
     return render(request, "prompt_gamified/index.html")
 
@@ -26,61 +49,121 @@ def home_view(request):
 
 @login_required
 def good_prompts_view(request):
-    # Показуємо перші 100 промптів, починаючи з найкращого
-    prompts = Prompt.objects.all().order_by("-rate")[:100]
-    return render(request, "prompt_gamified/good_prompts.html", {"prompts": prompts})
+    # Найкращі промпти з кешу; фільтри за оцінкою та новизною
+    min_rate, max_rate, order = top_prompt_filters(request.GET)
+    search_text = request.GET.get("q", "").strip()
+    next_cursor = None
+    if search_text:
+        # Пошук за текстом: сторінки за курсором, від найрелевантнішого
+        prompts, next_cursor = search_prompts(
+            search_text, min_rate, max_rate, cursor=request.GET.get("cursor")
+        )
+    else:
+        prompts = top_prompts.filtered(min_rate, max_rate, order)
+
+    context = {
+        "prompts": prompts,
+        "q": search_text,
+        "next_cursor": next_cursor,
+        "min_rate": min_rate,
+        "max_rate": max_rate,
+        "order": order,
+        "rates": range(1, 11),
+    }
+    return render(request, "prompt_gamified/good_prompts.html", context)
+
+
+async def arender(request, template_name: str, context: dict):
+    # Контекст-процесори шаблонів звертаються до request.user синхронно
+    return await sync_to_async(render)(request, template_name, context)
 
 
 @login_required
-def prompt_trainer_view(request):
+async def prompt_trainer_view(request):
     context = {}
 
     if request.method == "POST":
         user_message = request.POST.get("prompt", "")
-        context, error = handle_prompt_trainer_post(request.user, user_message)
+        user = await request.auser()
+        context, error = await ahandle_prompt_trainer_post(user, user_message)
 
         if error:
             context["error"] = error
 
-    return render(request, "prompt_gamified/prompt_trainer.html", context)
+    return await arender(request, "prompt_gamified/prompt_trainer.html", context)
 
 
 @login_required
-def leaderboard_view(request):
-    users_list = CustomUser.objects.filter(is_active=True).order_by("-exp")
-    # 10 - максимальна кількість користувачів на сторінці
-    paginator = Paginator(users_list, 10)
+def evaluation_status_view(request, job_id):
+    # Резервний спосіб отримати результат, якщо WebSocket недоступний
+    job = get_evaluation_job(job_id)
+    if job is None or job["user_id"] != request.user.id:
+        return JsonResponse({"status": "not_found"}, status=404)
+
+    return JsonResponse(
+        {"job_id": job_id, "status": job["status"], "result": job["result"]}
+    )
 
-    page_number = request.GET.get("page", 1)
-    page_obj = paginator.get_page(page_number)
 
-    # Задаємо позицію першого користувача на сторінці
-    start_rank = (page_obj.number - 1) * paginator.per_page
+@staff_member_required
+def llm_status_view(request):
+    # Стан викликів LLM: з'єднання процесу, черга ліміту, circuit breaker,
+    # hedged запити
+    return JsonResponse(
+        {
+            "connections": get_connection_stats(),
+            "rate_limiter": get_rate_limiter_stats(),
+            "circuit_breaker": llm_circuit_breaker.stats(),
+            "hedging": llm_hedged_caller.stats(),
+            "single_flight": get_single_flight_stats(),
+        }
+    )
 
-    # Перебираємо позицію користувача на сторінці та починаємо з 1
-    for idx, user in enumerate(page_obj.object_list, start=1):
-        # Визначаємо глобальну позицію користувача.
-        # Наприклад, на сторінці 5 користувач із позицією 4 буде
-        # (5-1) * 10 + 4 = 44-м у глобальному рейтингу
-        user.rank_position = start_rank + idx
+
+@staff_member_required
+def evaluation_metrics_view(request):
+    # Затримки, результати, стан кешу, токени та вартість оцінювання
+    return JsonResponse(get_evaluation_metrics())
+
+
+@login_required
+def leaderboard_view(request):
+    # Гравці та їх позиції читаються з лідерборду в Redis, без запитів до
+    # таблиці користувачів. 10 - максимальна кількість користувачів на сторінці
+    page_number = request.GET.get("page", 1)
+    try:
+        paginator = Paginator(leaderboard.users(), 10)
+        page_obj = paginator.get_page(page_number)
+        my_position = leaderboard.position(request.user.id)
+        around_me = leaderboard.around(request.user.id)
+    except redis.RedisError as e:
+        # Без Redis таблиця читається з бази, але без місця користувача
+        logger.warning("Leaderboard is unavailable, reading from database: %s", e)
+        messages.warning(request, "Ваше місце в лідерборді тимчасово недоступне.")
+        paginator = Paginator(leaderboard.database_users(), 10)
+        page_obj = paginator.get_page(page_number)
+        my_position, around_me = None, []
 
     context = {
         "page_obj": page_obj,
         "total_users": paginator.count,
+        "my_position": my_position,
+        "my_page": (my_position - 1) // paginator.per_page + 1 if my_position else None,
+        "around_me": around_me,
     }
     return render(request, "prompt_gamified/leader_board.html", context)
 
 
 @login_required
-def challenge_view(request):
+async def challenge_view(request):
     if request.method == "GET":
-        context = handle_challenge_get(request)
+        context = await ahandle_challenge_get(request)
     else:
-        context = handle_challenge_post(request)
+        context = await ahandle_challenge_post(request)
         if context is None:
             return redirect("prompt_gamified:challenge")
 
-    return render(request, "prompt_gamified/challenge.html", context)
+    return await arender(request, "prompt_gamified/challenge.html", context)
 
 
 @login_required
@@ -95,6 +178,40 @@ def guess_the_best_prompt_view(request):
     return render(request, "prompt_gamified/guess_the_best_prompt.html", context)
 
 
+@login_required
+def guess_the_best_session_view(request):
+    # Усі раунди гри готуються одним запитом, відповіді надходять через JSON
+    session = start_guess_session(request.user)
+    if session is None:
+        context = {"error": "Недостатньо промптів для гри. Спробуйте пізніше!"}
+    else:
+        context = {
+            "session_id": session["id"],
+            "rounds": session_rounds_for_client(session),
+        }
+    return render(request, "prompt_gamified/guess_the_best_session.html", context)
+
+
+@login_required
+def guess_the_best_answer_view(request, session_id):
+    if request.method != "POST":
+        return JsonResponse({"error": "Метод не дозволено."}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        round_index = int(data["round"])
+        prompt_id = int(data["prompt_id"])
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({"error": "Некоректна відповідь."}, status=400)
+
+    result = answer_guess_round(session_id, request.user, round_index, prompt_id)
+    if result is None:
+        return JsonResponse({"error": "Гру не знайдено."}, status=404)
+    if "error" in result:
+        return JsonResponse(result, status=400)
+    return JsonResponse(result)
+
+
 @login_required
 def store_view(request):
     # Відображаємо елементи косметики всіх типів, окрім рангових кілець
@@ -17,7 +17,12 @@ django.setup()
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
-from chat.routing import websocket_urlpatterns
+from chat.routing import websocket_urlpatterns as chat_websocket_urlpatterns
+from prompt_gamified.routing import (
+    websocket_urlpatterns as prompt_gamified_websocket_urlpatterns,
+)
+
+websocket_urlpatterns = chat_websocket_urlpatterns + prompt_gamified_websocket_urlpatterns
 
 application = ProtocolTypeRouter(
     {
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     "django.contrib.sites",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "storages",
     "crispy_forms",
     "crispy_bootstrap5",
@@ -164,8 +165,12 @@ LOGIN_REDIRECT_URL = "prompt_gamified:home_page"
 LOGOUT_REDIRECT_URL = "auth:login"
 
 
-CELERY_BROKER_URL = "redis://redis:6379/0"
-CELERY_RESULT_BACKEND = "redis://redis:6379/0"
+REDIS_HOST = config("REDIS_HOST", default="redis")
+REDIS_PORT = config("REDIS_PORT", default=6379, cast=int)
+REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}"
+
+CELERY_BROKER_URL = f"{REDIS_URL}/0"
+CELERY_RESULT_BACKEND = f"{REDIS_URL}/0"
 
 # Серіалізація (JSON безпечніший за pickle)
 CELERY_ACCEPT_CONTENT = ["json"]
@@ -198,10 +203,143 @@ CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [("redis", 6379)],
+            "hosts": [(REDIS_HOST, REDIS_PORT)],
         },
     },
-}   
+}
+
+EVALUATION_CACHE_TTL = config("EVALUATION_CACHE_TTL", default=7 * 24 * 60 * 60, cast=int)
+
+# Кеш (стан задач оцінювання, лічильники тощо) зберігається в окремій базі Redis
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"{REDIS_URL}/1",
+    },
+    # Кеш оцінок промптів. Записи мають TTL, тому за політики Redis
+    # volatile-lru при нестачі пам'яті витісняються найдавніше використані
+    "evaluations": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"{REDIS_URL}/2",
+        "TIMEOUT": EVALUATION_CACHE_TTL,
+    },
+}
+
+EVALUATION_CACHE_ALIAS = "evaluations"
+EVALUATION_CACHE_ENABLED = config("EVALUATION_CACHE_ENABLED", default=True, cast=bool)
+
+# Мінімальна схожість Жаккара, з якої промпт вважається майже дублікатом
+NEAR_DUPLICATE_SIMILARITY = config("NEAR_DUPLICATE_SIMILARITY", default=0.8, cast=float)
+
+# Пул готових пар для "Вгадай кращий промпт" на кожен рівень складності:
+# поповнюється до GUESS_PAIR_POOL_SIZE, коли пар менше за LOW_WATERMARK
+GUESS_PAIR_POOL_SIZE = config("GUESS_PAIR_POOL_SIZE", default=200, cast=int)
+GUESS_PAIR_POOL_LOW_WATERMARK = config("GUESS_PAIR_POOL_LOW_WATERMARK", default=50, cast=int)
+
+# Багатораундова гра "Вгадай кращий промпт": кількість раундів і скільки
+# секунд стан гри зберігається в кеші
+GUESS_SESSION_ROUNDS = config("GUESS_SESSION_ROUNDS", default=10, cast=int)
+GUESS_SESSION_TTL = config("GUESS_SESSION_TTL", default=30 * 60, cast=int)
+
+# Скільки найкращих промптів показує бібліотека промптів
+TOP_PROMPTS_SIZE = config("TOP_PROMPTS_SIZE", default=100, cast=int)
+
+# Redis для лідерборду (sorted set за досвідом). Порожнє значення — лідерборд
+# у пам'яті процесу
+LEADERBOARD_REDIS_URL = config("LEADERBOARD_REDIS_URL", default=f"{REDIS_URL}/3")
+
+# Redis для індексу випадкової вибірки промптів (множини id за оцінками).
+# Порожнє значення — індекс у пам'яті процесу
+PROMPT_SAMPLE_REDIS_URL = config("PROMPT_SAMPLE_REDIS_URL", default=f"{REDIS_URL}/4")
+
+# Скільки результатів пошуку промптів на сторінці
+PROMPT_SEARCH_PAGE_SIZE = config("PROMPT_SEARCH_PAGE_SIZE", default=20, cast=int)
+
+# Схожі промпти з високою оцінкою після оцінки в тренажері: тека індексу
+# TF-IDF, мінімальна оцінка прикладів, скільки прикладів показувати і як
+# часто (секунди) індекс доповнюється новими промптами
+SIMILAR_PROMPTS_DIR = config("SIMILAR_PROMPTS_DIR", default=str(BASE_DIR / "similar_prompts"))
+SIMILAR_PROMPTS_MIN_RATE = config("SIMILAR_PROMPTS_MIN_RATE", default=8, cast=int)
+SIMILAR_PROMPTS_COUNT = config("SIMILAR_PROMPTS_COUNT", default=3, cast=int)
+SIMILAR_PROMPTS_UPDATE_INTERVAL = config("SIMILAR_PROMPTS_UPDATE_INTERVAL", default=5 * 60, cast=int)
+
+# Скільки секунд зберігається стан задачі оцінювання промпта
+EVALUATION_JOB_TTL = config("EVALUATION_JOB_TTL", default=60 * 60, cast=int)
+
+# Де виконується оцінка промпта: "celery" — у воркері Celery, "asyncio" — в
+# event loop ASGI-процесу (Daphne) через async клієнт LLM, без черги задач
+EVALUATION_RUNNER = config("EVALUATION_RUNNER", default="celery")
+
+# Надсилати оцінку та покращений промпт частинами, поки модель генерує відповідь
+EVALUATION_STREAMING = config("EVALUATION_STREAMING", default=True, cast=bool)
+
+# Пул HTTP-з'єднань до LLM провайдера (один клієнт на процес)
+LLM_POOL_MAX_CONNECTIONS = config("LLM_POOL_MAX_CONNECTIONS", default=20, cast=int)
+LLM_POOL_MAX_KEEPALIVE = config("LLM_POOL_MAX_KEEPALIVE", default=10, cast=int)
+LLM_KEEPALIVE_EXPIRY = config("LLM_KEEPALIVE_EXPIRY", default=60.0, cast=float)
+LLM_CONNECT_TIMEOUT = config("LLM_CONNECT_TIMEOUT", default=5.0, cast=float)
+LLM_READ_TIMEOUT = config("LLM_READ_TIMEOUT", default=30.0, cast=float)
+
+# Спільний для всіх процесів ліміт запитів до LLM провайдера (0 — без ліміту)
+LLM_RATE_LIMIT_RPM = config("LLM_RATE_LIMIT_RPM", default=50, cast=int)
+LLM_RATE_LIMIT_TPM = config("LLM_RATE_LIMIT_TPM", default=0, cast=int)
+# Redis для відер ліміту. Порожнє значення — відра в пам'яті процесу
+LLM_RATE_LIMIT_REDIS_URL = config("LLM_RATE_LIMIT_REDIS_URL", default=f"{REDIS_URL}/5")
+# Скільки секунд запит може чекати в черзі, перш ніж оцінка завершиться помилкою
+LLM_RATE_LIMIT_MAX_WAIT = config("LLM_RATE_LIMIT_MAX_WAIT", default=120, cast=int)
+
+# Максимальна тривалість одного виклику LLM, секунди
+LLM_CALL_DEADLINE = config("LLM_CALL_DEADLINE", default=20.0, cast=float)
+# Після стількох помилок поспіль запити не надсилаються LLM_BREAKER_COOLDOWN секунд
+LLM_BREAKER_FAILURES = config("LLM_BREAKER_FAILURES", default=5, cast=int)
+LLM_BREAKER_COOLDOWN = config("LLM_BREAKER_COOLDOWN", default=30, cast=int)
+# Hedged запити: якщо відповіді немає довше за p95 затримки (але не менше
+# LLM_HEDGE_MIN_DELAY), надсилається другий такий самий запит
+LLM_HEDGE_ENABLED = config("LLM_HEDGE_ENABLED", default=False, cast=bool)
+LLM_HEDGE_MIN_DELAY = config("LLM_HEDGE_MIN_DELAY", default=2.0, cast=float)
+LLM_HEDGE_MAX_WORKERS = config("LLM_HEDGE_MAX_WORKERS", default=8, cast=int)
+
+# Однакові промпти, що оцінюються одночасно, чекають на один запит до LLM.
+# Таймаут має перевищувати найдовшу оцінку разом з очікуванням у черзі
+EVALUATION_SINGLE_FLIGHT = config("EVALUATION_SINGLE_FLIGHT", default=True, cast=bool)
+EVALUATION_SINGLE_FLIGHT_TIMEOUT = config(
+    "EVALUATION_SINGLE_FLIGHT_TIMEOUT",
+    default=LLM_RATE_LIMIT_MAX_WAIT + int(LLM_CALL_DEADLINE) + 30,
+    cast=int,
+)
+
+# Пакетна оцінка для офлайн-задач: стільки промптів в одному запиті до LLM
+# і максимальна тривалість такого запиту, секунди
+EVALUATION_BATCH_SIZE = config("EVALUATION_BATCH_SIZE", default=10, cast=int)
+EVALUATION_BATCH_DEADLINE = config("EVALUATION_BATCH_DEADLINE", default=90.0, cast=float)
+
+# Ціни моделей для обліку вартості оцінок, долари
+LLM_PRICING = {
+    "sonar-pro": {
+        "input_per_million": 3.0,
+        "output_per_million": 15.0,
+        "per_request": 0.006,
+    },
+}
+
+# Бекенд оцінювання промптів. Для тестів навантаження без мережі:
+# prompt_gamified.evaluators.HeuristicEvaluator або FakeLatencyEvaluator
+PROMPT_EVALUATOR_BACKEND = config(
+    "PROMPT_EVALUATOR_BACKEND",
+    default="prompt_gamified.evaluators.PerplexityEvaluator",
+)
+# Імітація затримки провайдера для FakeLatencyEvaluator, секунди
+FAKE_EVALUATOR_LATENCY = config("FAKE_EVALUATOR_LATENCY", default=1.5, cast=float)
+FAKE_EVALUATOR_JITTER = config("FAKE_EVALUATOR_JITTER", default=0.5, cast=float)
+FAKE_EVALUATOR_SEED = config("FAKE_EVALUATOR_SEED", default=42, cast=int)
+# Касета відповідей LLM: prompt_gamified.cassette.RecordingEvaluator записує
+# в неї відповіді бекенда LLM_CASSETTE_BACKEND, ReplayEvaluator — відтворює
+LLM_CASSETTE_PATH = config("LLM_CASSETTE_PATH", default=str(BASE_DIR / "llm_cassette.jsonl"))
+LLM_CASSETTE_BACKEND = config(
+    "LLM_CASSETTE_BACKEND",
+    default="prompt_gamified.evaluators.PerplexityEvaluator",
+)
+
 CHAT_ENCRYPTION_KEY = config("CHAT_ENCRYPTION_KEY")
 
 # ALL-AUTH
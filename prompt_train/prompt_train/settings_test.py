@@ -1,3 +1,5 @@
+import tempfile
+
 from .settings import *
 
 # Вимкнути AWS S3 для тестів
@@ -17,3 +19,32 @@ CELERY_TASK_EAGER_PROPAGATES = True
 
 # Email: не надсилати реальні листи під час тестів
 EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+
+# Кеш та Channels: працюють у пам'яті без Redis
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "evaluations": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "evaluations",
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    },
+}
+CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+    },
+}
+
+# Лідерборд: у пам'яті процесу без Redis
+LEADERBOARD_REDIS_URL = ""
+
+# Індекс вибірки промптів: у пам'яті процесу без Redis
+PROMPT_SAMPLE_REDIS_URL = ""
+
+# Ліміт запитів до LLM: відра в пам'яті процесу без Redis
+LLM_RATE_LIMIT_REDIS_URL = ""
+
+# Індекс схожих промптів: тимчасова тека замість теки проєкту
+SIMILAR_PROMPTS_DIR = tempfile.mkdtemp(prefix="similar_prompts_")
@@ -0,0 +1,328 @@
+"""Лідерборд активних користувачів за досвідом.
+
+Порядок гравців зберігається в sorted set Redis (SCORES_KEY: id → exp), а
+дані для таблиці — нікнейм, ранг, досвід, поінти, зображення — в хеші
+USERS_KEY. Сторінка лідерборду читає лише Redis: ZCARD для кількості
+гравців, ZREVRANGE для сторінки і HMGET для її рядків. Місце користувача
+(ZREVRANK) та сусіди по таблиці знаходяться за O(log n) без перегляду
+сторінок.
+
+Збереження користувача, що зачіпає поля таблиці (ENTRY_FIELDS), оновлює
+запис після коміту транзакції, перечитавши ці поля з бази: екземпляр у
+пам'яті міг бути завантажений ще до чужої нагороди. Нагорода
+(CustomUser.add_rewards) пише значення, які повернув її UPDATE. Записи,
+змінені в обхід моделі
+(QuerySet.update, ручні правки в базі), виправляє повна перебудова з бази:
+команда rebuild_leaderboard або задача, яку ставить перегляд порожнього
+лідерборду.
+
+Якщо Redis недоступний, сторінка лідерборду показує ту саму таблицю з бази
+(database_users) без місця користувача.
+
+Без LEADERBOARD_REDIS_URL лідерборд зберігається в пам'яті процесу — для
+тестів і локальної розробки, як locmem замість Redis для кешу.
+"""
+
+import json
+import logging
+from bisect import bisect_left, insort
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+# Учасники множини — id з нулями попереду (_member). Формат змінився разом
+# з назвою ключа: множину старого формату замінює rebuild_leaderboard
+SCORES_KEY = "leaderboard:exp_id"
+USERS_KEY = "leaderboard:users"
+REBUILD_SUFFIX = ":rebuild"
+REBUILD_LOCK_KEY = "leaderboard:rebuild"
+REBUILD_LOCK_TTL = 60
+
+# Скільки гравців вище і нижче за користувача показувати поруч з ним
+AROUND_RADIUS = 2
+
+FIELDS = ("id", "nickname", "rank", "exp", "points", "profile_picture")
+
+# Поля, від яких залежить запис користувача: зміна інших (last_login,
+# active_ring) лідерборд не оновлює
+ENTRY_FIELDS = frozenset({*FIELDS, "is_active"} - {"id"})
+
+
+def _member(user_id: int) -> str:
+    # За рівного досвіду Redis упорядковує учасників як рядки. Однакова
+    # довжина робить цей порядок числовим — тим самим, що -id у базі
+    return f"{user_id:020d}"
+
+
+def _entry(user) -> dict:
+    return {
+        "id": user.id,
+        "nickname": user.nickname,
+        "rank": user.rank,
+        "exp": user.exp,
+        "points": user.points,
+        "profile_picture": user.profile_picture.name or "",
+    }
+
+
+class RedisStore:
+    def __init__(self, url: str):
+        self._url = url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self._url, decode_responses=True)
+        return self._client
+
+    def set(self, entry: dict) -> None:
+        with self.client.pipeline() as pipe:
+            pipe.zadd(SCORES_KEY, {_member(entry["id"]): entry["exp"]})
+            pipe.hset(USERS_KEY, entry["id"], json.dumps(entry))
+            pipe.execute()
+
+    def remove(self, user_id: int) -> None:
+        with self.client.pipeline() as pipe:
+            pipe.zrem(SCORES_KEY, _member(user_id))
+            pipe.hdel(USERS_KEY, user_id)
+            pipe.execute()
+
+    def count(self) -> int:
+        return self.client.zcard(SCORES_KEY)
+
+    def position(self, user_id: int) -> int | None:
+        return self.client.zrevrank(SCORES_KEY, _member(user_id))
+
+    def page(self, start: int, stop: int) -> list[dict]:
+        if stop <= start:
+            return []
+        members = self.client.zrevrange(SCORES_KEY, start, stop - 1)
+        if not members:
+            return []
+        ids = [int(member) for member in members]
+        # Запис міг зникнути між двома командами — такий рядок пропускаємо
+        return [
+            json.loads(data)
+            for data in self.client.hmget(USERS_KEY, ids)
+            if data is not None
+        ]
+
+    def replace(self, entries) -> int:
+        # Новий стан збирається в окремих ключах і підміняє старий атомарно
+        scores_key, users_key = SCORES_KEY + REBUILD_SUFFIX, USERS_KEY + REBUILD_SUFFIX
+        self.client.delete(scores_key, users_key)
+        written = 0
+        with self.client.pipeline(transaction=False) as pipe:
+            for entry in entries:
+                pipe.zadd(scores_key, {_member(entry["id"]): entry["exp"]})
+                pipe.hset(users_key, entry["id"], json.dumps(entry))
+                written += 1
+                if written % 1000 == 0:
+                    pipe.execute()
+            pipe.execute()
+
+        with self.client.pipeline() as pipe:
+            if written:
+                pipe.rename(scores_key, SCORES_KEY)
+                pipe.rename(users_key, USERS_KEY)
+            else:
+                pipe.delete(SCORES_KEY, USERS_KEY)
+            pipe.execute()
+        return written
+
+
+class MemoryStore:
+    """Той самий порядок, що й у Redis та в базі: досвід, а за рівного
+    досвіду — id, від більшого до меншого."""
+
+    def __init__(self):
+        self._entries = {}
+        self._order = []
+
+    def _key(self, entry: dict) -> tuple[int, int]:
+        return entry["exp"], entry["id"]
+
+    def set(self, entry: dict) -> None:
+        self.remove(entry["id"])
+        self._entries[entry["id"]] = entry
+        insort(self._order, self._key(entry))
+
+    def remove(self, user_id: int) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._order.pop(bisect_left(self._order, self._key(entry)))
+
+    def count(self) -> int:
+        return len(self._order)
+
+    def position(self, user_id: int) -> int | None:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        return len(self._order) - 1 - bisect_left(self._order, self._key(entry))
+
+    def page(self, start: int, stop: int) -> list[dict]:
+        size = len(self._order)
+        keys = self._order[max(size - stop, 0) : max(size - start, 0)]
+        return [self._entries[user_id] for _, user_id in reversed(keys)]
+
+    def replace(self, entries) -> int:
+        self._entries = {entry["id"]: entry for entry in entries}
+        self._order = sorted(self._key(entry) for entry in self._entries.values())
+        return len(self._entries)
+
+
+class DatabaseLeaderboardList:
+    """Той самий список гравців, прочитаний з бази, коли Redis недоступний."""
+
+    def __init__(self):
+        self._users = CustomUser.objects.filter(is_active=True).order_by("-exp", "-id")
+
+    def count(self) -> int:
+        return self._users.count()
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index : index + 1][0]
+        start = index.start or 0
+        users = self._users.values(*FIELDS)[index]
+        return _with_positions(
+            [
+                {**user, "profile_picture": user["profile_picture"] or ""}
+                for user in users
+            ],
+            start,
+        )
+
+
+class LeaderboardList:
+    """Гравці від найбільшого досвіду — список для Paginator, що читає лише
+    потрібний зріз."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def count(self) -> int:
+        return self._store.count()
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index : index + 1][0]
+        start, stop = index.start or 0, index.stop
+        if stop is None:
+            stop = self.count()
+        return _with_positions(self._store.page(start, stop), start)
+
+
+def _picture_url(name: str) -> str:
+    if not name:
+        return ""
+    return CustomUser._meta.get_field("profile_picture").storage.url(name)
+
+
+def _with_positions(entries: list[dict], start: int) -> list[dict]:
+    return [
+        {
+            **entry,
+            "rank_position": start + offset,
+            "profile_picture_url": _picture_url(entry["profile_picture"]),
+        }
+        for offset, entry in enumerate(entries, start=1)
+    ]
+
+
+class Leaderboard:
+    def __init__(self):
+        self._store = None
+        self._store_url = None
+
+    @property
+    def store(self):
+        url = settings.LEADERBOARD_REDIS_URL
+        if self._store is None or url != self._store_url:
+            self._store = RedisStore(url) if url else MemoryStore()
+            self._store_url = url
+        return self._store
+
+    def update(self, user) -> None:
+        """Оновлює запис користувача; неактивні користувачі прибираються."""
+        try:
+            if user.is_active:
+                self.store.set(_entry(user))
+            else:
+                self.store.remove(user.id)
+        except redis.RedisError as e:
+            # Лідерборд не повинен ламати збереження користувача: пропущене
+            # оновлення виправить наступна зміна або перебудова
+            logger.warning("Could not update leaderboard for user %s: %s", user.id, e)
+
+    def refresh(self, user_id: int) -> None:
+        """Перечитує запис користувача з бази і оновлює лідерборд."""
+        user = CustomUser.objects.filter(id=user_id).only(*ENTRY_FIELDS).first()
+        if user is None:
+            self.discard(user_id)
+        else:
+            self.update(user)
+
+    def discard(self, user_id: int) -> None:
+        try:
+            self.store.remove(user_id)
+        except redis.RedisError as e:
+            logger.warning("Could not remove user %s from leaderboard: %s", user_id, e)
+
+    def users(self) -> LeaderboardList:
+        """Усі гравці від найбільшого досвіду, для Paginator."""
+        if not self.store.count():
+            self.schedule_rebuild()
+        return LeaderboardList(self.store)
+
+    def database_users(self) -> DatabaseLeaderboardList:
+        """Гравці з бази, для сторінки лідерборду без Redis."""
+        return DatabaseLeaderboardList()
+
+    def position(self, user_id: int) -> int | None:
+        """Місце користувача в лідерборді, починаючи з 1."""
+        position = self.store.position(user_id)
+        return None if position is None else position + 1
+
+    def around(self, user_id: int, radius: int = AROUND_RADIUS) -> list[dict]:
+        """Користувач і до radius гравців над ним та під ним."""
+        position = self.store.position(user_id)
+        if position is None:
+            return []
+        start = max(position - radius, 0)
+        return _with_positions(self.store.page(start, position + radius + 1), start)
+
+    def rebuild(self) -> int:
+        """Збирає лідерборд з бази. Повертає кількість гравців."""
+        users = (
+            CustomUser.objects.filter(is_active=True)
+            .values(*FIELDS)
+            .iterator(chunk_size=2000)
+        )
+        return self.store.replace(
+            {**user, "profile_picture": user["profile_picture"] or ""} for user in users
+        )
+
+    def schedule_rebuild(self) -> None:
+        from .tasks import rebuild_leaderboard_task
+
+        # Порожній лідерборд (новий Redis, очищена база) перебудовується
+        # у фоні не частіше ніж раз на REBUILD_LOCK_TTL секунд
+        if cache.add(REBUILD_LOCK_KEY, 1, timeout=REBUILD_LOCK_TTL):
+            rebuild_leaderboard_task.delay()
+
+
+leaderboard = Leaderboard()
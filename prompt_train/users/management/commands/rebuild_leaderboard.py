@@ -0,0 +1,21 @@
+"""Перебудова лідерборду з бази.
+
+Потрібна під час розгортання (порожній Redis) і після змін досвіду чи
+профілів в обхід моделі — наприклад, QuerySet.update або ручних правок у
+базі. Оновлення, що надійдуть під час перебудови, можуть бути перезаписані
+станом з бази на момент читання; наступна зміна користувача їх поверне.
+"""
+
+from django.core.management.base import BaseCommand
+
+from users.leaderboard import leaderboard
+
+
+class Command(BaseCommand):
+    help = "Перебудовує лідерборд з таблиці користувачів."
+
+    def handle(self, *args, **options):
+        count = leaderboard.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f"Лідерборд перебудовано: {count} гравців.")
+        )
@@ -0,0 +1,98 @@
+"""Узгодження рангів і рангових рамок усіх користувачів.
+
+Потрібне після зміни порогів RANK_THRESHOLDS або набору рангових рамок
+(міграція 0009 чи редагування в адмінці): ранг кожного користувача
+перераховується з досвіду тим самим SQL виразом, що й у add_rewards, а
+відсутні рамки для нового рангу видаються. Користувачі обробляються
+пачками за зростанням id: одна пачка — це один UPDATE рангів і один INSERT
+рамок з ignore_conflicts незалежно від її розміру, тож повторний запуск
+безпечний.
+
+Рамки, які вже видані, не забираються, навіть якщо ранг знизився.
+"""
+
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.expressions import RawSQL
+
+from users.leaderboard import leaderboard
+from users.models import (
+    RANK_ORDER,
+    Cosmetic,
+    CustomUser,
+    UserCosmetic,
+    rank_for_exp_sql,
+    ranks_up_to,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Перераховує ранги всіх користувачів з досвіду та видає відсутні "
+        "рангові рамки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Кількість користувачів, що обробляються за раз.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        rings = defaultdict(list)
+        for required, ring_id in Cosmetic.objects.filter(type="rank_ring").values_list(
+            "rank_required", "id"
+        ):
+            rings[required].append(ring_id)
+        rings_before = UserCosmetic.objects.filter(cosmetic__type="rank_ring").count()
+
+        # На відміну від add_rewards, ранг рахується лише з досвіду: хто не
+        # перевищує жодного порогу, отримує базовий ранг, а не зберігає старий
+        new_rank = RawSQL(rank_for_exp_sql("exp", f"'{RANK_ORDER[0]}'"), [])
+
+        last_id = users = ranks_changed = 0
+        while True:
+            with transaction.atomic():
+                chunk = CustomUser.objects.filter(id__gt=last_id).order_by("id")[
+                    :chunk_size
+                ]
+                ids = list(chunk.values_list("id", flat=True))
+                if not ids:
+                    break
+                users_chunk = CustomUser.objects.filter(id__gte=ids[0], id__lte=ids[-1])
+                # Рядки, де ранг уже правильний, не переписуються
+                ranks_changed += users_chunk.exclude(rank=new_rank).update(
+                    rank=new_rank
+                )
+                ranks = users_chunk.values_list("id", "rank")
+                UserCosmetic.objects.bulk_create(
+                    [
+                        UserCosmetic(user_id=user_id, cosmetic_id=ring_id)
+                        for user_id, rank in ranks
+                        for required in ranks_up_to(rank)
+                        for ring_id in rings[required]
+                    ],
+                    ignore_conflicts=True,
+                )
+            last_id = ids[-1]
+            users += len(ids)
+
+        if ranks_changed:
+            # UPDATE оминає post_save: ранги в лідерборді застаріли
+            leaderboard.rebuild()
+
+        granted = (
+            UserCosmetic.objects.filter(cosmetic__type="rank_ring").count()
+            - rings_before
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Оброблено {users} користувачів, змінено рангів: {ranks_changed}, "
+                f"видано рангових рамок: {granted}."
+            )
+        )
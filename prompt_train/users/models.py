@@ -1,7 +1,8 @@
 import os
 from django.contrib.auth.base_user import BaseUserManager, AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
-from django.db import models, transaction
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import F
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
@@ -29,6 +30,43 @@ def get_profile_picture_storage():
     return default_storage
 
 
+# Пороги досвіду для рангів, від найвищого: ранг надається, якщо exp більший
+# за поріг. Якщо exp не перевищує жодного порогу, ранг не змінюється
+RANK_THRESHOLDS = [("D", 18), ("R", 12), ("G", 7), ("S", 3)]
+
+
+def rank_for_exp(exp, current_rank):
+    for rank, threshold in RANK_THRESHOLDS:
+        if exp > threshold:
+            return rank
+    return current_rank
+
+
+def rank_for_exp_sql(exp_sql, rank_sql):
+    """SQL CASE з тими самими порогами, що й rank_for_exp."""
+    whens = " ".join(
+        f"WHEN {exp_sql} > {threshold} THEN '{rank}'"
+        for rank, threshold in RANK_THRESHOLDS
+    )
+    return f"CASE {whens} ELSE {rank_sql} END"
+
+
+# Ранги від найнижчого до найвищого
+RANK_ORDER = ["B", "S", "G", "R", "D"]
+
+
+def ranks_up_to(rank):
+    """Ранги, не вищі за rank (порожній список для невідомого рангу)."""
+    if rank not in RANK_ORDER:
+        return []
+    return RANK_ORDER[: RANK_ORDER.index(rank) + 1]
+
+
+# Поля, попередні значення яких CustomUser.save() бере зі знімка при
+# завантаженні з бази замість окремого запиту
+TRACKED_FIELDS = ("profile_picture", "rank")
+
+
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password, **extra_fields):
         email = self.normalize_email(email)
@@ -101,51 +139,106 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return f"{self.nickname} - {self.email}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        self._snapshot(fields)
+
+    def _snapshot(self, fields=None):
+        """Запам'ятовує значення полів TRACKED_FIELDS, які зараз є в базі."""
+        if not hasattr(self, "_loaded_values"):
+            self._loaded_values = {}
+        deferred = self.get_deferred_fields()
+        for name in TRACKED_FIELDS:
+            if name not in deferred and (fields is None or name in fields):
+                self._loaded_values[name] = self._tracked_value(name)
+
+    def _tracked_value(self, name):
+        value = getattr(self, name)
+        # Для файлу порівнюється шлях у сховищі
+        return (value.name or "") if name == "profile_picture" else value
+
+    def _loaded_value(self, name):
+        loaded_values = getattr(self, "_loaded_values", {})
+        if name in loaded_values:
+            return loaded_values[name]
+        # Екземпляр створено не з бази (або поле відкладене): читаємо значення
+        value = (
+            CustomUser.objects.filter(pk=self.pk).values_list(name, flat=True).first()
+        )
+        return (value or "") if name == "profile_picture" else value
+
     def save(self, *args, **kwargs):
         # Визначаємо, чи це новий користувач
         is_new = self.pk is None
+        update_fields = kwargs.get("update_fields")
+
+        # Видаляємо старе зображення, якщо воно було замінене. Попереднє
+        # значення відоме з моменту завантаження, окремий запит не потрібен
+        if not is_new and (update_fields is None or "profile_picture" in update_fields):
+            old_picture = self._loaded_value("profile_picture")
+            if old_picture and old_picture != self._tracked_value("profile_picture"):
+                self.profile_picture.storage.delete(old_picture)
 
-        # Видаляємо старе зображення, якщо воно було замінене
-        if not is_new:
-            try:
-                old_instance = CustomUser.objects.get(pk=self.pk)
-                if old_instance.profile_picture and old_instance.profile_picture != self.profile_picture:
-                    old_instance.profile_picture.delete(save=False)
-            except CustomUser.DoesNotExist:
-                pass
-        
         # Оновлення рангу на основі досвіду
-        old_rank = self.rank
-        new_rank = self.rank
-        if self.exp > 18:
-            new_rank = "D"
-        elif self.exp > 12:
-            new_rank = "R"
-        elif self.exp > 7:
-            new_rank = "G"
-        elif self.exp > 3:
-            new_rank = "S"
-        if old_rank != new_rank:
-            self.rank = new_rank
-        
+        old_rank = self.rank if is_new else self._loaded_value("rank")
+        self.rank = rank_for_exp(self.exp, self.rank)
+
         super().save(*args, **kwargs)
+        self._snapshot(update_fields)
+
+        # Новий користувач отримує бронзову рангову рамку, а при зміні рангу —
+        # всі доступні рангові рамки
+        if is_new or old_rank != self.rank:
+            self.grant_rank_rings()
+
+    def grant_rank_rings(self):
+        """Видає всі доступні рангові рамки одним INSERT. Рамки, які вже є,
+        пропускаються завдяки unique_together, тож виклик можна повторювати."""
+        ring_ids = list(self.get_available_rank_rings().values_list("id", flat=True))
+        if ring_ids:
+            UserCosmetic.objects.bulk_create(
+                [UserCosmetic(user=self, cosmetic_id=ring_id) for ring_id in ring_ids],
+                ignore_conflicts=True,
+            )
+
+    def add_rewards(self, exp=0, points=0):
+        """Додає досвід і поінти одним UPDATE і перераховує ранг у тій самій
+        інструкції, тож одночасні нагороди з різних вкладок не губляться.
+        Рангові рамки видаються, лише якщо ранг у базі справді змінився."""
+        table = connection.ops.quote_name(self._meta.db_table)
+        with connection.cursor() as cursor:
+            # Підзапит блокує рядок і повертає ранг до оновлення
+            cursor.execute(
+                f"""
+                UPDATE {table} AS u
+                SET exp = u.exp + %s,
+                    points = u.points + %s,
+                    rank = {rank_for_exp_sql("u.exp + %s", "u.rank")}
+                FROM (SELECT id, rank FROM {table} WHERE id = %s FOR UPDATE) AS old
+                WHERE u.id = old.id
+                RETURNING u.exp, u.points, u.rank, old.rank
+                """,
+                [exp, points, *[exp] * len(RANK_THRESHOLDS), self.pk],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return
+
+        self.exp, self.points, self.rank, old_rank = row
+        self._snapshot(["rank"])
+        if self.rank != old_rank:
+            self.grant_rank_rings()
+
+        # UPDATE оминає post_save, тож лідерборд оновлюється тут
+        from .leaderboard import leaderboard
 
-        # Додаємо бронзову рангову рамку для нового користувача
-        if is_new:
-            bronze_ring = Cosmetic.objects.filter(
-                type="rank_ring",
-                rank_required="B"
-            ).first()
-            if bronze_ring:
-                UserCosmetic.objects.get_or_create(user=self, cosmetic=bronze_ring)
-
-        # Додаємо всі доступні рангові рамки, якщо ранг змінився
-        if old_rank != new_rank and self.pk:
-            available_rings = self.get_available_rank_rings()
-            if available_rings.exists():
-                with transaction.atomic():
-                    for ring in available_rings:
-                        UserCosmetic.objects.get_or_create(user=self, cosmetic=ring)
+        transaction.on_commit(lambda: leaderboard.update(self))
 
     def has_perm(self, perm, obj=None):
         return self.is_staff
@@ -154,17 +247,10 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         return self.is_staff
 
     def get_available_rank_rings(self):
-        RANK_ORDER = ['B', 'S', 'G', 'R', 'D']
-        # Задаємо індекс рангу користувача
-        try:
-            user_rank_index = RANK_ORDER.index(self.rank)
-        except ValueError:
-            return Cosmetic.objects.none()
-
         # Повертаємо лише рангові кільця, у яких необхідний ранг не більше рангу користувача.
         return Cosmetic.objects.filter(
             type="rank_ring",
-            rank_required__in=RANK_ORDER[:user_rank_index + 1]
+            rank_required__in=ranks_up_to(self.rank)
         )
     
     def buy_cosmetic(self, cosmetic):
@@ -172,16 +258,31 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
             raise ValidationError("Рангові кільця не можуть бути купленими.")
         if UserCosmetic.objects.filter(user=self, cosmetic=cosmetic).exists():
             raise ValidationError("Не можна придбати вже куплений елемент косметики.")
-        if self.points < cosmetic.price:
-            raise ValidationError("Не вистачає поінтів на купівлю елемента косметики.")
-        
+
         with transaction.atomic():
-            self.points -= cosmetic.price
-            self.save()
+            # Умовний UPDATE замість save(): екземпляр міг застаріти, і повний
+            # save() записав би старі exp та points поверх одночасної нагороди
+            debited = CustomUser.objects.filter(
+                pk=self.pk, points__gte=cosmetic.price
+            ).update(points=F("points") - cosmetic.price)
+            if not debited:
+                raise ValidationError("Не вистачає поінтів на купівлю елемента косметики.")
 
-            UserCosmetic.objects.create(
-                user=self, cosmetic=cosmetic
-            )
+            try:
+                UserCosmetic.objects.create(user=self, cosmetic=cosmetic)
+            except IntegrityError as e:
+                # Той самий елемент щойно купили з іншої вкладки — списання
+                # відкочується разом з транзакцією
+                raise ValidationError(
+                    "Не можна придбати вже куплений елемент косметики."
+                ) from e
+
+        self.refresh_from_db(fields=["points"])
+
+        # UPDATE оминає post_save, тож лідерборд оновлюється тут
+        from .leaderboard import leaderboard
+
+        transaction.on_commit(lambda: leaderboard.refresh(self.pk))
 
 
 class Cosmetic(models.Model):
@@ -230,27 +331,30 @@ class UserCosmetic(models.Model):
 
     def activate_cosmetic(self):
         """Активує косметику для користувача, оновлюючи відповідні поля в CustomUser."""
-        user = self.user
-        
+        field = self._active_field()
+        if field is None:
+            return
+
         # Оновлюємо відповідне поле в CustomUser в залежності від типу косметики
-        if self.cosmetic.type in ["ring", "rank_ring"]:
-            user.active_ring = self.cosmetic
-        elif self.cosmetic.type == "element":
-            user.active_element = self.cosmetic
-        elif self.cosmetic.type == "title":
-            user.active_title = self.cosmetic
-        
-        user.save()
+        setattr(self.user, field, self.cosmetic)
+        self.user.save(update_fields=[field])
 
     def take_off_cosmetic(self):
         """Деактивує косметику для користувача, змінюючи відповідні поля на пусті."""
-        user = self.user
+        field = self._active_field()
+        if field is None:
+            return
 
+        setattr(self.user, field, None)
+        self.user.save(update_fields=[field])
+
+    def _active_field(self):
+        """Поле CustomUser для активної косметики цього типу. Зберігається лише
+        воно: повний save() користувача записав би застарілі exp та points."""
         if self.cosmetic.type in ["ring", "rank_ring"]:
-            user.active_ring = None
-        elif self.cosmetic.type == "element":
-            user.active_element = None
-        elif self.cosmetic.type == "title":
-            user.active_title = None
-        
-        user.save()
+            return "active_ring"
+        if self.cosmetic.type == "element":
+            return "active_element"
+        if self.cosmetic.type == "title":
+            return "active_title"
+        return None
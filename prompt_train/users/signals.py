@@ -1,6 +1,8 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
+from .leaderboard import ENTRY_FIELDS, leaderboard
 from .tasks import send_registration_email_task
 import logging
 
@@ -19,3 +21,20 @@ def send_email_on_user_creation(sender, instance, created, **kwargs):
         
         send_registration_email_task.delay(instance.id)
         logger.info(f"Email task delayed для користувача {instance.id}")
+
+
+@receiver(post_save, sender=User)
+def update_leaderboard_on_save(sender, instance, update_fields=None, **kwargs):
+    # Вхід (last_login) чи вибір рамки не змінюють рядка лідерборду
+    if update_fields is not None and not ENTRY_FIELDS & set(update_fields):
+        return
+    # Після коміту і з бази: відкочена транзакція не повинна потрапити в
+    # лідерборд, а екземпляр у пам'яті міг застаріти
+    user_id = instance.id
+    transaction.on_commit(lambda: leaderboard.refresh(user_id))
+
+
+@receiver(post_delete, sender=User)
+def discard_from_leaderboard(sender, instance, **kwargs):
+    user_id = instance.id
+    transaction.on_commit(lambda: leaderboard.discard(user_id))
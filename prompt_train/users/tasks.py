@@ -52,3 +52,13 @@ def send_registration_email_task(self, user_id):
         logger.error(f"Помилка при відправці email: {exc}")
         # Retry задачу до 3 разів з затримкою 60 секунд
         raise self.retry(exc=exc, countdown=60)
+
+
+@shared_task
+def rebuild_leaderboard_task():
+    """Перебудова лідерборду з бази"""
+    from .leaderboard import leaderboard
+
+    count = leaderboard.rebuild()
+    logger.info(f"Лідерборд перебудовано: {count} гравців")
+    return count
@@ -1,6 +1,18 @@
-from django.test import TestCase
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+import redis
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.exceptions import ValidationError
-from users.models import CustomUser, CustomUserManager
+from users.leaderboard import MemoryStore, RedisStore, leaderboard
+from users.models import Cosmetic, CustomUser, CustomUserManager, UserCosmetic
 
 
 class CustomUserManagerTest(TestCase):
@@ -185,3 +197,378 @@ class CustomUserRankSystemTest(TestCase):
         self.user.points = 100
         self.user.save()
         self.assertEqual(self.user.rank, "G")
+
+
+class CustomUserRewardsTest(TestCase):
+    """Тести атомарного нарахування досвіду та поінтів"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="rewards@test.com", password="pass123", nickname="rewards"
+        )
+        self.silver_ring = Cosmetic.objects.create(
+            name="Срібне кільце", svg_code="<svg/>", type="rank_ring", rank_required="S"
+        )
+
+    def test_concurrent_rewards_are_not_lost(self):
+        """Перевірка, що нагороди з двох застарілих копій користувача сумуються"""
+        first_tab = CustomUser.objects.get(pk=self.user.pk)
+        second_tab = CustomUser.objects.get(pk=self.user.pk)
+
+        with self.assertNumQueries(1):
+            first_tab.add_rewards(exp=2, points=30)
+        second_tab.add_rewards(exp=1, points=20)
+
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.exp, self.user.points), (3, 50))
+        self.assertEqual((second_tab.exp, second_tab.points), (3, 50))
+
+    def test_rank_rings_granted_only_on_rank_change(self):
+        """Перевірка, що рангова рамка видається лише при зміні рангу в базі"""
+        self.user.add_rewards(exp=3)
+        self.assertEqual(self.user.rank, "B")
+        self.assertFalse(
+            UserCosmetic.objects.filter(user=self.user, cosmetic=self.silver_ring).exists()
+        )
+
+        self.user.add_rewards(exp=1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.rank, "S")
+        self.assertTrue(
+            UserCosmetic.objects.filter(user=self.user, cosmetic=self.silver_ring).exists()
+        )
+
+        # Ранг не змінився — жодних запитів до косметики
+        with self.assertNumQueries(1):
+            self.user.add_rewards(exp=1, points=10)
+
+    def test_purchase_from_stale_copy_keeps_concurrent_reward(self):
+        """Перевірка, що купівля із застарілої копії не затирає нагороду"""
+        ring = Cosmetic.objects.create(name="Кільце", svg_code="<svg/>", price=30)
+        self.user.add_rewards(points=40)
+        stale = CustomUser.objects.get(pk=self.user.pk)
+
+        self.user.add_rewards(exp=2, points=10)
+        stale.buy_cosmetic(ring)
+        self.assertEqual(stale.points, 20)
+
+        owned = UserCosmetic.objects.select_related("user").get(cosmetic=ring)
+        self.user.add_rewards(exp=1)
+        owned.activate_cosmetic()
+
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.exp, self.user.points), (3, 20))
+        self.assertEqual(self.user.active_ring, ring)
+
+    def test_purchase_without_enough_points_changes_nothing(self):
+        """Перевірка, що без поінтів у базі купівля не списує їх і не видає елемент"""
+        ring = Cosmetic.objects.create(name="Кільце", svg_code="<svg/>", price=30)
+        stale = CustomUser.objects.get(pk=self.user.pk)
+        # Застаріла копія вважає, що поінтів вистачає
+        stale.points = 100
+
+        with self.assertRaises(ValidationError):
+            stale.buy_cosmetic(ring)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.points, 0)
+        self.assertFalse(UserCosmetic.objects.filter(cosmetic=ring).exists())
+
+
+class CustomUserDirtyFieldsTest(TestCase):
+    """Тести відстеження змінених полів у CustomUser.save()"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="dirty@test.com", password="pass123", nickname="dirty"
+        )
+
+    def test_save_loaded_user_without_extra_select(self):
+        """Перевірка, що збереження завантаженого користувача — один запит"""
+        user = CustomUser.objects.get(pk=self.user.pk)
+        user.points = 42
+        with self.assertNumQueries(1):
+            user.save()
+
+    def test_replaced_profile_picture_is_deleted(self):
+        """Перевірка, що замінене зображення профілю видаляється зі сховища"""
+        self.user.profile_picture = SimpleUploadedFile("old.png", b"old")
+        self.user.save()
+        old_name = self.user.profile_picture.name
+        storage = self.user.profile_picture.storage
+        self.assertTrue(storage.exists(old_name))
+
+        user = CustomUser.objects.get(pk=self.user.pk)
+        user.profile_picture = SimpleUploadedFile("new.jpg", b"new")
+        user.save()
+        self.assertFalse(storage.exists(old_name))
+        self.assertTrue(storage.exists(user.profile_picture.name))
+
+        # Зображення не змінилося — нічого не видаляється
+        user.points = 5
+        user.save()
+        self.assertTrue(storage.exists(user.profile_picture.name))
+
+    def test_rank_rings_not_granted_without_rank_change(self):
+        """Перевірка, що рангові рамки не перевидаються, якщо ранг не змінився"""
+        user = CustomUser.objects.get(pk=self.user.pk)
+        user.exp = 2
+        with self.assertNumQueries(1):
+            user.save()
+
+        user.exp = 4
+        user.save()
+        self.assertEqual(user.rank, "S")
+        user.points = 1
+        with self.assertNumQueries(1):
+            user.save()
+
+
+class RankRingGrantTest(TestCase):
+    """Тести видачі рангових рамок"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="rings@test.com", password="pass123", nickname="rings"
+        )
+        self.rank_rings = Cosmetic.objects.filter(type="rank_ring")
+
+    def owned_rings(self, user):
+        return set(
+            UserCosmetic.objects.filter(
+                user=user, cosmetic__type="rank_ring"
+            ).values_list("cosmetic__rank_required", flat=True)
+        )
+
+    def test_new_user_gets_bronze_ring(self):
+        """Перевірка, що новий користувач отримує бронзову рамку"""
+        self.assertEqual(self.owned_rings(self.user), {"B"})
+
+    def test_grant_rank_rings_is_bulk_and_idempotent(self):
+        """Перевірка, що рамки видаються одним INSERT і повторний виклик безпечний"""
+        CustomUser.objects.filter(pk=self.user.pk).update(rank="D")
+        self.user.refresh_from_db()
+
+        with self.assertNumQueries(2):
+            self.user.grant_rank_rings()
+        self.user.grant_rank_rings()
+
+        self.assertEqual(self.owned_rings(self.user), {"B", "S", "G", "R", "D"})
+        self.assertEqual(
+            UserCosmetic.objects.filter(user=self.user).count(),
+            self.rank_rings.count(),
+        )
+
+    def test_reconcile_command_fixes_ranks_and_rings(self):
+        """Перевірка, що команда перераховує ранги та видає відсутні рамки"""
+        other = CustomUser.objects.create_user(
+            email="other@test.com", password="pass123", nickname="other"
+        )
+        # Досвід змінено в обхід save(): ранг і рамки застаріли
+        CustomUser.objects.filter(pk=self.user.pk).update(exp=8)
+        UserCosmetic.objects.filter(user=other).delete()
+
+        out = StringIO()
+        call_command("reconcile_rank_rings", "--chunk-size", "1", stdout=out)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.rank, "G")
+        self.assertEqual(self.owned_rings(self.user), {"B", "S", "G"})
+        self.assertEqual(self.owned_rings(other), {"B"})
+        self.assertIn("змінено рангів: 1", out.getvalue())
+
+        # Повторний запуск нічого не змінює
+        call_command("reconcile_rank_rings", stdout=StringIO())
+        self.assertEqual(self.owned_rings(self.user), {"B", "S", "G"})
+
+    def test_reconcile_command_resets_rank_below_thresholds(self):
+        """Перевірка, що ранг без досвіду над порогами стає базовим, а рамки лишаються"""
+        CustomUser.objects.filter(pk=self.user.pk).update(exp=2, rank="G")
+        self.user.refresh_from_db()
+        self.user.grant_rank_rings()
+
+        call_command("reconcile_rank_rings", stdout=StringIO())
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.rank, "B")
+        self.assertEqual(self.owned_rings(self.user), {"B", "S", "G"})
+
+
+def redis_available(url):
+    try:
+        return redis.Redis.from_url(url, socket_connect_timeout=0.5).ping()
+    except redis.RedisError:
+        return False
+
+
+# Окрема база Redis, щоб тест не зачепив справжній лідерборд
+TEST_LEADERBOARD_REDIS_URL = f"{settings.REDIS_URL}/15"
+
+
+class LeaderboardTest(TestCase):
+    """Тести лідерборду"""
+
+    def setUp(self):
+        leaderboard.rebuild()
+
+    def create_player(self, nickname, exp):
+        with self.captureOnCommitCallbacks(execute=True):
+            return CustomUser.objects.create_user(
+                email=f"{nickname}@test.com",
+                password="pass123",
+                nickname=nickname,
+                exp=exp,
+                is_active=True,
+            )
+
+    def nicknames(self, entries):
+        return [entry["nickname"] for entry in entries]
+
+    def test_order_and_positions(self):
+        """Перевірка порядку гравців і позиції користувача"""
+        low = self.create_player("low", 1)
+        top = self.create_player("top", 10)
+        self.create_player("mid", 5)
+
+        entries = leaderboard.users()[0:10]
+        self.assertEqual(self.nicknames(entries), ["top", "mid", "low"])
+        self.assertEqual([entry["rank_position"] for entry in entries], [1, 2, 3])
+        self.assertEqual(leaderboard.position(top.id), 1)
+        self.assertEqual(leaderboard.position(low.id), 3)
+
+    def test_rewards_and_deactivation_update_leaderboard(self):
+        """Перевірка, що нагорода та деактивація оновлюють лідерборд"""
+        self.create_player("first", 5)
+        second = self.create_player("second", 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.add_rewards(exp=10, points=5)
+        self.assertEqual(leaderboard.position(second.id), 1)
+        self.assertEqual(leaderboard.users()[0]["points"], second.points)
+
+        second.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        self.assertIsNone(leaderboard.position(second.id))
+        self.assertEqual(leaderboard.users().count(), 1)
+
+    def test_ties_are_ordered_like_database(self):
+        """Перевірка, що за рівного досвіду порядок збігається з резервною
+        таблицею з бази: id 10 вище за 9, а не навпаки, як у рядків"""
+        for user_id in (999_999, 1_000_000):
+            with self.captureOnCommitCallbacks(execute=True):
+                CustomUser.objects.create_user(
+                    id=user_id,
+                    email=f"tie{user_id}@test.com",
+                    password="pass123",
+                    nickname=f"tie{user_id}",
+                    exp=7,
+                    is_active=True,
+                )
+
+        ids = [entry["id"] for entry in leaderboard.users()[0:10]]
+        database_ids = [entry["id"] for entry in leaderboard.database_users()[0:10]]
+        self.assertEqual(ids, [1_000_000, 999_999])
+        self.assertEqual(ids, database_ids)
+        self.assertEqual(leaderboard.position(1_000_000), 1)
+
+    def test_around(self):
+        """Перевірка сусідів користувача в лідерборді"""
+        players = [self.create_player(f"p{exp}", exp) for exp in range(1, 8)]
+
+        around = leaderboard.around(players[3].id, radius=1)
+        self.assertEqual(self.nicknames(around), ["p5", "p4", "p3"])
+        self.assertEqual([entry["rank_position"] for entry in around], [3, 4, 5])
+        around = leaderboard.around(players[6].id, radius=1)
+        self.assertEqual(self.nicknames(around), ["p7", "p6"])
+
+    def test_rebuild_command(self):
+        """Перевірка, що команда перебудовує лідерборд з бази"""
+        player = self.create_player("player", 3)
+        CustomUser.objects.filter(pk=player.pk).update(exp=50)
+
+        call_command("rebuild_leaderboard", stdout=StringIO())
+        self.assertEqual(leaderboard.users()[0]["exp"], 50)
+
+    def test_view_does_not_query_users_table(self):
+        """Перевірка, що сторінка лідерборду не сортує і не рахує користувачів у базі"""
+        player = self.create_player("viewer", 4)
+        self.create_player("leader", 9)
+        self.client.force_login(player)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("prompt_gamified:leaderboard"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["my_position"], 2)
+        self.assertEqual(self.nicknames(response.context["page_obj"]), ["leader", "viewer"])
+        for query in queries:
+            self.assertNotIn("COUNT(", query["sql"])
+            self.assertNotIn("ORDER BY", query["sql"])
+
+    def test_save_rereads_entry_from_database(self):
+        """Перевірка, що застарілий екземпляр не затирає нагороду в лідерборді"""
+        player = self.create_player("player", 1)
+        stale = CustomUser.objects.get(pk=player.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            player.add_rewards(exp=10)
+
+        with patch.object(leaderboard, "refresh") as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                stale.save(update_fields=["last_login"])
+        refresh.assert_not_called()
+
+        stale.nickname = "renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            stale.save(update_fields=["nickname"])
+        entry = leaderboard.users()[0]
+        self.assertEqual((entry["nickname"], entry["exp"]), ("renamed", 11))
+
+    def test_view_reads_database_when_redis_is_down(self):
+        """Перевірка, що без Redis сторінка лідерборду читається з бази"""
+        player = self.create_player("viewer", 4)
+        self.create_player("leader", 9)
+        self.client.force_login(player)
+
+        with patch.object(MemoryStore, "count", side_effect=redis.ConnectionError):
+            response = self.client.get(reverse("prompt_gamified:leaderboard"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context["my_position"])
+        self.assertEqual(self.nicknames(response.context["page_obj"]), ["leader", "viewer"])
+        self.assertEqual(
+            [entry["rank_position"] for entry in response.context["page_obj"]], [1, 2]
+        )
+
+
+@skipUnless(redis_available(TEST_LEADERBOARD_REDIS_URL), "Redis недоступний")
+@override_settings(LEADERBOARD_REDIS_URL=TEST_LEADERBOARD_REDIS_URL)
+class RedisLeaderboardStoreTest(TestCase):
+    """Тести лідерборду в Redis"""
+
+    def setUp(self):
+        self.store = RedisStore(TEST_LEADERBOARD_REDIS_URL)
+        self.store.client.flushdb()
+
+    def tearDown(self):
+        self.store.client.flushdb()
+
+    def test_sorted_set_operations(self):
+        """Перевірка запису, позиції, сторінки та перебудови"""
+        self.store.replace(
+            {"id": user_id, "nickname": f"u{user_id}", "exp": user_id * 2}
+            for user_id in range(1, 6)
+        )
+        self.assertEqual(self.store.count(), 5)
+        self.assertEqual(self.store.position(5), 0)
+        self.assertEqual([entry["id"] for entry in self.store.page(1, 3)], [4, 3])
+
+        self.store.set({"id": 1, "nickname": "u1", "exp": 100})
+        self.assertEqual(self.store.position(1), 0)
+        # Рівний досвід: більший id вище, як у таблиці з бази
+        self.store.set({"id": 10, "nickname": "u10", "exp": 100})
+        self.assertEqual([entry["id"] for entry in self.store.page(0, 2)], [10, 1])
+        self.store.remove(10)
+        self.store.remove(1)
+        self.assertIsNone(self.store.position(1))
+
+        self.store.replace([])
+        self.assertEqual(self.store.count(), 0)